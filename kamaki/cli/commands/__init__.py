@@ -352,6 +352,12 @@ class _name_filter(object):
     def _filter_by_name(self, items):
         return self._non_exact_name_filter(self._exact_name_filter(items))
 
+    def _iter_filter_by_name(self, items):
+        """Filter an iterable of items lazily, one item at a time"""
+        for item in items:
+            if self._filter_by_name([item]):
+                yield item
+
 
 class _id_filter(object):
 
@@ -31,12 +31,14 @@
 # interpreted as representing official policies, either expressed
 # or implied, of GRNET S.A.command
 
-from time import localtime, strftime
+from time import localtime, strftime, time
+from itertools import chain, islice
 from io import StringIO
 from pydoc import pager
 from os import path, walk, makedirs
 
-from kamaki.clients.pithos import PithosClient, ClientError
+from kamaki.clients import ClientTimeout
+from kamaki.clients.pithos import PithosClient, ClientError, BlockHashCache
 
 from kamaki.cli import command
 from kamaki.cli.command_tree import CommandTree
@@ -75,6 +77,10 @@ class _pithos_init(_command_init):
     def _custom_uuid(self):
         return self.config.get_cloud(self.cloud, 'pithos_uuid')
 
+    @DontRaiseKeyError
+    def _hash_cache_dir(self):
+        return self.config.get('global', 'hash_cache_dir')
+
     def _set_account(self):
         self.account = self._custom_uuid()
         if self.account:
@@ -110,6 +116,9 @@ class _pithos_init(_command_init):
         self._set_account()
         self.client = PithosClient(
             self.base_url, self.token, self.account, self.container)
+        hash_cache_dir = self._hash_cache_dir()
+        if hash_cache_dir:
+            self.client.hash_cache = BlockHashCache(hash_cache_dir)
 
     def main(self):
         self._run()
@@ -125,10 +134,12 @@ class _pithos_account(_pithos_init):
         self.arguments['account'].account_client = auth_base
 
     def print_objects(self, object_list):
+        width = len(str(len(object_list))) if (
+            hasattr(object_list, '__len__')) else 0
         for index, obj in enumerate(object_list):
             pretty_obj = obj.copy()
             index += 1
-            empty_space = ' ' * (len(str(len(object_list))) - len(str(index)))
+            empty_space = ' ' * (width - len(str(index)))
             if 'subdir' in obj:
                 continue
             if self._is_dir(obj):
@@ -152,6 +163,59 @@ class _pithos_account(_pithos_init):
         return 'application/directory' in remote_dict.get(
             'content_type', remote_dict.get('content-type', ''))
 
+    def _delete_objects(self, prefix=None, until=None):
+        """Delete the objects of the container under prefix (all, if None)
+        many at a time, reporting progress and throughput. Objects are listed
+        page by page, so an interrupted deletion resumes if run again
+
+        :returns: (int) the number of deleted objects
+        """
+        self.client.MAX_THREADS = int(self['max_threads'] or 5)
+        failed, deleted, started = [], 0, time()
+        reported = started
+        objects = (o['name'] for o in self.client.iter_objects(prefix=prefix))
+        try:
+            for obj, error in self.client.delete_objects(objects, until=until):
+                if error:
+                    failed.append((obj, error))
+                    continue
+                deleted += 1
+                if time() - reported >= 1:
+                    reported = time()
+                    self.error('  deleted %s objects (%.1f objects/s)' % (
+                        deleted, deleted / (reported - started)))
+        except KeyboardInterrupt:
+            self.error('\nDeletion canceled by user, after %s objects' % (
+                deleted))
+            self.error('to resume, run again')
+            raise
+        elapsed = time() - started
+        self.error('Deleted %s objects in %.1fs (%.1f objects/s)' % (
+            deleted, elapsed, deleted / elapsed if elapsed else deleted))
+        if failed:
+            raise CLIError(
+                'Failed to delete %s objects' % len(failed),
+                importance=2, details=['%s: %s' % (
+                    obj, ('%s' % error).strip()) for obj, error in failed] + [
+                        'To retry, run again'])
+        return deleted
+
+    def _delete_at_once_or_bulk(self, delete, prefix=None, until=None):
+        """Run delete, a server side deletion of many objects, unless in bulk
+        mode. In bulk mode, or if delete times out, delete the objects under
+        prefix one by one (see _delete_objects)
+
+        :returns: (int) the number of objects deleted one by one, or None
+        """
+        if not self['bulk']:
+            try:
+                delete()
+                return None
+            except ClientTimeout as ct:
+                self.error('%s, deleting objects one by one' % (
+                    ('%s' % ct).strip()))
+        return self._delete_objects(prefix, until=until)
+
     def _run(self):
         super(_pithos_account, self)._run()
         self.client.account = self['account'] or getattr(
@@ -282,7 +346,9 @@ class file_list(_pithos_container, _optional_json, _name_filter):
         enum=FlagArgument('Enumerate results', '--enumerate'),
         recursive=FlagArgument(
             'Recursively list containers and their contents',
-            ('-R', '--recursive'))
+            ('-R', '--recursive')),
+        max_threads=IntArgument(
+            'max concurrent listings with -R (default: 5)', '--threads')
     )
 
     @errors.generic.all
@@ -290,23 +356,42 @@ class file_list(_pithos_container, _optional_json, _name_filter):
     @errors.pithos.container
     @errors.pithos.object_path
     def _run(self):
-        r = self.client.container_get(
-            limit=False if self['more'] else self['limit'],
-            marker=self['marker'],
-            prefix=self['name_pref'],
-            delimiter=self['delimiter'],
-            path=self.path or '',
+        kwargs = dict(
             show_only_shared=self['shared_by_me'],
             public=self['public'],
             if_modified_since=self['if_modified_since'],
             if_unmodified_since=self['if_unmodified_since'],
             until=self['until'],
             meta=self['meta'])
+        if self['recursive'] and not (self['marker'] or self['delimiter']):
+            #  List all the objects under path, sharded by subdirectory
+            self.client.MAX_THREADS = int(self['max_threads'] or 5)
+            path = (self.path or '').strip('/')
+            prefix = ('%s/' % path) if path else ''
+            if (self['name_pref'] or '').startswith(prefix):
+                #  Names are filtered by name_pref, ask only for those
+                prefix = self['name_pref']
+            objects = self.client.iter_objects_sharded(
+                prefix=prefix or None, **kwargs)
+            if self['limit']:
+                objects = islice(objects, self['limit'])
+        else:
+            objects = self.client.iter_objects(
+                limit=self['limit'],
+                marker=self['marker'],
+                prefix=self['name_pref'],
+                delimiter=self['delimiter'],
+                path=self.path or '',
+                **kwargs)
 
-        if not r.json:
+        try:
+            first = objects.next()
+        except StopIteration:
             self.error('Container "%s" is empty' % self.client.container)
-
-        files = self._filter_by_name(r.json)
+            return
+        files = self._iter_filter_by_name(chain([first], objects))
+        if self['json_output'] or self['output_format']:
+            files = list(files)
         if self['more']:
             outbu, self._out = self._out, StringIO()
         try:
@@ -475,9 +560,33 @@ class file_delete(_pithos_container):
         recursive=FlagArgument(
             'If a directory, empty first', ('-r', '--recursive')),
         delimiter=ValueArgument(
-            'delete objects prefixed with <object><delimiter>', '--delimiter')
+            'delete objects prefixed with <object><delimiter>', '--delimiter'),
+        bulk=FlagArgument(
+            'Delete the contents of a directory or container one by one, many '
+            'at a time, with progress (run again to resume). It is used '
+            'anyway if the server takes too long to delete them at once',
+            '--bulk'),
+        max_threads=IntArgument(
+            'max concurrent deletions with --bulk (default: 5)', '--threads')
     )
 
+    def _delete_path(self):
+        until = self['until_date']
+        delimiter = '/' if self['recursive'] else self['delimiter']
+        if not delimiter:
+            self.client.del_object(self.path, until=until)
+            return
+        deleted = self._delete_at_once_or_bulk(
+            lambda: self.client.del_object(
+                self.path, until=until, delimiter=delimiter),
+            '%s%s' % (self.path, delimiter), until=until)
+        if deleted is not None:
+            try:
+                self.client.del_object(self.path, until=until)
+            except ClientError as ce:
+                if not (ce.status in (404, ) and deleted):
+                    raise
+
     @errors.generic.all
     @errors.pithos.connection
     @errors.pithos.container
@@ -486,16 +595,16 @@ class file_delete(_pithos_container):
         if self.path:
             if self['yes'] or self.ask_user(
                     'Delete /%s/%s ?' % (self.container, self.path)):
-                self.client.del_object(
-                    self.path,
-                    until=self['until_date'],
-                    delimiter='/' if self['recursive'] else self['delimiter'])
+                self._delete_path()
             else:
                 self.error('Aborted')
         else:
             if self['yes'] or self.ask_user(
                     'Empty container /%s ?' % self.container):
-                self.client.container_delete(self.container, delimiter='/')
+                self._delete_at_once_or_bulk(
+                    lambda: self.client.container_delete(
+                        self.container, delimiter='/'),
+                    until=self['until_date'])
             else:
                 self.error('Aborted')
 
@@ -518,8 +627,13 @@ class _source_destination(_pithos_container, _optional_output_cmd):
             ('-r', '--recursive')),
         force=FlagArgument(
             'Overwrite destination objects, if needed', ('-f', '--force')),
+        resume=FlagArgument(
+            'Resume an interrupted transfer: destination objects identical '
+            'to their source are not copied again (moves replace them)',
+            '--resume'),
         source_version=ValueArgument(
-            'The version of the source object', '--source-version')
+            'The version of the source object', '--source-version'),
+        max_threads=IntArgument('default: 5', '--threads')
     )
 
     def __init__(self, arguments={}, auth_base=None, cloud=None):
@@ -547,55 +661,80 @@ class _source_destination(_pithos_container, _optional_output_cmd):
             self.error('  mkdir %s/%s/%s' % (
                 dst_prf, self.dst_client.container, dst))
 
-    @errors.generic.all
-    @errors.pithos.account
-    def _src_dst(self, version=None):
-        """Preconditions:
-        self.account, self.container, self.path
-        self.dst_acc, self.dst_con, self.dst_path
-        They should all be configured properly
-        :returns: [(src_path, dst_path), ...], if src_path is None, create
-            destination directory
+    def _dst_objects(self, prefix):
+        """:returns: (generator) of (name, is directory, hash) of destination
+            objects, in name order
         """
-        src_objects, dst_objects, pairs = dict(), dict(), []
         try:
-            for obj in self.dst_client.list_objects(
-                    prefix=self.dst_path or self.path or '/'):
-                dst_objects[obj['name']] = obj
+            for o in self.dst_client.iter_objects_sharded(prefix=prefix):
+                yield (o['name'], self._is_dir(o), o.get('hash'))
         except ClientError as ce:
             if ce.status in (404, ):
                 raise CLIError(
                     'Destination container pithos://%s/%s not found' % (
                         self.dst_client.account, self.dst_client.container))
             raise ce
+
+    def _exists_error(self, src_path, dst_path):
+        return CLIError(
+            'Destination object exists', importance=2, details=[
+                'Failed while transfering:',
+                '    pithos://%s/%s/%s' % (
+                        self.account,
+                        self.container,
+                        src_path),
+                '--> pithos://%s/%s/%s' % (
+                        self.dst_client.account,
+                        self.dst_client.container,
+                        dst_path),
+                'Use %s to transfer overwrite' % (
+                        self.arguments['force'].lvalue)])
+
+    @errors.generic.all
+    @errors.pithos.account
+    def _src_dst(self, version=None, skip_identical=False):
+        """Preconditions:
+        self.account, self.container, self.path
+        self.dst_acc, self.dst_con, self.dst_path
+        They should all be configured properly
+        Source objects are listed page by page, as pairs are consumed. Pairs
+        that cannot be transfered without overwriting are appended to
+        self.conflicts, instead. With resume, destination objects identical
+        to their source are not overwrites, and they are skipped if
+        skip_identical
+
+        :returns: (generator) of (src_path, dst_path), if src_path is None,
+            create destination directory, if dst_path is None, src_path is
+            a source directory
+        """
+        self.conflicts = []
         if self['source_prefix']:
             #  Copy and replace prefixes
-            for src_obj in self.client.list_objects(prefix=self.path):
-                src_objects[src_obj['name']] = src_obj
-            for src_path, src_obj in src_objects.items():
-                dst_path = '%s%s' % (
-                    self.dst_path or self.path, src_path[len(self.path):])
-                dst_obj = dst_objects.get(dst_path, None)
-                if self['force'] or not dst_obj:
+            src_prefix = self.path or ''
+            dst_prefix = self.dst_path or src_prefix
+            #  Both listings are in name order, so they are walked together
+            dst_objects = self._dst_objects(dst_prefix or None)
+            dst_obj = next(dst_objects, None)
+            for src_obj in self.client.iter_objects(prefix=self.path):
+                src_path = src_obj['name']
+                dst_path = '%s%s' % (dst_prefix, src_path[len(src_prefix):])
+                src_is_dir = self._is_dir(src_obj)
+                while dst_obj and dst_obj[0] < dst_path:
+                    dst_obj = next(dst_objects, None)
+                dst_is_dir, dst_hash = dst_obj[1:] if (
+                    dst_obj and dst_obj[0] == dst_path) else (None, None)
+                identical = self['resume'] and not (
+                    src_is_dir or dst_is_dir is not False) and (
+                        dst_hash == src_obj.get('hash'))
+                if identical and skip_identical:
+                    continue
+                if self['force'] or dst_is_dir is None or identical:
                     #  Just do it
-                    pairs.append((
-                        None if self._is_dir(src_obj) else src_path, dst_path))
-                    if self._is_dir(src_obj):
-                        pairs.append((self.path or dst_path, None))
-                elif not (self._is_dir(dst_obj) and self._is_dir(src_obj)):
-                    raise CLIError(
-                        'Destination object exists', importance=2, details=[
-                            'Failed while transfering:',
-                            '    pithos://%s/%s/%s' % (
-                                    self.account,
-                                    self.container,
-                                    src_path),
-                            '--> pithos://%s/%s/%s' % (
-                                    self.dst_client.account,
-                                    self.dst_client.container,
-                                    dst_path),
-                            'Use %s to transfer overwrite' % (
-                                    self.arguments['force'].lvalue)])
+                    yield (None if src_is_dir else src_path, dst_path)
+                    if src_is_dir:
+                        yield (src_path, None)
+                elif not (dst_is_dir and src_is_dir):
+                    self.conflicts.append((src_path, dst_path))
         else:
             #  One object transfer
             try:
@@ -612,12 +751,19 @@ class _source_destination(_pithos_container, _optional_output_cmd):
                                 self.arguments['source_prefix'].lvalue)])
                 raise
             dst_path = self.dst_path or self.path
-            dst_obj = dst_objects.get(dst_path or self.path, None)
-            if self['force'] or not dst_obj:
-                pairs.append(
-                    (None if self._is_dir(src_obj) else self.path, dst_path))
+            #  If dst_path exists, it is listed first under its own prefix
+            dst_obj = next(self._dst_objects(dst_path), None)
+            dst_obj = dst_obj[1:] if (
+                dst_obj and dst_obj[0] == dst_path) else None
+            identical = self['resume'] and dst_obj and not (
+                self._is_dir(src_obj) or dst_obj[0]) and (
+                    dst_obj[1] == src_obj.get('x-object-hash'))
+            if identical and skip_identical:
+                return
+            if self['force'] or not dst_obj or identical:
+                yield (None if self._is_dir(src_obj) else self.path, dst_path)
                 if self._is_dir(src_obj):
-                    pairs.append((self.path or dst_path, None))
+                    yield (self.path or dst_path, None)
             elif self._is_dir(src_obj):
                 raise CLIError(
                     'Cannot transfer an application/directory object',
@@ -632,21 +778,57 @@ class _source_destination(_pithos_container, _optional_output_cmd):
                         '  /file create  (general purpose)',
                         '  /file mkdir   (a directory object)'])
             else:
-                raise CLIError(
-                    'Destination object exists',
-                    importance=2, details=[
-                        'Failed while transfering:',
-                        '    pithos://%s/%s/%s' % (
-                                self.account,
-                                self.container,
-                                self.path),
-                        '--> pithos://%s/%s/%s' % (
-                                self.dst_client.account,
-                                self.dst_client.container,
-                                dst_path),
-                        'Use %s to transfer overwrite' % (
-                                self.arguments['force'].lvalue)])
-        return pairs
+                raise self._exists_error(self.path, dst_path)
+
+    def _transfer(self, transfer_name, **kwargs):
+        """Transfer the objects of _src_dst on the server side, many at a
+        time. Directories are created as they come. For moves, source
+        directories are deleted in the end, if all objects were moved.
+        Failures are collected and reported in the end"""
+        move, src_dirs, failed = transfer_name in ('move', ), [], []
+        self.dst_client.MAX_THREADS = int(self['max_threads'] or 5)
+
+        def pairs():
+            for src, dst in self._src_dst(
+                    kwargs.get('source_version'), skip_identical=not move):
+                if src and dst:
+                    yield (src, dst)
+                elif dst:
+                    self._report_transfer(src, dst, transfer_name)
+                    self.dst_client.create_directory(dst)
+                elif move:
+                    src_dirs.append(src)
+
+        for src, dst, error in self.dst_client.transfer_objects(
+                self.client.container, pairs(),
+                move=move, source_account=self.client.account, **kwargs):
+            if error:
+                failed.append((src, dst, error))
+            else:
+                self._report_transfer(src, dst, transfer_name)
+        if not (failed or self.conflicts):
+            for src in sorted(set(src_dirs), reverse=True):
+                self._report_transfer(src, None, transfer_name)
+                self.client.del_object(src)
+            return
+
+        details = ['Not transfered: %s' % len(failed + self.conflicts)]
+        for src, dst in self.conflicts:
+            details.append('%s --> %s: destination object exists' % (
+                src, dst))
+        for src, dst, error in failed:
+            details.append('%s --> %s: %s' % (
+                src, dst, ('%s' % error).strip()))
+        if self.conflicts:
+            details.append('To overwrite, use %s' % (
+                self.arguments['force'].lvalue))
+        details.append('To skip objects already transfered, use %s' % (
+            self.arguments['resume'].lvalue))
+        if len(failed + self.conflicts) == 1 and not failed:
+            raise self._exists_error(*self.conflicts[0])
+        raise CLIError(
+            'Failed to %s some objects' % transfer_name,
+            importance=2, details=details)
 
     def _run(self, source_path_or_url, destination_path_or_url=''):
         super(_source_destination, self)._run(source_path_or_url)
@@ -677,20 +859,11 @@ class file_copy(_source_destination):
     @errors.pithos.container
     @errors.pithos.account
     def _run(self):
-        for src, dst in self._src_dst(self['source_version']):
-            self._report_transfer(src, dst, 'copy')
-            if src and dst:
-                self.dst_client.copy_object(
-                    src_container=self.client.container,
-                    src_object=src,
-                    dst_container=self.dst_client.container,
-                    dst_object=dst,
-                    source_account=self.client.account,
-                    source_version=self['source_version'],
-                    public=self['public'],
-                    content_type=self['content_type'])
-            elif dst:
-                self.dst_client.create_directory(dst)
+        self._transfer(
+            'copy',
+            source_version=self['source_version'],
+            public=self['public'],
+            content_type=self['content_type'])
 
     def main(self, source_path_or_url, destination_path_or_url=None):
         super(file_copy, self)._run(
@@ -713,21 +886,10 @@ class file_move(_source_destination):
     @errors.pithos.container
     @errors.pithos.account
     def _run(self):
-        for src, dst in self._src_dst():
-            self._report_transfer(src, dst, 'move')
-            if src and dst:
-                self.dst_client.move_object(
-                    src_container=self.client.container,
-                    src_object=src,
-                    dst_container=self.dst_client.container,
-                    dst_object=dst,
-                    source_account=self.account,
-                    public=self['public'],
-                    content_type=self['content_type'])
-            elif dst:
-                self.dst_client.create_directory(dst)
-            else:
-                self.client.del_object(src)
+        self._transfer(
+            'move',
+            public=self['public'],
+            content_type=self['content_type'])
 
     def main(self, source_path_or_url, destination_path_or_url=None):
         super(file_move, self)._run(
@@ -870,6 +1032,13 @@ class file_upload(_pithos_container, _optional_output_cmd):
             'Confirm upload with a custom checksum (MD5)', '--etag'),
         use_hashes=FlagArgument(
             'Source file contains hashmap not data', '--source-is-hashmap'),
+        pipelined=FlagArgument(
+            'Hash and upload blocks in one pass (faster for large new files, '
+            'but blocks already on the server are uploaded again)',
+            '--pipelined'),
+        hash_processes=IntArgument(
+            'Calculate block hashes in parallel processes (default: 1)',
+            '--hash-processes'),
     )
 
     def _sharing(self):
@@ -934,7 +1103,7 @@ class file_upload(_pithos_container, _optional_output_cmd):
                         if ce.status not in (404, ):
                             raise
             self._check_container_limit(lpath)
-            prev = ''
+            prev, dirs, sources = '', [], []
             for top, subdirs, files in walk(lpath):
                 if top != prev:
                     prev = top
@@ -944,15 +1113,18 @@ class file_upload(_pithos_container, _optional_output_cmd):
                         rel_path = rpath
                     self.error('mkdir /%s/%s' % (
                         self.client.container, rel_path))
-                    self.client.create_directory(rel_path)
+                    dirs.append(rel_path)
                 for f in files:
                     fpath = path.join(top, f)
                     if path.isfile(fpath):
                         rel_path = rel_path.replace(path.sep, '/')
                         pathfix = f.replace(path.sep, '/')
-                        yield open(fpath, 'rb'), '%s/%s' % (rel_path, pathfix)
+                        sources.append((fpath, '%s/%s' % (rel_path, pathfix)))
                     else:
                         self.error('%s is not a regular file' % fpath)
+            self.client.create_directories(dirs)
+            for source in sources:
+                yield source
         else:
             if not path.isfile(lpath):
                 raise CLIError(('%s is not a regular file' % lpath) if (
@@ -971,57 +1143,84 @@ class file_upload(_pithos_container, _optional_output_cmd):
                 if ce.status not in (404, ):
                     raise
             self._check_container_limit(lpath)
-            yield open(lpath, 'rb'), rpath
+            yield lpath, rpath
 
     def _run(self, local_path, remote_path):
         self.client.MAX_THREADS = int(self['max_threads'] or 5)
+        self.client.PREWARM_CONNECTIONS = True
+        self.client.HASH_PROCESSES = int(self['hash_processes'] or 1)
         params = dict(
             content_encoding=self['content_encoding'],
             content_type=self['content_type'],
             content_disposition=self['content_disposition'],
             sharing=self._sharing(),
             public=self['public'])
-        uploaded, container_info_cache = list, dict()
+        uploaded, container_info_cache = list(), dict()
         rpref = 'pithos://%s' if self['account'] else ''
-        for f, rpath in self._src_dst(local_path, remote_path):
+        sources = []
+        for fpath, rpath in self._src_dst(local_path, remote_path):
             self.error('%s --> %s/%s/%s' % (
-                f.name, rpref, self.client.container, rpath))
+                fpath, rpref, self.client.container, rpath))
+            fparams = dict()
             if not (self['content_type'] and self['content_encoding']):
-                ctype, cenc = guess_mime_type(f.name)
-                params['content_type'] = self['content_type'] or ctype
-                params['content_encoding'] = self['content_encoding'] or cenc
-            if self['unchunked']:
-                r = self.client.upload_object_unchunked(
-                    rpath, f,
-                    etag=self['md5_checksum'], withHashFile=self['use_hashes'],
-                    **params)
+                ctype, cenc = guess_mime_type(fpath)
+                fparams['content_type'] = self['content_type'] or ctype
+                fparams['content_encoding'] = self['content_encoding'] or cenc
+            sources.append((fpath, rpath, fparams))
+        if self['unchunked']:
+            for fpath, rpath, fparams in sources:
+                with open(fpath, 'rb') as f:
+                    r = self.client.upload_object_unchunked(
+                        rpath, f,
+                        etag=self['md5_checksum'],
+                        withHashFile=self['use_hashes'],
+                        **dict(params, **fparams))
                 if self['with_output'] or self['json_output']:
                     r['name'] = '/%s/%s' % (self.client.container, rpath)
                     uploaded.append(r)
-            else:
-                try:
-                    (progress_bar, upload_cb) = self._safe_progress_bar(
-                        'Uploading %s' % f.name.split(path.sep)[-1])
-                    if progress_bar:
-                        hash_bar = progress_bar.clone()
-                        hash_cb = hash_bar.get_generator(
-                            'Calculating block hashes')
-                    else:
-                        hash_cb = None
+        elif len(sources) == 1:
+            fpath, rpath, fparams = sources[0]
+            progress_bar = None
+            try:
+                (progress_bar, upload_cb) = self._safe_progress_bar(
+                    'Uploading %s' % fpath.split(path.sep)[-1])
+                if progress_bar:
+                    hash_bar = progress_bar.clone()
+                    hash_cb = hash_bar.get_generator(
+                        'Calculating block hashes')
+                else:
+                    hash_cb = None
+                with open(fpath, 'rb') as f:
                     r = self.client.upload_object(
                         rpath, f,
                         hash_cb=hash_cb,
                         upload_cb=upload_cb,
                         container_info_cache=container_info_cache,
-                        **params)
-                    if self['with_output'] or self['json_output']:
-                        r['name'] = '/%s/%s' % (self.client.container, rpath)
-                        uploaded.append(r)
-                except Exception:
-                    self._safe_progress_bar_finish(progress_bar)
-                    raise
-                finally:
-                    self._safe_progress_bar_finish(progress_bar)
+                        pipelined=self['pipelined'],
+                        **dict(params, **fparams))
+                if self['with_output'] or self['json_output']:
+                    r['name'] = '/%s/%s' % (self.client.container, rpath)
+                    uploaded.append(r)
+            finally:
+                self._safe_progress_bar_finish(progress_bar)
+        elif sources:
+            #  Many files: upload them in parallel, with one progress bar
+            progress_bar = None
+            try:
+                (progress_bar, upload_cb) = self._safe_progress_bar(
+                    'Uploading %s files' % len(sources))
+                results = self.client.upload_objects(
+                    sources,
+                    upload_cb=upload_cb,
+                    container_info_cache=container_info_cache,
+                    pipelined=self['pipelined'],
+                    **params)
+            finally:
+                self._safe_progress_bar_finish(progress_bar)
+            if self['with_output'] or self['json_output']:
+                for (fpath, rpath, fparams), r in zip(sources, results):
+                    r['name'] = '/%s/%s' % (self.client.container, rpath)
+                    uploaded.append(r)
         self._optional_output(uploaded)
         self.error('Upload completed')
 
@@ -1081,7 +1280,8 @@ class file_cat(_pithos_container):
         if_unmodified_since=DateArgument(
             'show output unmodified since then', '--if-unmodified-since'),
         object_version=ValueArgument(
-            'Get contents of the chosen version', '--object-version')
+            'Get contents of the chosen version', '--object-version'),
+        max_threads=IntArgument('default: 5', '--threads')
     )
 
     @errors.generic.all
@@ -1089,6 +1289,7 @@ class file_cat(_pithos_container):
     @errors.pithos.container
     @errors.pithos.object_path
     def _run(self):
+        self.client.MAX_THREADS = int(self['max_threads'] or 5)
         self.client.download_object(
             self.path, self._out,
             range_str=self['range'],
@@ -1135,10 +1336,11 @@ class file_download(_pithos_container):
         )
 
     def _src_dst(self, local_path):
-        """Create a list of (src, dst) where src is a remote location and dst
-        is an open file descriptor. Directories are denoted as (None, dirpath)
-        and they are pretended to other objects in a very strict order (shorter
-        to longer path)."""
+        """Create a list of (src, dst, resume, size) where src is a remote
+        location and dst is a local path. Directories are denoted as
+        (None, dirpath, None, None) and they are pretended to other objects in
+        a very strict order (shorter to longer path). Object sizes are known
+        for recursive downloads only, otherwise they are None."""
         ret = []
         try:
             if self.path:
@@ -1179,11 +1381,11 @@ class file_download(_pithos_container):
                 obj = obj or dict(
                     name='', content_type='application/directory')
                 dirs, files = [obj, ], []
-                objects = self.client.container_get(
-                    path=self.path,
+                objects = self.client.iter_objects_sharded(
+                    prefix=('%s/' % rpath) if rpath else None,
                     if_modified_since=self['modified_since_date'],
                     if_unmodified_since=self['unmodified_since_date'])
-                for o in objects.json:
+                for o in objects:
                     (dirs if self._is_dir(o) else files).append(o)
 
                 #  Put the directories on top of the list
@@ -1198,10 +1400,11 @@ class file_download(_pithos_container):
                             details=[
                                 'Either remove the file or specify a'
                                 'different target location'])
-                    ret.append((None, dpath, None))
+                    ret.append((None, dpath, None, None))
 
                 #  Append the file objects
-                for opath in [o['name'] for o in files]:
+                for o in files:
+                    opath = o['name']
                     lpath = '%s%s' % (local_path, opath[len(rpath):])
                     if self['resume']:
                         fxists = path.exists(lpath)
@@ -1212,14 +1415,14 @@ class file_download(_pithos_container):
                                 details=[
                                     'Either remove the file or specify a'
                                     'different target location'])
-                        ret.append((opath, lpath, fxists))
+                        ret.append((opath, lpath, fxists, o.get('bytes')))
                     elif path.exists(lpath):
                         raise CLIError(
                             'Cannot overwrite %s' % lpath,
                             details=['To overwrite/resume, use  %s' % (
                                 self.arguments['resume'].lvalue)])
                     else:
-                        ret.append((opath, lpath, None))
+                        ret.append((opath, lpath, None, o.get('bytes')))
             elif self.path:
                 raise CLIError(
                     'Remote object /%s/%s is a directory' % (
@@ -1248,7 +1451,7 @@ class file_download(_pithos_container):
                 for d in dirs[:-1]:
                     pref += d
                     if not path.exists(pref):
-                        ret.append((None, d, None))
+                        ret.append((None, d, None, None))
                     elif not path.isdir(pref):
                         raise CLIError(
                             'Failed to use %s as a destination' % local_path,
@@ -1259,13 +1462,8 @@ class file_download(_pithos_container):
                                 'directories or non-existing names',
                                 'Either remove the file, or choose another '
                                 'destination'])
-            ret.append((rpath, local_path, self['resume']))
-        for r, l, resume in ret:
-            if r:
-                with open(l, 'rwb+' if resume else 'wb+') as f:
-                    yield (r, f)
-            else:
-                yield (r, l)
+            ret.append((rpath, local_path, self['resume'], None))
+        return ret
 
     @errors.generic.all
     @errors.pithos.connection
@@ -1275,42 +1473,43 @@ class file_download(_pithos_container):
     @errors.pithos.local_path_download
     def _run(self, local_path):
         self.client.MAX_THREADS = int(self['max_threads'] or 5)
+        self.client.PREWARM_CONNECTIONS = True
         progress_bar = None
+        kwargs = dict(
+            range_str=self['range'],
+            version=self['object_version'],
+            if_match=self['matching_etag'],
+            if_none_match=self['non_matching_etag'],
+            if_modified_since=self['modified_since_date'],
+            if_unmodified_since=self['unmodified_since_date'])
         try:
-            for rpath, output_file in self._src_dst(local_path):
+            targets = []
+            for rpath, lpath, resume, size in self._src_dst(local_path):
                 if not rpath:
-                    self.error('Create local directory %s' % output_file)
-                    makedirs(output_file)
+                    self.error('Create local directory %s' % lpath)
+                    makedirs(lpath)
                     continue
-                self.error('/%s/%s --> %s' % (
-                    self.container, rpath, output_file.name))
+                self.error('/%s/%s --> %s' % (self.container, rpath, lpath))
+                targets.append((rpath, lpath, resume, size))
+            if len(targets) == 1:
+                rpath, lpath, resume, size = targets[0]
                 progress_bar, download_cb = self._safe_progress_bar(
                     '  download')
-                self.client.download_object(
-                    rpath, output_file,
-                    download_cb=download_cb,
-                    range_str=self['range'],
-                    version=self['object_version'],
-                    if_match=self['matching_etag'],
-                    resume=self['resume'],
-                    if_none_match=self['non_matching_etag'],
-                    if_modified_since=self['modified_since_date'],
-                    if_unmodified_since=self['unmodified_since_date'])
+                with open(lpath, 'rwb+' if resume else 'wb+') as f:
+                    self.client.download_object(
+                        rpath, f,
+                        download_cb=download_cb, resume=self['resume'],
+                        **kwargs)
+            elif targets:
+                progress_bar, download_cb = self._safe_progress_bar(
+                    'Downloading %s files' % len(targets))
+                self.client.download_objects(
+                    targets, download_cb=download_cb, **kwargs)
         except KeyboardInterrupt:
-            from threading import activeCount, enumerate as activethreads
-            timeout = 0.5
-            while activeCount() > 1:
-                self._out.write('\nCancel %s threads: ' % (activeCount() - 1))
-                self._out.flush()
-                for thread in activethreads():
-                    try:
-                        thread.join(timeout)
-                        self._out.write('.' if thread.isAlive() else '*')
-                    except RuntimeError:
-                        continue
-                    finally:
-                        self._out.flush()
-                        timeout += 0.1
+            self._out.write('\nCancel %s pending transfers' % (
+                self.client.transfer_pool.pending))
+            self._out.flush()
+            self.client.transfer_pool.cancel()
             self.error('\nDownload canceled by user')
             if local_path is not None:
                 self.error('to resume, re-run with --resume')
@@ -1471,52 +1670,54 @@ class container_list(_pithos_account, _optional_json, _name_filter):
                         cname, size, container['count']))
                 else:
                     self.writeln(cname)
-            objects = container.get('objects', [])
+            objects = container.get('objects', None)
+            if objects is None and self['recursive']:
+                objects = self._iter_container_objects(container['name'])
+                try:
+                    objects = chain([objects.next()], objects)
+                except StopIteration:
+                    objects = None
             if objects:
                 self.print_objects(objects)
                 self.writeln('')
 
-    def _create_object_forest(self, container_list):
+    def _iter_container_objects(self, container):
         try:
-            for container in container_list:
-                self.client.container = container['name']
-                objects = self.client.container_get(
-                    limit=False if self['more'] else self['limit'],
-                    if_modified_since=self['modified_since_date'],
-                    if_unmodified_since=self['unmodified_since_date'],
-                    until=self['until_date'],
-                    show_only_shared=self['shared_by_me'],
-                    public=self['public'])
-                container['objects'] = objects.json
+            self.client.container = container
+            return self.client.iter_objects(
+                limit=self['limit'],
+                if_modified_since=self['modified_since_date'],
+                if_unmodified_since=self['unmodified_since_date'],
+                until=self['until_date'],
+                show_only_shared=self['shared_by_me'],
+                public=self['public'])
         finally:
             self.client.container = None
 
+    def _create_object_forest(self, container_list):
+        for container in container_list:
+            container['objects'] = list(
+                self._iter_container_objects(container['name']))
+
     @errors.generic.all
     @errors.pithos.connection
     @errors.pithos.object_path
     @errors.pithos.container
     def _run(self, container):
-        if container:
-            r = self.client.container_get(
-                limit=False if self['more'] else self['limit'],
-                marker=self['marker'],
-                if_modified_since=self['modified_since_date'],
-                if_unmodified_since=self['unmodified_since_date'],
-                until=self['until_date'],
-                show_only_shared=self['shared_by_me'],
-                public=self['public'])
-        else:
-            r = self.client.account_get(
-                limit=False if self['more'] else self['limit'],
-                marker=self['marker'],
-                if_modified_since=self['modified_since_date'],
-                if_unmodified_since=self['unmodified_since_date'],
-                until=self['until_date'],
-                show_only_shared=self['shared_by_me'],
-                public=self['public'])
-        files = self._filter_by_name(r.json)
-        if self['recursive'] and not container:
-            self._create_object_forest(files)
+        listing = self.client.iter_objects if (
+            container) else self.client.iter_containers
+        files = self._iter_filter_by_name(listing(
+            limit=self['limit'],
+            marker=self['marker'],
+            if_modified_since=self['modified_since_date'],
+            if_unmodified_since=self['unmodified_since_date'],
+            until=self['until_date'],
+            show_only_shared=self['shared_by_me'],
+            public=self['public']))
+        if self['json_output'] or self['output_format']:
+            files = list(files)
+            if self['recursive'] and not container:
+                self._create_object_forest(files)
         if self['more']:
             outbu, self._out = self._out, StringIO()
         try:
@@ -1578,7 +1779,14 @@ class container_delete(_pithos_account):
     arguments = dict(
         yes=FlagArgument('Do not prompt for permission', '--yes'),
         recursive=FlagArgument(
-            'delete container even if not empty', ('-r', '--recursive'))
+            'delete container even if not empty', ('-r', '--recursive')),
+        bulk=FlagArgument(
+            'Delete the objects one by one, many at a time, with progress '
+            '(run again to resume). It is used anyway if the server takes '
+            'too long to delete them at once',
+            '--bulk'),
+        max_threads=IntArgument(
+            'max concurrent deletions with --bulk (default: 5)', '--threads')
     )
 
     @errors.generic.all
@@ -1596,7 +1804,8 @@ class container_delete(_pithos_account):
                     self.arguments['recursive'].lvalue)])
         if self['yes'] or self.ask_user(msg):
             if num_of_contents:
-                self.client.del_container(delimiter=delimiter)
+                self._delete_at_once_or_bulk(
+                    lambda: self.client.del_container(delimiter=delimiter))
             self.client.purge_container()
 
     def main(self, container):
@@ -1609,14 +1818,24 @@ class container_delete(_pithos_account):
 class container_empty(_pithos_account):
     """Empty a container"""
 
-    arguments = dict(yes=FlagArgument('Do not prompt for permission', '--yes'))
+    arguments = dict(
+        yes=FlagArgument('Do not prompt for permission', '--yes'),
+        bulk=FlagArgument(
+            'Delete the objects one by one, many at a time, with progress '
+            '(run again to resume). It is used anyway if the server takes '
+            'too long to delete them at once',
+            '--bulk'),
+        max_threads=IntArgument(
+            'max concurrent deletions with --bulk (default: 5)', '--threads')
+    )
 
     @errors.generic.all
     @errors.pithos.connection
     @errors.pithos.container
     def _run(self, container):
         if self['yes'] or self.ask_user('Empty container %s ?' % container):
-            self.client.del_container(delimiter='/')
+            self._delete_at_once_or_bulk(
+                lambda: self.client.del_container(delimiter='/'))
 
     def main(self, container):
         super(self.__class__, self)._run()
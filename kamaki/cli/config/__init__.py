@@ -79,6 +79,7 @@ DEFAULTS = {
         'log_pid': 'off',
         'history_file': HISTORY_PATH,
         'history_limit': 0,
+        'hash_cache_dir': os.path.expanduser('~/.kamaki.hashes'),
         'user_cli': 'astakos',
         'quota_cli': 'astakos',
         'resource_cli': 'astakos',
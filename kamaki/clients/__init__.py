@@ -33,18 +33,25 @@
 
 from urllib2 import quote, unquote
 from urlparse import urlparse
-from threading import Thread
+from threading import Thread, Event, Condition, Lock, current_thread
+from Queue import Queue, Empty
 from json import dumps, loads
+from os import fstat
+from stat import S_ISREG
 from time import time
-from httplib import ResponseNotReady, HTTPException
+from httplib import HTTPException, HTTPConnection, BadStatusLine
+from socket import timeout as SocketTimeout
+from select import select
 from time import sleep
-from random import random
 from logging import getLogger
 
-from objpool.http import PooledHTTPConnection
+from objpool import PoolLimitError
+from objpool.http import PooledHTTPConnection, HTTPConnectionPool
 
+from kamaki.clients.utils import iter_json_list
 
-TIMEOUT = 60.0   # seconds
+
+TIMEOUT = 60.0   # seconds, the default connect and read timeout
 HTTP_METHODS = ['GET', 'POST', 'PUT', 'HEAD', 'DELETE', 'COPY', 'MOVE']
 
 log = getLogger(__name__)
@@ -58,6 +65,38 @@ def _encode(v):
     return v
 
 
+def _is_string(data):
+    return isinstance(data, (basestring, buffer, bytearray))
+
+
+def _body_size(data):
+    """:returns: (int) the size of a request body (for file-like bodies, the
+        bytes left to read) or None if it is not known before it is read,
+        e.g., for pipes and iterators
+    """
+    if data is None:
+        return 0
+    if _is_string(data):
+        return len(data)
+    try:
+        if hasattr(data, 'getvalue'):
+            return len(data.getvalue()) - data.tell()
+        st = fstat(data.fileno())
+        if S_ISREG(st.st_mode):
+            return st.st_size - data.tell()
+    except (AttributeError, IOError, OSError, ValueError):
+        pass
+    return None
+
+
+def _get_header(headers, name, default=None):
+    """Case-insensitive header lookup"""
+    for k, v in headers.items():
+        if k.lower() == name:
+            return v
+    return default
+
+
 class ClientError(Exception):
     def __init__(self, message, status=0, details=None):
         log.debug('ClientError: msg[%s], sts[%s], dtl[%s]' % (
@@ -96,6 +135,22 @@ class ClientError(Exception):
             self.details = details if details else []
 
 
+class ClientTimeout(ClientError):
+    """A request took too long"""
+
+
+class ConnectTimeout(ClientTimeout):
+    """Failed to connect to the server in time"""
+
+
+class ReadTimeout(ClientTimeout):
+    """The server stopped sending or receiving data for too long"""
+
+
+class RequestTimeout(ClientTimeout):
+    """The request was not completed in the total time allowed"""
+
+
 class Logged(object):
 
     LOG_TOKEN = False
@@ -107,6 +162,9 @@ class Logged(object):
 class RequestManager(Logged):
     """Handle http request information"""
 
+    CHUNK_SIZE = 65536  # bytes, the read size of streamed request bodies
+    STREAM_RETRIES = 3  # resends of streamed requests on empty status lines
+
     def _connection_info(self, url, path, params={}):
         """ Set self.url to scheme://netloc/?params
         :param url: (str or unicode) The service url
@@ -135,14 +193,39 @@ class RequestManager(Logged):
 
     def __init__(
             self, method, url, path,
-            data=None, headers={}, params={}):
+            data=None, headers={}, params={},
+            connect_timeout=TIMEOUT, read_timeout=TIMEOUT,
+            total_timeout=None):
+        """
+        :param data: (str, buffer, file-like object or iterator of str) the
+            request body. File-like and iterator bodies are streamed
+
+        :param connect_timeout: (float) seconds to wait for a connection
+
+        :param read_timeout: (float) seconds to wait for the server on each
+            socket operation, after connecting
+
+        :param total_timeout: (float) seconds for the whole request and
+            response, or None for no limit
+        """
         method = method.upper()
         assert method in HTTP_METHODS, 'Invalid http method %s' % method
         if headers:
             assert isinstance(headers, dict)
         self.headers = dict(headers)
         self.method, self.data = method, data
+        self.data_size = _body_size(data)
+        self._data_start = None
+        if data is not None and not _is_string(data):
+            try:
+                self._data_start = data.tell()
+            except (AttributeError, IOError, ValueError):
+                pass
         self.scheme, self.netloc = self._connection_info(url, path, params)
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.total_timeout = total_timeout
+        self._deadline = None
 
     def dump_log(self):
         plog = ('\t[%s]' % self) if self.LOG_PID else ''
@@ -153,11 +236,15 @@ class RequestManager(Logged):
             if key.lower() in ('x-auth-token', ) and not self.LOG_TOKEN:
                 self._token, val = val, '...'
             sendlog.info('  %s: %s%s' % (key, val, plog))
-        if self.data:
+        if self.data and not _is_string(self.data):
+            sendlog.info('data size: %s (streamed)%s' % (
+                self.data_size, plog))
+        elif self.data:
             sendlog.info('data size: %s%s' % (len(self.data), plog))
             if self.LOG_DATA:
-                sendlog.info(self.data.replace(self._token, '...') if (
-                    self._token) else self.data)
+                data = str(self.data)
+                sendlog.info(data.replace(self._token, '...') if (
+                    self._token) else data)
         else:
             sendlog.info('data size: 0%s' % plog)
 
@@ -167,75 +254,370 @@ class RequestManager(Logged):
             headers[k] = quote(v)
         self.headers = headers
 
+    def iter_body(self):
+        """Iterate over the request body, in chunks of up to CHUNK_SIZE bytes
+        for file-like bodies. Those are rewound first, if possible, so that
+        the request can be retried, and they are not read past the
+        Content-Length header, if set
+        """
+        data = self.data
+        if not data:
+            return
+        if _is_string(data):
+            yield data
+            return
+        if not hasattr(data, 'read'):
+            for chunk in data:
+                yield chunk
+            return
+        if self._data_start is not None:
+            data.seek(self._data_start)
+        left = _get_header(self.headers, 'content-length')
+        left = None if left is None else int(left)
+        while left is None or left > 0:
+            chunk = data.read(
+                self.CHUNK_SIZE if left is None else min(
+                    self.CHUNK_SIZE, left))
+            if not chunk:
+                break
+            if left is not None:
+                left -= len(chunk)
+            yield chunk
+
+    def _send_streamed(self, conn):
+        """Send the headers and then the body, chunk by chunk. If the
+        Transfer-Encoding is chunked, so is the body
+        """
+        lowered = [k.lower() for k in self.headers]
+        conn.putrequest(
+            str(self.method.upper()), str(self.path),
+            skip_host='host' in lowered,
+            skip_accept_encoding='accept-encoding' in lowered)
+        for k, v in self.headers.items():
+            conn.putheader(k, v)
+        conn.endheaders()
+        chunked = _get_header(
+            self.headers, 'transfer-encoding', '').lower() == 'chunked'
+        sent = 0
+        for chunk in self.iter_body():
+            if not chunk:
+                continue
+            self.set_timeout(conn)
+            if chunked:
+                conn.send('%x\r\n' % len(chunk))
+            conn.send(chunk)
+            if chunked:
+                conn.send('\r\n')
+            sent += len(chunk)
+        if chunked:
+            conn.send('0\r\n\r\n')
+        self.data_size = sent
+
+    def set_timeout(self, conn):
+        """Set the socket timeout of conn to the read timeout, or to the time
+        left until the total timeout, if that is shorter
+
+        :raises RequestTimeout: if there is no time left
+        """
+        timeout = self.read_timeout
+        if self._deadline is not None:
+            left = self._deadline - time()
+            if left <= 0:
+                raise self.timeout_error()
+            timeout = min(timeout, left) if timeout else left
+        if conn.sock:
+            conn.sock.settimeout(timeout)
+
+    def timeout_error(self, connecting=False):
+        """:returns: (ClientTimeout) the error for a timed out socket"""
+        plog = ('\t[%s]' % self) if self.LOG_PID else ''
+        recvlog.debug('Kamaki Timeout %s %s%s' % (
+            self.method, self.path, plog))
+        if self._deadline is not None and time() >= self._deadline:
+            return RequestTimeout(
+                'Request to %s not completed in %s seconds' % (
+                    self.netloc, self.total_timeout))
+        if connecting:
+            return ConnectTimeout('Connection to %s timed out after %s s' % (
+                self.netloc, self.connect_timeout))
+        return ReadTimeout('No data from %s for %s seconds' % (
+            self.netloc, self.read_timeout))
+
+    def _connect(self, conn):
+        if conn.sock is None:
+            conn.timeout = self.connect_timeout
+            if self._deadline is not None:
+                conn.timeout = min(
+                    conn.timeout or self.total_timeout, self.total_timeout)
+            try:
+                conn.connect()
+            except SocketTimeout:
+                raise self.timeout_error(connecting=True)
+
+    def _get_streamed_response(self, conn):
+        """Get the response of a request sent by _send_streamed
+
+        On an empty status line (the server closed a kept-alive connection),
+        objpool resends the last request made with conn.request, which is
+        not this one. So, the unpatched getresponse is called and the request
+        is resent here, if its body can be rewound
+        """
+        retries = self.STREAM_RETRIES
+        while True:
+            self.set_timeout(conn)
+            try:
+                return HTTPConnection.getresponse(conn)
+            except BadStatusLine as bsl:
+                rewindable = self._data_start is not None or not hasattr(
+                    self.data, 'read') and not hasattr(self.data, 'next')
+                if not (retries and rewindable and bsl.line == "''"):
+                    raise
+            retries -= 1
+            recvlog.debug('Empty status line, resending %s %s' % (
+                self.method, self.path))
+            conn.close()
+            self._connect(conn)
+            self.set_timeout(conn)
+            self._send_streamed(conn)
+
     def perform(self, conn):
         """
         :param conn: (httplib connection object)
 
         :returns: (HTTPResponse)
+
+        :raises ClientTimeout: ConnectTimeout, ReadTimeout or RequestTimeout
         """
         self._encode_headers()
         self.dump_log()
-        conn.request(
-            method=str(self.method.upper()),
-            url=str(self.path),
-            headers=self.headers,
-            body=self.data)
-        sendlog.info('')
-        keep_trying = TIMEOUT
-        while keep_trying > 0:
-            try:
-                return conn.getresponse()
-            except ResponseNotReady:
-                wait = 0.03 * random()
-                sleep(wait)
-                keep_trying -= wait
-        plog = ('\t[%s]' % self) if self.LOG_PID else ''
-        logmsg = 'Kamaki Timeout %s %s%s' % (self.method, self.path, plog)
-        recvlog.debug(logmsg)
-        raise ClientError('HTTPResponse takes too long - kamaki timeout')
+        if self.total_timeout:
+            self._deadline = time() + self.total_timeout
+        self._connect(conn)
+        try:
+            self.set_timeout(conn)
+            if self.data and not _is_string(self.data):
+                self._send_streamed(conn)
+                sendlog.info('')
+                return self._get_streamed_response(conn)
+            conn.request(
+                method=str(self.method.upper()),
+                url=str(self.path),
+                headers=self.headers,
+                body=self.data)
+            sendlog.info('')
+            self.set_timeout(conn)
+            return conn.getresponse()
+        except SocketTimeout:
+            raise self.timeout_error()
+
+
+class ConnectionPool(HTTPConnectionPool):
+    """A pool of persistent HTTP(S) connections to an endpoint
+
+    hits: requests served by an already open, pooled connection
+    misses: requests that had to open a connection
+    created: connections created, including pre-warmed ones
+    """
+
+    def __init__(self, scheme, netloc, size):
+        super(ConnectionPool, self).__init__(scheme, netloc, size=size)
+        self._lock = Lock()
+        self._idle = set()
+        self.hits, self.misses, self.created = 0, 0, 0
+
+    def _stale(self, conns):
+        """:returns: (list) the conns closed by the server (see verify)"""
+        socks = dict([(conn.sock, conn) for conn in conns if conn.sock])
+        if not socks:
+            return []
+        return [socks[sock] for sock in select(socks.keys(), (), (), 0)[0]]
+
+    def pool_get(self, *args, **kwargs):
+        conn = super(ConnectionPool, self).pool_get(*args, **kwargs)
+        if conn is not None:
+            with self._lock:
+                if not getattr(conn, '_kamaki_pooled', False):
+                    conn._kamaki_pooled = True
+                    self.created += 1
+                if conn.sock:
+                    self.hits += 1
+                else:
+                    self.misses += 1
+                    #  Connections dropped by the pool as stale, on the way
+                    self._idle.difference_update(self._stale(self._idle))
+                self._idle.discard(conn)
+        return conn
+
+    def pool_put(self, conn):
+        if conn is not None and conn.sock:
+            with self._lock:
+                self._idle.add(conn)
+        super(ConnectionPool, self).pool_put(conn)
+        if conn is not None and not conn.sock:
+            #  Closed by the pool, not to be reused
+            with self._lock:
+                self._idle.discard(conn)
+
+    @property
+    def idle(self):
+        """:returns: (int) the number of open connections in the pool"""
+        with self._lock:
+            self._idle.difference_update(self._stale(self._idle))
+            return len(self._idle)
+
+    def resize(self, size):
+        """Raise the limit of connections in use to size. Pools never shrink,
+        because connections in use may exceed the new limit"""
+        with self._lock:
+            grow, self.size = max(0, size - self.size), max(self.size, size)
+        for i in range(grow):
+            #  Releases an allocation, without putting a connection
+            self.pool_put(None)
+
+    def prewarm(self, n, timeout=None):
+        """Connect in parallel, until there are n connections in the pool
+        Connections that fail are dropped silently, since the requests to
+        follow will fail with a proper error. Connections in use count
+        towards n, so it is never exceeded
+
+        :param timeout: (float) seconds to wait for each connection
+
+        :returns: (int) the number of connections opened
+        """
+        allocated = []
+        try:
+            for i in range(min(n, self.size)):
+                allocated.append(super(ConnectionPool, self).pool_get(
+                    blocking=False, create=False))
+        except PoolLimitError:
+            pass
+        pooled = [conn for conn in allocated if conn is not None]
+        conns = [self.pool_create_free() for i in range(
+            len(allocated) - len(pooled))]
+        for conn in conns:
+            conn._kamaki_pooled, conn.timeout = True, timeout
+        threads = [SilentEvent(conn.connect) for conn in conns]
+        for thread in threads:
+            thread.start()
+        opened = []
+        for conn, thread in zip(conns, threads):
+            thread.join()
+            if thread.exception:
+                log.debug('Failed to pre-warm a connection to %s: %s' % (
+                    self.netloc, thread.exception))
+                conn.close()
+                self.pool_put(None)
+            else:
+                opened.append(conn)
+        with self._lock:
+            self.created += len(conns)
+        for conn in pooled + opened:
+            self.pool_put(conn)
+        return len(opened)
+
+
+class ConnectionPools(object):
+    """The connection pools of all endpoints, one per (scheme, netloc)
+
+    Pools are sized by the concurrency of the clients that use them (see
+    Client.poolsize and MAX_THREADS). They are never smaller than MIN_SIZE,
+    so that a few background requests (e.g., listing prefetch) of serial
+    clients do not wait for a connection.
+    """
+
+    MIN_SIZE = 4
+
+    def __init__(self):
+        self._pools = dict()
+        self._lock = Lock()
+
+    def get(self, scheme, netloc, size=None):
+        """:returns: (ConnectionPool) for scheme://netloc, at least size big"""
+        size = max(size or 0, self.MIN_SIZE)
+        with self._lock:
+            pool = self._pools.get((scheme, netloc))
+            if pool is None:
+                pool = ConnectionPool(scheme, netloc, size)
+                self._pools[(scheme, netloc)] = pool
+        pool.resize(size)
+        return pool
+
+    def stats(self):
+        """
+        :returns: (dict) {(scheme, netloc): {
+            size: .., idle: .., created: .., hits: .., misses: ..}, ...}
+        """
+        with self._lock:
+            pools = self._pools.items()
+        return dict([(key, dict(
+            size=pool.size,
+            idle=pool.idle,
+            created=pool.created,
+            hits=pool.hits,
+            misses=pool.misses)) for key, pool in pools])
+
+
+connection_pools = ConnectionPools()
 
 
 class ResponseManager(Logged):
     """Manage the http request and handle the response data, headers, etc."""
 
-    def __init__(self, request, poolsize=None, connection_retry_limit=0):
+    def __init__(
+            self, request, poolsize=None, connection_retry_limit=0,
+            stream=False):
         """
         :param request: (RequestManager)
 
-        :param poolsize: (int) the size of the connection pool
+        :param poolsize: (int) the minimum size of the connection pool of the
+            request endpoint (see ConnectionPools)
 
         :param connection_retry_limit: (int)
+
+        :param stream: (bool) do not read the response body along with the
+            headers. Consume it with iter_content or readinto, or else it is
+            read on the first access of content, text or json. A stream
+            keeps its connection until it is consumed or closed
         """
         self.CONNECTION_TRY_LIMIT = 1 + connection_retry_limit
         self.request = request
         self._request_performed = False
         self.poolsize = poolsize
+        self.stream = stream
+        self._stream = None
+        self._offset = 0
+        self._json = None
+        #  Called with the streamed body size, when the stream is closed
+        self.on_close = None
+        self._received = 0
 
     def _get_response(self):
         if self._request_performed:
             return
 
-        pool_kw = dict(size=self.poolsize) if self.poolsize else dict()
+        pool = connection_pools.get(
+            self.request.scheme, self.request.netloc, self.poolsize)
         for retries in range(1, self.CONNECTION_TRY_LIMIT + 1):
             try:
-                with PooledHTTPConnection(
-                        self.request.netloc, self.request.scheme,
-                        **pool_kw) as connection:
+                pooled = PooledHTTPConnection(
+                    self.request.netloc, self.request.scheme, pool=pool)
+                connection = pooled.acquire()
+                try:
                     self.request.LOG_TOKEN = self.LOG_TOKEN
                     self.request.LOG_DATA = self.LOG_DATA
                     self.request.LOG_PID = self.LOG_PID
                     r = self.request.perform(connection)
-                    plog = ''
+                    self._plog = ''
                     if self.LOG_PID:
                         recvlog.info('\n%s <-- %s <-- [req: %s]\n' % (
                             self, r, self.request))
-                        plog = '\t[%s]' % self
+                        self._plog = '\t[%s]' % self
                     self._request_performed = True
                     self._status_code, self._status = r.status, unquote(
                         r.reason)
                     recvlog.info(
                         '%d %s%s' % (
-                            self.status_code, self.status, plog))
+                            self.status_code, self.status, self._plog))
                     self._headers = dict()
                     for k, v in r.getheaders():
                         if k.lower in ('x-auth-token', ) and (
@@ -243,16 +625,26 @@ class ResponseManager(Logged):
                             self._token, v = v, '...'
                         v = unquote(v).decode('utf-8')
                         self._headers[k] = v
-                        recvlog.info('  %s: %s%s' % (k, v, plog))
-                    self._content = r.read()
-                    recvlog.info('data size: %s%s' % (
-                        len(self._content) if self._content else 0, plog))
-                    if self.LOG_DATA and self._content:
-                        data = '%s%s' % (self._content, plog)
-                        if self._token:
-                            data = data.replace(self._token, '...')
-                        recvlog.info(data)
-                    recvlog.info('-             -        -     -   -  - -')
+                        recvlog.info('  %s: %s%s' % (k, v, self._plog))
+                    if self.stream:
+                        self._content = None
+                        self._stream = (r, connection, pooled)
+                        pooled = None
+                        recvlog.info('data size: (streamed)%s' % self._plog)
+                    else:
+                        try:
+                            self.request.set_timeout(connection)
+                            self._content = r.read()
+                        except SocketTimeout:
+                            raise self.request.timeout_error()
+                        self._log_content()
+                except Exception:
+                    if pooled:
+                        connection.close()
+                    raise
+                finally:
+                    if pooled:
+                        pooled.release()
                 break
             except Exception as err:
                 if isinstance(err, HTTPException):
@@ -269,6 +661,94 @@ class ResponseManager(Logged):
                         'Failed while http-connecting to %s (%s)' % (
                             self.request.url, err))
 
+    def _log_content(self):
+        recvlog.info('data size: %s%s' % (
+            len(self._content) if self._content else 0, self._plog))
+        if self.LOG_DATA and self._content:
+            data = '%s%s' % (self._content, self._plog)
+            if self._token:
+                data = data.replace(self._token, '...')
+            recvlog.info(data)
+        recvlog.info('-             -        -     -   -  - -')
+
+    def _read_stream(self, size):
+        r, connection = self._stream[:2]
+        try:
+            self.request.set_timeout(connection)
+            data = r.read(size)
+            self._received += len(data)
+            return data
+        except SocketTimeout:
+            raise self.request.timeout_error()
+
+    def iter_content(self, chunk_size=65536):
+        """Iterate over the response body. A streamed body is received from
+        the network as it is consumed, chunk_size bytes at a time
+
+        :returns: (generator) of str chunks
+        """
+        self._get_response()
+        if self._stream is None:
+            if self._content:
+                yield self._content
+            return
+        try:
+            while True:
+                chunk = self._read_stream(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            self.close()
+
+    def readinto(self, buf):
+        """Read the next part of the response body into a writable buffer
+        (e.g., a bytearray or a memoryview). A streamed body is received as
+        it is consumed, up to len(buf) bytes at a time, and copied into buf
+
+        :returns: (int) the number of bytes read, 0 at the end of the body
+        """
+        self._get_response()
+        view = memoryview(buf)
+        if self._stream is None:
+            content = self._content or ''
+            n = min(len(view), len(content) - self._offset)
+            view[:n] = content[self._offset:self._offset + n]
+            self._offset += n
+            return n
+        r = self._stream[0]
+        size = len(view) if r.length is None else min(len(view), r.length)
+        if not size:
+            self.close()
+            return 0
+        data = self._read_stream(size)
+        n = len(data)
+        view[:n] = data
+        if not n and r.length:
+            self.close()
+            raise ClientError(
+                'Incomplete response body from %s (%s more bytes)' % (
+                    self.request.url, r.length))
+        if not n or r.length == 0 or r.isclosed():
+            self.close()
+        return n
+
+    def close(self):
+        """Release the connection of a streamed response. If the body is not
+        fully read, the connection is closed instead of reused
+        """
+        if self._stream:
+            r, connection, pooled = self._stream
+            self._stream = None
+            complete = r.isclosed() or r.length == 0
+            r.close()
+            if not complete:
+                connection.close()
+            pooled.release()
+        on_close, self.on_close = self.on_close, None
+        if on_close:
+            on_close(self._received)
+
     @property
     def status_code(self):
         self._get_response()
@@ -287,6 +767,9 @@ class ResponseManager(Logged):
     @property
     def content(self):
         self._get_response()
+        if self._stream:
+            self._content = ''.join(self.iter_content())
+            self._log_content()
         return self._content
 
     @property
@@ -294,17 +777,32 @@ class ResponseManager(Logged):
         """
         :returns: (str) content
         """
-        self._get_response()
-        return '%s' % self._content
+        return '%s' % self.content
 
     @property
     def json(self):
         """
-        :returns: (dict) squeezed from json-formated content
+        :returns: (dict) squeezed from json-formated content, decoded once
         """
-        self._get_response()
+        content = self.content
+        if self._json is None or self._json[0] is not content:
+            try:
+                self._json = (content, loads(content))
+            except ValueError as err:
+                raise ClientError('Response not formated in JSON - %s' % err)
+        return self._json[1]
+
+    def iter_json(self, chunk_size=65536):
+        """Decode a json list body incrementally. The elements of a streamed
+        (stream=True) list are yielded as soon as they arrive
+
+        :returns: (generator) the list elements
+        """
+        if self.status_code == 204:
+            return
         try:
-            return loads(self._content)
+            for item in iter_json_list(self.iter_content(chunk_size)):
+                yield item
         except ValueError as err:
             raise ClientError('Response not formated in JSON - %s' % err)
 
@@ -337,46 +835,323 @@ class SilentEvent(Thread):
             self._exception = e
 
 
+class QueuedEvent(object):
+    """method(*args, **kwargs) to be run by a TransferPool worker
+    It exposes the same interface as SilentEvent (value, exception, join,
+    isAlive), so that callers can treat both the same way
+    """
+
+    def __init__(self, method, *args, **kwargs):
+        self.method = method
+        self.args = args
+        self.kwargs = kwargs
+        self._done = Event()
+
+    @property
+    def exception(self):
+        return getattr(self, '_exception', False)
+
+    @property
+    def value(self):
+        return getattr(self, '_value', None)
+
+    def isAlive(self):
+        return not self._done.is_set()
+
+    is_alive = isAlive
+
+    def join(self, timeout=None):
+        """Wait for the job to run. Poll, so that KeyboardInterrupt gets in"""
+        while not self._done.is_set():
+            self._done.wait(0.1 if timeout is None else timeout)
+            if timeout is not None:
+                break
+
+    def cancel(self):
+        if not self._done.is_set():
+            self._exception = ClientError('Transfer canceled')
+            self._done.set()
+
+    def run(self):
+        try:
+            if not self._done.is_set():
+                self._value = self.method(*(self.args), **(self.kwargs))
+        except Exception as e:
+            recvlog.debug('Job %s got exception %s\n<%s %s' % (
+                self,
+                type(e),
+                e.status if isinstance(e, ClientError) else '',
+                e))
+            self._exception = e
+        finally:
+            self._done.set()
+
+
+class TransferPool(object):
+    """A bounded pool of persistent worker threads, fed by a job queue
+
+    Workers pull the next job as soon as they are done with the previous one,
+    so there are always up to "size" jobs running. Submitting blocks while the
+    pool is saturated (i.e., "size" jobs are running and "size" more are
+    queued), so producers (e.g., block readers) cannot run far ahead of the
+    workers and memory stays bounded.
+    """
+
+    def __init__(self, size=1):
+        self._jobs = Queue()
+        self._workers = []
+        self._pending = 0
+        self._cond = Condition()
+        self._cancelling = Event()
+        self.size = size
+
+    @property
+    def size(self):
+        return self._size
+
+    @size.setter
+    def size(self, size):
+        assert isinstance(size, int) and size > 0, 'Pool size not a +int'
+        self._cond.acquire()
+        try:
+            self._size = size
+            self._spawn()
+            self._cond.notify_all()
+        finally:
+            self._cond.release()
+
+    @property
+    def pending(self):
+        """:returns: (int) number of jobs queued or running"""
+        return self._pending
+
+    def _work(self):
+        while True:
+            job = self._jobs.get()
+            try:
+                job.run()
+            finally:
+                self._cond.acquire()
+                try:
+                    self._pending -= 1
+                    self._cond.notify_all()
+                    if len(self._workers) > self._size:
+                        #  The pool has shrunk, this worker must retire
+                        self._workers.remove(current_thread())
+                        break
+                finally:
+                    self._cond.release()
+
+    def _spawn(self):
+        """Start workers for the pending jobs, up to size of them. Call with
+        self._cond acquired"""
+        while len(self._workers) < min(self._size, self._pending):
+            worker = Thread(target=self._work)
+            worker.daemon = True
+            self._workers.append(worker)
+            worker.start()
+
+    def submit(self, method, *args, **kwargs):
+        """Queue method(*args, **kwargs) and block if the pool is saturated
+
+        :returns: (QueuedEvent) a handler for the queued job
+        """
+        job = QueuedEvent(method, *args, **kwargs)
+        if self._cancelling.is_set():
+            job.cancel()
+            return job
+        self._cond.acquire()
+        try:
+            while self._pending >= 2 * self._size:
+                self._cond.wait(0.1)
+            self._pending += 1
+            self._spawn()
+        finally:
+            self._cond.release()
+        self._jobs.put(job)
+        return job
+
+    def join(self):
+        """Wait until all queued jobs are done"""
+        self._cond.acquire()
+        try:
+            while self._pending:
+                self._cond.wait(0.1)
+        finally:
+            self._cond.release()
+
+    def drop(self):
+        """Drop all queued jobs, without waiting for the running ones"""
+        while True:
+            try:
+                job = self._jobs.get_nowait()
+            except Empty:
+                break
+            job.cancel()
+            self._cond.acquire()
+            try:
+                self._pending -= 1
+                self._cond.notify_all()
+            finally:
+                self._cond.release()
+
+    def cancel(self, feeders=()):
+        """Drop all queued jobs and wait for the running ones to finish
+
+        :param feeders: (list) jobs (e.g., of another pool) that submit jobs
+            to this pool. Until they are done, their jobs are dropped as soon
+            as they are submitted
+        """
+        self._cancelling.set()
+        try:
+            self.drop()
+            for feeder in feeders:
+                feeder.join()
+            self.drop()
+            self.join()
+        finally:
+            self._cancelling.clear()
+
+
+class AdaptiveConcurrency(object):
+    """AIMD control of the number of concurrent requests to an endpoint
+
+    Requests are accounted in epochs of "window" requests. The window starts
+    at initial and doubles after every epoch (slow start), until the first
+    sign of congestion. From then on, it grows by 1 after every epoch that
+    does not lower the throughput (bytes/sec), it shrinks by 1 after an
+    epoch that does and it is halved when the server is overloaded (e.g.,
+    502, 503) or a request fails to connect. It never exceeds maximum.
+    """
+
+    OVERLOAD = (0, 429, 502, 503, 504)
+    TOLERANCE = 0.9
+
+    def __init__(self, maximum=1, initial=1):
+        self._lock = Lock()
+        self.maximum = maximum
+        self._window = float(max(1, initial))
+        self._slow_start = True
+        self._last_backoff = 0.0
+        self._new_epoch(time())
+        self.throughput = 0.0
+        self.rtt = 0.0
+        self.requests, self.errors, self.bytes = 0, 0, 0
+
+    @property
+    def window(self):
+        """:returns: (int) the current number of concurrent requests"""
+        return max(1, min(int(self._window), self.maximum))
+
+    def _new_epoch(self, now):
+        self._epoch_start, self._epoch_requests, self._epoch_bytes = now, 0, 0
+
+    def record(self, nbytes, elapsed, status):
+        """Account a completed request
+
+        :param nbytes: (int) the bytes sent and received
+
+        :param elapsed: (float) the duration of the request, in seconds
+
+        :param status: (int) the http status code, 0 if connection failed
+        """
+        with self._lock:
+            now = time()
+            self.requests += 1
+            self.rtt = (0.8 * self.rtt + 0.2 * elapsed) if (
+                self.rtt) else elapsed
+            if status in self.OVERLOAD:
+                self.errors += 1
+                #  Requests in flight fail together, back off once for them
+                if now - self._last_backoff > self.rtt:
+                    self._window = max(1.0, min(
+                        self._window, self.maximum) / 2)
+                    self._slow_start = False
+                    self._last_backoff = now
+                    self.throughput = 0.0
+                    self._new_epoch(now)
+                return
+            self.bytes += nbytes
+            if not self._epoch_requests:
+                #  Do not count idle time before the epoch
+                self._epoch_start = max(self._epoch_start, now - elapsed)
+            self._epoch_requests += 1
+            self._epoch_bytes += nbytes
+            if self._epoch_requests < self.window:
+                return
+            throughput = self._epoch_bytes / max(
+                now - self._epoch_start, 1e-6)
+            if throughput >= self.throughput * self.TOLERANCE:
+                self._window += self._window if self._slow_start else 1
+            else:
+                self._slow_start = False
+                self._window -= 1
+            self._window = max(1.0, min(self._window, self.maximum))
+            self.throughput = throughput
+            self._new_epoch(now)
+
+
 class Client(Logged):
 
     MAX_THREADS = 1
+    #  The concurrency window of new clients, up to MAX_THREADS
+    INITIAL_CONCURRENCY = 4
+    PREWARM_CONNECTIONS = False
     DATE_FORMATS = ['%a %b %d %H:%M:%S %Y', ]
     CONNECTION_RETRY_LIMIT = 0
+    CONNECT_TIMEOUT = TIMEOUT
+    READ_TIMEOUT = TIMEOUT
+    TOTAL_TIMEOUT = None
 
     def __init__(self, base_url, token):
         assert base_url, 'No base_url for client %s' % self
         self.base_url = base_url
         self.token = token
         self.headers, self.params = dict(), dict()
+        #  Connection pool size for base_url, None for MAX_THREADS
         self.poolsize = None
 
-    def _init_thread_limit(self, limit=1):
-        assert isinstance(limit, int) and limit > 0, 'Thread limit not a +int'
-        self._thread_limit = limit
-        self._elapsed_old = 0.0
-        self._elapsed_new = 0.0
-
-    def _watch_thread_limit(self, threadlist):
-        self._thread_limit = getattr(self, '_thread_limit', 1)
-        self._elapsed_new = getattr(self, '_elapsed_new', 0.0)
-        self._elapsed_old = getattr(self, '_elapsed_old', 0.0)
-        recvlog.debug('# running threads: %s' % len(threadlist))
-        if self._elapsed_old and self._elapsed_old >= self._elapsed_new and (
-                self._thread_limit < self.MAX_THREADS):
-            self._thread_limit += 1
-        elif self._elapsed_old <= self._elapsed_new and self._thread_limit > 1:
-            self._thread_limit -= 1
-
-        self._elapsed_old = self._elapsed_new
-        if len(threadlist) >= self._thread_limit:
-            self._elapsed_new = 0.0
-            for thread in threadlist:
-                begin_time = time()
-                thread.join()
-                self._elapsed_new += time() - begin_time
-            self._elapsed_new = self._elapsed_new / len(threadlist)
-            return []
-        return threadlist
+    @property
+    def transfer_pool(self):
+        """A persistent pool of workers for concurrent requests
+
+        :returns: (TransferPool) created on first access, resized to the
+            current concurrency window (up to MAX_THREADS) on every access
+        """
+        window = self.concurrency.window
+        pool = getattr(self, '_transfer_pool', None)
+        if pool is None:
+            pool = self._transfer_pool = TransferPool(window)
+        elif pool.size != window:
+            pool.size = window
+        return pool
+
+    @property
+    def concurrency(self):
+        """The controller of the number of concurrent requests to base_url
+
+        :returns: (AdaptiveConcurrency) its window never exceeds MAX_THREADS
+        """
+        control = getattr(self, '_concurrency', None)
+        if control is None:
+            control = self._concurrency = AdaptiveConcurrency(
+                self.MAX_THREADS, initial=self.INITIAL_CONCURRENCY)
+        control.maximum = self.MAX_THREADS
+        return control
+
+    def prewarm_connections(self, n=None):
+        """Open connections to base_url in parallel, ahead of a bulk transfer,
+        so that concurrent requests do not wait for TCP/TLS handshakes
+
+        :param n: (int) the number of connections (default: MAX_THREADS)
+
+        :returns: (int) the number of connections opened
+        """
+        url = urlparse(self.base_url)
+        pool = connection_pools.get(
+            url.scheme, url.netloc, self.poolsize or self.MAX_THREADS)
+        return pool.prewarm(
+            n or self.MAX_THREADS, timeout=self.CONNECT_TIMEOUT)
 
     def async_run(self, method, kwarg_list):
         """Fire threads of operations
@@ -390,11 +1165,8 @@ class Client(Logged):
             kwarg_list
         """
         flying, results = {}, {}
-        self._init_thread_limit()
         for index, kwargs in enumerate(kwarg_list):
-            self._watch_thread_limit(flying.values())
-            flying[index] = SilentEvent(method=method, **kwargs)
-            flying[index].start()
+            flying[index] = self.transfer_pool.submit(method, **kwargs)
             unfinished = {}
             for key, thread in flying.items():
                 if thread.isAlive():
@@ -432,15 +1204,15 @@ class Client(Logged):
         if iff:
             self.params[name] = '%s' % value
 
-    def request(
-            self, method, path,
-            async_headers=dict(), async_params=dict(),
-            **kwargs):
-        """Commit an HTTP request to base_url/path
-        Requests are commited to and performed by Request/ResponseManager
-        These classes perform a lazy http request. Present method, by default,
-        enforces them to perform the http call. Hint: call present method with
-        success=None to get a non-performed ResponseManager object.
+    def _request_manager(
+            self, method, path, async_headers, async_params, kwargs):
+        """Prepare a request to base_url/path. Pending headers and params
+        are consumed
+
+        :param kwargs: (dict) the request keyword arguments. Those used here
+            are popped, e.g., success, data, json, timeouts
+
+        :returns: (RequestManager, success)
         """
         assert isinstance(method, str) or isinstance(method, unicode)
         assert method
@@ -452,34 +1224,88 @@ class Client(Logged):
             params.update(async_params)
             success = kwargs.pop('success', 200)
             data = kwargs.pop('data', None)
+            timeouts = dict(
+                connect_timeout=kwargs.pop(
+                    'connect_timeout', self.CONNECT_TIMEOUT),
+                read_timeout=kwargs.pop('read_timeout', self.READ_TIMEOUT),
+                total_timeout=kwargs.pop(
+                    'total_timeout', self.TOTAL_TIMEOUT))
             headers.setdefault('X-Auth-Token', self.token)
             if 'json' in kwargs:
                 data = dumps(kwargs.pop('json'))
                 headers.setdefault('Content-Type', 'application/json')
-            if data:
-                headers.setdefault('Content-Length', '%s' % len(data))
+            if data and _get_header(headers, 'content-length') is None:
+                size = _body_size(data)
+                if size is None:
+                    headers.setdefault('Transfer-Encoding', 'chunked')
+                else:
+                    headers['Content-Length'] = '%s' % size
 
             plog = ('\t[%s]' % self) if self.LOG_PID else ''
             sendlog.debug('\n\nCMT %s@%s%s', method, self.base_url, plog)
             req = RequestManager(
                 method, self.base_url, path,
-                data=data, headers=headers, params=params)
-            #  req.log()
-            r = ResponseManager(
-                req,
-                poolsize=self.poolsize,
-                connection_retry_limit=self.CONNECTION_RETRY_LIMIT)
-            r.LOG_TOKEN, r.LOG_DATA, r.LOG_PID = (
+                data=data, headers=headers, params=params, **timeouts)
+            req.LOG_TOKEN, req.LOG_DATA, req.LOG_PID = (
                 self.LOG_TOKEN, self.LOG_DATA, self.LOG_PID)
-            r._token = headers['X-Auth-Token']
+            req._token = headers['X-Auth-Token']
         finally:
             self.headers = dict()
             self.params = dict()
+        return req, success
+
+    def request(
+            self, method, path,
+            async_headers=dict(), async_params=dict(),
+            **kwargs):
+        """Commit an HTTP request to base_url/path
+        Requests are commited to and performed by Request/ResponseManager
+        These classes perform a lazy http request. Present method, by default,
+        enforces them to perform the http call. Hint: call present method with
+        success=None to get a non-performed ResponseManager object.
+        The data may be a string, a file-like object or an iterator of
+        strings. Bodies of unknown size are sent with chunked encoding.
+        Timeouts (connect_timeout, read_timeout, total_timeout) default to
+        the respective class attributes (e.g., CONNECT_TIMEOUT)
+        With stream=True, the response body is not read along with the
+        headers (see ResponseManager.iter_content and readinto). Streamed
+        requests are accounted by the concurrency control when they are
+        closed, along with their body
+        """
+        stream = kwargs.pop('stream', False)
+        req, success = self._request_manager(
+            method, path, async_headers, async_params, kwargs)
+        r = ResponseManager(
+            req,
+            poolsize=self.poolsize or self.MAX_THREADS,
+            connection_retry_limit=self.CONNECTION_RETRY_LIMIT,
+            stream=stream)
+        r.LOG_TOKEN, r.LOG_DATA, r.LOG_PID = (
+            self.LOG_TOKEN, self.LOG_DATA, self.LOG_PID)
+        r._token = req._token
 
         if success is not None:
+            begin_time = time()
+            try:
+                status_code = r.status_code
+            except (ClientError, IOError):
+                self.concurrency.record(0, time() - begin_time, 0)
+                raise
+
+            def record(received):
+                self.concurrency.record(
+                    (req.data_size or 0) + received,
+                    time() - begin_time,
+                    status_code)
+
+            if stream:
+                #  Account for the body, when it is consumed
+                r.on_close = record
+            else:
+                record(len(r.content or ''))
             # Success can either be an int or a collection
             success = (success,) if isinstance(success, int) else success
-            if r.status_code not in success:
+            if status_code not in success:
                 self._raise_for_status(r)
         return r
 
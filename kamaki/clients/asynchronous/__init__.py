@@ -0,0 +1,322 @@
+# Copyright 2014 GRNET S.A. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or
+# without modification, are permitted provided that the following
+# conditions are met:
+#
+#   1. Redistributions of source code must retain the above
+#      copyright notice, self.list of conditions and the following
+#      disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above
+#      copyright notice, self.list of conditions and the following
+#      disclaimer in the documentation and/or other materials
+#      provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY GRNET S.A. ``AS IS'' AND ANY EXPRESS
+# OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL GRNET S.A OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF
+# USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED
+# AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# The views and conclusions contained in the software and
+# documentation are those of the authors and should not be
+# interpreted as representing official policies, either expressed
+# or implied, of GRNET S.A.
+
+"""An asyncio transport for kamaki clients (requires trollius)
+
+Requests of an AsyncClient are coroutines, run by an event loop on a single
+thread, so thousands of them may be in progress at the same time, e.g.,
+
+    client = AsyncClient(url, token)
+    paths = ['/servers/%s' % server_id for server_id in server_ids]
+    responses = client.run_all(client.get, [dict(path=p) for p in paths])
+
+or, in a coroutine:
+
+    r = yield From(client.get('/servers/%s' % server_id))
+"""
+
+from json import loads
+from urllib2 import unquote
+from time import time
+
+from trollius import (
+    coroutine, From, Return, Semaphore, TimeoutError,
+    get_event_loop, open_connection, wait_for, gather)
+
+from kamaki.clients import (
+    Client, ClientError, Logged, recvlog, _get_header)
+
+
+class AsyncResponse(Logged):
+    """The response of an AsyncClient request, with the same interface as
+    ResponseManager (status_code, status, headers, content, text, json)"""
+
+    def __init__(self, status_code, status, headers, content):
+        self.status_code, self.status = status_code, status
+        self.headers, self.content = headers, content
+
+    @property
+    def text(self):
+        """
+        :returns: (str) content
+        """
+        return '%s' % self.content
+
+    @property
+    def json(self):
+        """
+        :returns: (dict) squeezed from json-formated content, decoded once
+        """
+        if not hasattr(self, '_json'):
+            try:
+                self._json = loads(self.content)
+            except ValueError as err:
+                raise ClientError('Response not formated in JSON - %s' % err)
+        return self._json
+
+
+class AsyncClient(Client):
+    """A Client with coroutine request methods (request, get, put, ...)
+
+    Request methods prepare the request (e.g., consume the headers set with
+    set_header) at once and return a coroutine which performs it. Up to
+    MAX_CONNECTIONS requests run concurrently, each on its own connection.
+    Connections are kept alive and reused. The timeouts of Client apply:
+    connect_timeout to connecting, read_timeout to each network read or write
+    and total_timeout to the whole request
+    """
+
+    MAX_CONNECTIONS = 100
+    READ_SIZE = 65536
+
+    def __init__(self, base_url, token, loop=None):
+        super(AsyncClient, self).__init__(base_url, token)
+        self.loop = loop or get_event_loop()
+        self._slots = Semaphore(self.MAX_CONNECTIONS, loop=self.loop)
+        self._idle = dict()
+
+    def request(
+            self, method, path,
+            async_headers=dict(), async_params=dict(),
+            **kwargs):
+        """Prepare an HTTP request to base_url/path
+
+        :returns: (coroutine) which performs the request and returns an
+            AsyncResponse. It raises ClientError if the status code is not
+            in success (default: 200)
+        """
+        req, success = self._request_manager(
+            method, path, async_headers, async_params, kwargs)
+        return self._request(req, success)
+
+    def run_all(self, method, kwarg_list):
+        """Run the requests of method (e.g., self.get) concurrently
+
+        :param method: a method which returns a coroutine
+
+        :param kwarg_list: (list of dicts) the arguments of each method call
+
+        :returns: (list) the results of each method call w.r. to the order of
+            kwarg_list
+        """
+        return self.loop.run_until_complete(gather(
+            *[method(**kwargs) for kwargs in kwarg_list], loop=self.loop))
+
+    def close(self):
+        """Close the idle connections"""
+        for conns in self._idle.values():
+            for reader, writer in conns:
+                writer.close()
+        self._idle = dict()
+
+    @coroutine
+    def _request(self, req, success):
+        yield From(self._slots.acquire())
+        try:
+            r = yield From(self._perform(req))
+        finally:
+            self._slots.release()
+        if success is not None:
+            success = (success,) if isinstance(success, int) else success
+            if r.status_code not in success:
+                self._raise_for_status(r)
+        raise Return(r)
+
+    def _timeout(self, req):
+        """:returns: (float) the read timeout or the time left, if shorter"""
+        timeout = req.read_timeout
+        if req._deadline is not None:
+            left = req._deadline - time()
+            if left <= 0:
+                raise req.timeout_error()
+            timeout = min(timeout, left) if timeout else left
+        return timeout
+
+    @coroutine
+    def _io(self, req, operation):
+        """Wait for a network operation, within the timeouts of req"""
+        try:
+            result = yield From(wait_for(
+                operation, self._timeout(req), loop=self.loop))
+        except TimeoutError:
+            raise req.timeout_error()
+        raise Return(result)
+
+    @coroutine
+    def _connect(self, req):
+        """:returns: (reader, writer, reused)"""
+        idle = self._idle.get((req.scheme, req.netloc), [])
+        while idle:
+            reader, writer = idle.pop()
+            if not reader.at_eof():
+                raise Return((reader, writer, True))
+            writer.close()
+        host, sep, port = req.netloc.rpartition(':')
+        if not (sep and port.isdigit()):
+            host, port = req.netloc, 443 if req.scheme == 'https' else 80
+        try:
+            reader, writer = yield From(wait_for(
+                open_connection(
+                    host, int(port),
+                    ssl=req.scheme == 'https', loop=self.loop),
+                req.connect_timeout, loop=self.loop))
+        except TimeoutError:
+            raise req.timeout_error(connecting=True)
+        raise Return((reader, writer, False))
+
+    @coroutine
+    def _send_body(self, req, writer, chunked):
+        sent = 0
+        for chunk in req.iter_body():
+            if not chunk:
+                continue
+            if chunked:
+                writer.write('%x\r\n' % len(chunk))
+            writer.write(str(chunk) if isinstance(chunk, buffer) else chunk)
+            if chunked:
+                writer.write('\r\n')
+            sent += len(chunk)
+            yield From(self._io(req, writer.drain()))
+        if chunked:
+            writer.write('0\r\n\r\n')
+        yield From(self._io(req, writer.drain()))
+        req.data_size = sent
+
+    @coroutine
+    def _perform(self, req):
+        req._encode_headers()
+        req.dump_log()
+        if req.total_timeout:
+            req._deadline = time() + req.total_timeout
+        head = ['%s %s HTTP/1.1' % (req.method, req.path)]
+        head.append('Host: %s' % req.netloc)
+        head += ['%s: %s' % (k, v) for k, v in req.headers.items()]
+        message = '\r\n'.join(head) + '\r\n\r\n'
+        chunked = _get_header(
+            req.headers, 'transfer-encoding', '').lower() == 'chunked'
+        while True:
+            reader, writer, reused = yield From(self._connect(req))
+            try:
+                writer.write(message)
+                yield From(self._send_body(req, writer, chunked))
+                response = yield From(self._read_response(req, reader))
+            except Exception:
+                writer.close()
+                raise
+            if response or not reused:
+                break
+            #  The server closed the idle connection, try a new one
+            writer.close()
+        if not response:
+            raise ClientError('Connection to %s closed by server' % (
+                req.netloc))
+        status_code, status, headers, content, keep_alive = response
+        if keep_alive:
+            self._idle.setdefault((req.scheme, req.netloc), []).append(
+                (reader, writer))
+        else:
+            writer.close()
+        plog = ('\t[%s]' % self) if self.LOG_PID else ''
+        recvlog.info('%d %s%s' % (status_code, status, plog))
+        for k, v in headers.items():
+            recvlog.info('  %s: %s%s' % (k, v, plog))
+        recvlog.info('data size: %s%s' % (len(content), plog))
+        raise Return(AsyncResponse(status_code, status, headers, content))
+
+    @coroutine
+    def _read_response(self, req, reader):
+        """:returns: (status_code, status, headers, content, keep_alive) or
+            None, if the connection is closed before a status line arrives
+        """
+        line = yield From(self._io(req, reader.readline()))
+        if not line:
+            raise Return(None)
+        version, sep, status = line.strip().partition(' ')
+        status_code, sep, status = status.partition(' ')
+        status_code = int(status_code)
+        headers, lowered = dict(), dict()
+        while True:
+            line = (yield From(self._io(req, reader.readline()))).strip()
+            if not line:
+                break
+            k, sep, v = line.partition(':')
+            k, v = k.strip(), unquote(v.strip()).decode('utf-8')
+            headers[k] = '%s, %s' % (headers[k], v) if k in headers else v
+            lowered[k.lower()] = headers[k]
+        keep_alive = version == 'HTTP/1.1' and (
+            lowered.get('connection', '').lower() != 'close')
+        if req.method == 'HEAD' or status_code in (204, 304) or (
+                status_code < 200):
+            content = ''
+        elif 'chunked' in lowered.get('transfer-encoding', '').lower():
+            content = yield From(self._read_chunks(req, reader))
+        elif 'content-length' in lowered:
+            content = yield From(self._read_exactly(
+                req, reader, int(lowered['content-length'])))
+        else:
+            content = yield From(self._read_exactly(req, reader))
+            keep_alive = False
+        raise Return((status_code, status, headers, content, keep_alive))
+
+    @coroutine
+    def _read_exactly(self, req, reader, size=None):
+        """Read size bytes, or until EOF if size is None"""
+        chunks = []
+        while size is None or size > 0:
+            chunk = yield From(self._io(req, reader.read(
+                self.READ_SIZE if size is None else min(
+                    size, self.READ_SIZE))))
+            if not chunk:
+                if size is None:
+                    break
+                raise ClientError('Incomplete response from %s' % (
+                    req.netloc))
+            chunks.append(chunk)
+            if size is not None:
+                size -= len(chunk)
+        raise Return(''.join(chunks))
+
+    @coroutine
+    def _read_chunks(self, req, reader):
+        chunks = []
+        while True:
+            line = yield From(self._io(req, reader.readline()))
+            size = int(line.split(';')[0].strip() or '0', 16)
+            if not size:
+                break
+            chunk = yield From(self._read_exactly(req, reader, size))
+            chunks.append(chunk)
+            yield From(self._io(req, reader.readline()))
+        while (yield From(self._io(req, reader.readline()))).strip():
+            pass
+        raise Return(''.join(chunks))
@@ -0,0 +1,140 @@
+# Copyright 2014 GRNET S.A. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or
+# without modification, are permitted provided that the following
+# conditions are met:
+#
+#   1. Redistributions of source code must retain the above
+#      copyright notice, self.list of conditions and the following
+#      disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above
+#      copyright notice, self.list of conditions and the following
+#      disclaimer in the documentation and/or other materials
+#      provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY GRNET S.A. ``AS IS'' AND ANY EXPRESS
+# OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL GRNET S.A OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF
+# USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED
+# AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# The views and conclusions contained in the software and
+# documentation are those of the authors and should not be
+# interpreted as representing official policies, either expressed
+# or implied, of GRNET S.A.
+
+from unittest import TestCase, skipIf
+from json import dumps
+
+try:
+    import trollius
+except ImportError:
+    trollius = None
+
+
+@skipIf(trollius is None, 'AsyncClient requires trollius')
+class AsyncClient(TestCase):
+
+    def setUp(self):
+        from kamaki.clients.asynchronous import AsyncClient
+        self.loop = trollius.new_event_loop()
+        self.connections = []
+        self.server = self.loop.run_until_complete(trollius.start_server(
+            self._serve, '127.0.0.1', 0, loop=self.loop))
+        port = self.server.sockets[0].getsockname()[1]
+        self.client = AsyncClient(
+            'http://127.0.0.1:%s' % port, 'token', loop=self.loop)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.close()
+        self.loop.run_until_complete(self.server.wait_closed())
+        self.loop.close()
+
+    def _serve(self, reader, writer):
+        """Reply with the request in json, keep the connection alive"""
+        self.connections.append(writer)
+        From = trollius.From
+        while True:
+            line = yield From(reader.readline())
+            if not line:
+                break
+            method, path, version = line.split()
+            length, chunked = 0, False
+            while True:
+                line = (yield From(reader.readline())).strip()
+                if not line:
+                    break
+                k, sep, v = line.partition(':')
+                if k.lower() == 'content-length':
+                    length = int(v)
+                elif k.lower() == 'transfer-encoding':
+                    chunked = v.strip() == 'chunked'
+            body = (yield From(reader.readexactly(length))) if length else ''
+            while chunked:
+                length = int((yield From(reader.readline())).strip(), 16)
+                body += yield From(reader.readexactly(length + 2))
+                body = body[:-2]
+                chunked = length > 0
+            if path.startswith('/sleep'):
+                yield From(trollius.sleep(0.5, loop=self.loop))
+            if path.startswith('/chunked'):
+                writer.write(
+                    'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n'
+                    '5\r\nhello\r\n6\r\n world\r\n0\r\n\r\n')
+                continue
+            content = dumps(dict(method=method, path=path, body=body))
+            writer.write('HTTP/1.1 %s\r\nContent-Length: %s\r\n\r\n%s' % (
+                '404 Not Found' if path.startswith('/missing') else '200 OK',
+                len(content), content))
+        writer.close()
+
+    def test_request(self):
+        r = self.loop.run_until_complete(self.client.get('/some/path'))
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(
+            r.json, dict(method='GET', path='/some/path', body=''))
+        r = self.loop.run_until_complete(
+            self.client.post('/other', data='some data', success=(200, 201)))
+        self.assertEqual(
+            r.json, dict(method='POST', path='/other', body='some data'))
+        r = self.loop.run_until_complete(
+            self.client.put('/streamed', data=iter(['some ', 'chunks'])))
+        self.assertEqual(
+            r.json, dict(method='PUT', path='/streamed', body='some chunks'))
+        r = self.loop.run_until_complete(self.client.get('/chunked'))
+        self.assertEqual(r.content, 'hello world')
+        self.assertEqual(len(self.connections), 1)
+
+    def test_run_all(self):
+        paths = ['/path/%s' % i for i in range(300)]
+        r = self.client.run_all(
+            self.client.put, [dict(path=path) for path in paths])
+        self.assertEqual([resp.json['path'] for resp in r], paths)
+        self.assertTrue(
+            len(self.connections) <= self.client.MAX_CONNECTIONS)
+
+    def test_errors(self):
+        from kamaki.clients import ClientError, ReadTimeout
+        try:
+            self.loop.run_until_complete(self.client.get('/missing'))
+            self.assertTrue(False, 'ClientError not raised')
+        except ClientError as ce:
+            self.assertEqual(ce.status, 404)
+        self.assertRaises(
+            ReadTimeout, self.loop.run_until_complete,
+            self.client.get('/sleep', read_timeout=0.1))
+
+
+if __name__ == '__main__':
+    from sys import argv
+    from kamaki.clients.test import runTestCase
+    runTestCase(AsyncClient, 'AsyncClient', argv[1:])
@@ -31,27 +31,276 @@
 # interpreted as representing official policies, either expressed
 # or implied, of GRNET S.A.
 
-from threading import enumerate as activethreads
-
-from os import fstat
+from os import (
+    fstat, path, stat, makedirs, rename, remove, getpid, lseek, listdir, utime)
+from sys import platform
+from errno import ENXIO
 from hashlib import new as newhashlib
 from time import time
+from uuid import uuid4
 from StringIO import StringIO
+from multiprocessing import Pool, TimeoutError
+from json import dumps, loads
+from copy import copy
+from threading import Lock, Event, current_thread
+from Queue import Queue, Empty
 
-from binascii import hexlify
-
-from kamaki.clients import SilentEvent, sendlog
+from kamaki.clients import sendlog, SilentEvent, TransferPool
 from kamaki.clients.pithos.rest_api import PithosRestClient
 from kamaki.clients.storage import ClientError
-from kamaki.clients.utils import path4url, filter_in, readall
+from kamaki.clients.utils import path4url, filter_in, readall, memory_map
 
 
 def _pithos_hash(block, blockhash):
     h = newhashlib(blockhash)
-    h.update(block.rstrip('\x00'))
+    if block and block[-1] == '\x00':
+        block = str(block).rstrip('\x00')
+    h.update(block)
     return h.hexdigest()
 
 
+def _zero_hash(blockhash):
+    """:returns: the hash of blocks of zeros, of any size (see _pithos_hash)
+    """
+    return newhashlib(blockhash).hexdigest()
+
+
+#  lseek whence values to find data and holes in sparse files (not in os)
+SEEK_DATA, SEEK_HOLE = (3, 4) if platform.startswith(
+    ('linux', 'freebsd', 'sunos')) else (None, None)
+
+
+def _hole_blocks(fileobj, blocksize, size):
+    """Find the blocks of the next size bytes of fileobj that are holes
+
+    :returns: (set) indices of blocks that lie entirely in holes. Empty, if
+        the platform or the file system cannot tell
+    """
+    if SEEK_DATA is None:
+        return set()
+    try:
+        fd, start = fileobj.fileno(), fileobj.tell()
+    except (AttributeError, IOError, ValueError):
+        return set()
+    end, offset, holes = start + size, start, set()
+    try:
+        while offset < end:
+            try:
+                data = min(lseek(fd, offset, SEEK_DATA), end)
+            except OSError as err:
+                if err.errno != ENXIO:
+                    raise
+                data = end
+            #  [offset, data) is a hole
+            blockid = (offset - start + blocksize - 1) // blocksize
+            while start + blockid * blocksize < data and (
+                    min(start + (blockid + 1) * blocksize, end) <= data):
+                holes.add(blockid)
+                blockid += 1
+            if data >= end:
+                break
+            offset = lseek(fd, data, SEEK_HOLE)
+    except (OSError, IOError):
+        return set()
+    finally:
+        fileobj.seek(start)
+    return holes
+
+
+def _read_blocks(fileobj, blocksize, size, fmap=None, holes=()):
+    """Read size bytes from the current position of fileobj, in blocks
+
+    :param fmap: (mmap) a memory map of fileobj. If given, blocks are
+        zero-copy buffers of the map and fileobj is only seeked at the end
+
+    :param holes: (set) indices of blocks known to be zeros (see
+        _hole_blocks), which are not read
+
+    :returns: (generator) the blocks, which are shorter only at EOF. Blocks
+        in holes are None
+    """
+    start = offset = fileobj.tell()
+    end = offset + size
+    while offset < end:
+        if (offset - start) // blocksize in holes:
+            offset += min(blocksize, end - offset)
+            if not fmap:
+                fileobj.seek(offset)
+            yield None
+            continue
+        if fmap:
+            block = buffer(fmap, offset, min(blocksize, end - offset))
+        else:
+            block = readall(fileobj, min(blocksize, end - offset))
+        if not len(block):
+            break
+        offset += len(block)
+        yield block
+    if fmap:
+        fileobj.seek(offset)
+
+
+def _pithos_hash_range(args):
+    """Hash consecutive blocks of a local file (run by a process pool)
+
+    :param args: (tuple) (file path, start, end, blocksize, blockhash)
+
+    :returns: (list) the hashes of the blocks in [start, end), in order
+    """
+    fpath, start, end, blocksize, blockhash = args
+    with open(fpath, 'rb') as f:
+        f.seek(start)
+        return [_pithos_hash(block, blockhash) for block in _read_blocks(
+            f, blocksize, end - start, memory_map(f))]
+
+
+class BlockHashCache(object):
+    """An on-disk cache of the block hashes of local files
+
+    There is one entry per (file path, block size, block hash algorithm),
+    stored as a json file in cache_dir. Each entry keeps the size, mtime and
+    inode of the file at hashing time. If any of them differs from the
+    current file status, or the file is gone, the entry is removed when it
+    is looked up. Once every PRUNE_INTERVAL, a write to the cache prunes it
+    (see prune), so entries of deleted or moved files do not pile up.
+    """
+
+    MAX_ENTRIES = 10000
+    MAX_AGE = 30 * 24 * 3600  # seconds since an entry was last used
+    PRUNE_INTERVAL = 24 * 3600  # seconds
+
+    def __init__(self, cache_dir):
+        self.cache_dir = path.abspath(path.expanduser(cache_dir))
+
+    @staticmethod
+    def identity(fpath):
+        """:returns: (list) [size, mtime, inode] of the local file"""
+        st = stat(fpath)
+        return [st.st_size, st.st_mtime, st.st_ino]
+
+    def _entry_path(self, fpath, blocksize, blockhash):
+        h = newhashlib('sha1')
+        h.update('%s\n%s\n%s' % (path.realpath(fpath), blocksize, blockhash))
+        return path.join(self.cache_dir, h.hexdigest())
+
+    def get(self, fpath, blocksize, blockhash):
+        """
+        :returns: (list) the cached block hashes of the file, or None if they
+            are missing or the file has changed since they were cached
+        """
+        entry_path = self._entry_path(fpath, blocksize, blockhash)
+        try:
+            with open(entry_path) as f:
+                entry = f.read()
+        except (IOError, OSError):
+            return None
+        try:
+            entry = loads(entry)
+            if entry['identity'] == self.identity(fpath):
+                #  Mark as used, so that it is not pruned
+                utime(entry_path, None)
+                return entry['hashes']
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+        #  Stale or corrupted
+        self.remove(fpath, blocksize, blockhash)
+        return None
+
+    def set(self, fpath, blocksize, blockhash, hashes, identity=None):
+        """Cache the block hashes of a file
+
+        :param identity: (list) the file identity when hashing started (see
+            identity method), so that changes during hashing are detected.
+            If not given, the current file identity is used
+        """
+        try:
+            if not path.isdir(self.cache_dir):
+                makedirs(self.cache_dir)
+            entry_path = self._entry_path(fpath, blocksize, blockhash)
+            tmp_path = '%s.%s' % (entry_path, getpid())
+            with open(tmp_path, 'w') as f:
+                f.write(dumps(dict(
+                    path=path.realpath(fpath),
+                    identity=identity or self.identity(fpath),
+                    hashes=hashes)))
+            rename(tmp_path, entry_path)
+            marker = path.join(self.cache_dir, '.pruned')
+            if not path.exists(marker) or (
+                    time() - stat(marker).st_mtime > self.PRUNE_INTERVAL):
+                open(marker, 'w').close()
+                self.prune()
+        except (IOError, OSError) as err:
+            sendlog.debug('Failed to cache hashes of %s: %s' % (fpath, err))
+
+    def prune(self):
+        """Remove the entries not used for MAX_AGE seconds, and then the least
+        recently used ones, down to MAX_ENTRIES"""
+        entries, now = [], time()
+        for name in listdir(self.cache_dir):
+            if name.startswith('.'):
+                continue
+            entry_path = path.join(self.cache_dir, name)
+            try:
+                used = stat(entry_path).st_mtime
+                if now - used > self.MAX_AGE:
+                    remove(entry_path)
+                else:
+                    entries.append((used, entry_path))
+            except OSError:
+                pass
+        entries.sort()
+        for used, entry_path in entries[:-self.MAX_ENTRIES or None]:
+            try:
+                remove(entry_path)
+            except OSError:
+                pass
+
+    def remove(self, fpath, blocksize, blockhash):
+        try:
+            remove(self._entry_path(fpath, blocksize, blockhash))
+        except OSError:
+            pass
+
+
+class BlockRegistry(object):
+    """The blocks uploaded, or being uploaded, in a session, by hash
+
+    Uploads of different files share it, so that a block they have in common
+    goes over the wire once. A block in flight is represented by its upload
+    job, which is given to anyone else uploading the same block. A failed job
+    is replaced by the next upload of the block. Stored blocks keep no data.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._blocks = dict()
+
+    def submit(self, hash, upload):
+        """Start uploading a block, unless it is stored or in flight
+
+        :param upload: (callable) upload(hash) starts the upload of the block
+            and returns a job (QueuedEvent or SilentEvent)
+
+        :returns: the upload job of the block, or None if it is stored
+        """
+        with self._lock:
+            job = self._blocks.get(hash)
+            if job is True:
+                return None
+            if job is None or (not job.isAlive() and job.exception):
+                job = self._blocks[hash] = upload(hash)
+            return job
+
+    def stored(self, hash):
+        """Mark a block as stored on the server. It is called by the transfer
+        pool workers, so it must not wait for the lock: submit may hold it
+        while waiting for the pool"""
+        self._blocks[hash] = True
+
+    def __contains__(self, hash):
+        return self._blocks.get(hash) is True
+
+
 def _range_up(start, end, max_value, a_range):
     """
     :param start: (int) the window bottom
@@ -102,6 +351,19 @@ def _range_up(start, end, max_value, a_range):
 class PithosClient(PithosRestClient):
     """Synnefo Pithos+ API client"""
 
+    HASH_PROCESSES = 1
+    LISTING_PAGE_SIZE = 10000  # the listing limit of Pithos+ servers
+    SMALL_OBJECT_SIZE = 4 * 1024 * 1024  # bytes, one default size block
+
+    #  A BlockHashCache, to avoid hashing unchanged local files again
+    hash_cache = None
+
+    #  A BlockRegistry, to upload the blocks shared by many files once
+    block_registry = None
+
+    #  A multiprocessing Pool of HASH_PROCESSES, shared by many uploads
+    hash_pool = None
+
     def __init__(self, base_url, token, account=None, container=None):
         super(PithosClient, self).__init__(base_url, token, account, container)
 
@@ -141,6 +403,130 @@ class PithosClient(PithosRestClient):
             self.container = cnt_back_up
         return r.headers
 
+    def create_directories(self, paths):
+        """Create directory objects concurrently, through the transfer pool
+
+        :param paths: (iterable) directory object names, each created once
+
+        :returns: (dict) {path: headers}
+        """
+        self._assert_container()
+        jobs = [(p, self.transfer_pool.submit(
+            self._fork().create_directory, p)) for p in sorted(set(paths))]
+        try:
+            for p, job in jobs:
+                job.join()
+                if job.exception:
+                    raise job.exception
+            return dict([(p, job.value) for p, job in jobs])
+        finally:
+            for p, job in jobs:
+                job.cancel()
+
+    @property
+    def file_pool(self):
+        """A persistent pool of workers for concurrent file uploads. Files
+        are not run by the transfer_pool, so that a file job never waits for
+        block jobs queued behind it in the same pool
+
+        :returns: (TransferPool) of MAX_THREADS workers
+        """
+        pool = getattr(self, '_file_pool', None)
+        if pool is None:
+            pool = self._file_pool = TransferPool(self.MAX_THREADS)
+        elif pool.size != self.MAX_THREADS:
+            pool.size = self.MAX_THREADS
+        return pool
+
+    def _run_files(self, method, argslist, cb=None):
+        """Run method(*args) for each args in argslist, in the file_pool
+        After an error, jobs not started yet are skipped and the error is
+        raised when the running ones are done
+
+        :param cb: optional progress.bar object, advanced per finished job
+
+        :returns: (list) the results, in the order of argslist
+        """
+        results, failed = [None] * len(argslist), []
+        if cb:
+            self.progress_bar_gen = cb(len(argslist))
+            self._cb_next()
+
+        def run(i, args):
+            if not failed:
+                results[i] = method(*args)
+
+        def collect(job):
+            job.join()
+            if job.exception:
+                failed.append(job.exception)
+            else:
+                self._cb_next()
+
+        pool, jobs = self.file_pool, []
+        try:
+            for i, args in enumerate(argslist):
+                if failed:
+                    break
+                jobs.append(pool.submit(run, i, args))
+                while jobs and not jobs[0].isAlive():
+                    collect(jobs.pop(0))
+            while jobs:
+                collect(jobs.pop(0))
+        except KeyboardInterrupt:
+            sendlog.info('- - - wait for threads to finish')
+            failed.append(None)
+            #  Running jobs wait for their blocks: drop the blocks they
+            #  submit, so that they fail fast
+            pool.drop()
+            self.transfer_pool.cancel(feeders=jobs)
+            pool.cancel()
+            raise
+        if failed:
+            raise failed[0]
+        return results
+
+    def upload_objects(self, sources, upload_cb=None, **kwargs):
+        """Upload many local files, up to MAX_THREADS of them at a time
+
+        Each file is uploaded by a copy of the client (see upload_object), so
+        all of them share the transfer pool of the blocks, the concurrency
+        window and the connection pool. They also share a block_registry (a
+        new one, if not set), so blocks common to many files are sent once,
+        and a hash_pool of HASH_PROCESSES (a new one, if not set).
+        After an error, files not started yet are skipped and the error is
+        raised when the running ones are done
+
+        :param sources: (list) of (local path, remote object path) or
+            (local path, remote object path, dict of upload_object args)
+
+        :param upload_cb: optional progress.bar object for uploaded files
+
+        :param kwargs: upload_object arguments for all files, e.g.,
+            content_type, sharing, public, pipelined
+
+        :returns: (list) the object headers, in the order of sources
+        """
+        self._assert_container()
+        kwargs.setdefault('container_info_cache', dict())
+        registry = self.block_registry or BlockRegistry()
+        hash_pool = self.hash_pool or (
+            Pool(self.HASH_PROCESSES) if self.HASH_PROCESSES > 1 else None)
+
+        def upload(lpath, obj, args=None):
+            fork = self._fork()
+            fork.block_registry, fork.hash_pool = registry, hash_pool
+            with open(lpath, 'rb') as f:
+                return fork.upload_object(
+                    obj, f, **dict(kwargs, **(args or {})))
+
+        try:
+            return self._run_files(upload, sources, upload_cb)
+        finally:
+            if hash_pool is not self.hash_pool:
+                hash_pool.terminate()
+                hash_pool.join()
+
     def upload_object_unchunked(
             self, obj, f,
             withHashFile=False,
@@ -154,7 +540,9 @@ class PithosClient(PithosRestClient):
         """
         :param obj: (str) remote object path
 
-        :param f: open file descriptor
+        :param f: open file descriptor, streamed to the server. If its size
+            is not known in advance (e.g., a pipe), chunked transfer encoding
+            is used
 
         :param withHashFile: (bool)
 
@@ -189,10 +577,12 @@ class PithosClient(PithosRestClient):
                 raise ClientError(msg, 1)
             f = StringIO(data)
         else:
-            data = readall(f, size) if size else f.read()
+            #  Stream from f: at most size bytes, or up to EOF
+            data = f
         r = self.object_put(
             obj,
             data=data,
+            content_length=None if withHashFile else (size or None),
             etag=etag,
             content_encoding=content_encoding,
             content_disposition=content_disposition,
@@ -243,9 +633,7 @@ class PithosClient(PithosRestClient):
 
     # upload_* auxiliary methods
     def _put_block_async(self, data, hash):
-        event = SilentEvent(method=self._put_block, data=data, hash=hash)
-        event.start()
-        return event
+        return self.transfer_pool.submit(self._put_block, data=data, hash=hash)
 
     def _put_block(self, data, hash):
         r = self.container_post(
@@ -255,6 +643,8 @@ class PithosClient(PithosRestClient):
             data=data,
             format='json')
         assert r.json[0] == hash, 'Local hash does not match server'
+        if self.block_registry is not None:
+            self.block_registry.stored(hash)
 
     def _get_file_block_info(self, fileobj, size=None, cache=None):
         """
@@ -307,52 +697,222 @@ class PithosClient(PithosRestClient):
             success=success)
         return (None if r.status_code == 201 else r.json), r.headers
 
+    def _calculate_blocks_in_processes(
+            self, blocksize, blockhash, size, nblocks, hashes, hmap, fileobj,
+            hash_gen=None):
+        """Hash the blocks of fileobj in HASH_PROCESSES parallel processes
+        Each process hashes a range of blocks and results are collected in
+        order, so the hashes list is the same as in sequential hashing
+        The processes of hash_pool are used, if set, otherwise a pool is
+        created for this file
+        """
+        step = blocksize * max(1, min(
+            64, nblocks // (4 * self.HASH_PROCESSES)))
+        ranges = [(
+            fileobj.name, start, min(start + step, size), blocksize, blockhash
+            ) for start in xrange(0, size, step)]
+        pool = self.hash_pool or Pool(self.HASH_PROCESSES)
+        try:
+            results = pool.imap(_pithos_hash_range, ranges)
+            for i in xrange(len(ranges)):
+                while True:
+                    try:
+                        range_hashes = results.next(0.5)
+                        break
+                    except TimeoutError:
+                        continue
+                for hash in range_hashes:
+                    offset = len(hashes) * blocksize
+                    hashes.append(hash)
+                    hmap[hash] = (offset, min(blocksize, size - offset))
+                    if hash_gen:
+                        hash_gen.next()
+        except BaseException:
+            if pool is not self.hash_pool:
+                pool.terminate()
+                pool.join()
+            raise
+        if pool is not self.hash_pool:
+            pool.close()
+            pool.join()
+        fileobj.seek(size)
+
+    @staticmethod
+    def _local_path(fileobj, size=None):
+        """
+        :param size: (int) if given, fileobj must be read from the start and
+            be exactly that long
+
+        :returns: (str) the path of fileobj, if it is a regular local file,
+            otherwise None
+        """
+        fpath = getattr(fileobj, 'name', None)
+        try:
+            if not (isinstance(fpath, basestring) and path.isfile(fpath)):
+                return None
+            if size is None or not fileobj.tell() and (
+                    size == fstat(fileobj.fileno()).st_size):
+                return fpath
+        except (AttributeError, IOError, ValueError):
+            pass
+        return None
+
     def _calculate_blocks_for_upload(
             self, blocksize, blockhash, size, nblocks, hashes, hmap, fileobj,
             hash_cb=None):
         offset = 0
+        hash_gen = None
         if hash_cb:
             hash_gen = hash_cb(nblocks)
             hash_gen.next()
 
-        for i in xrange(nblocks):
-            block = readall(fileobj, min(blocksize, size - offset))
-            bytes = len(block)
-            if bytes <= 0:
-                break
+        fpath = self._local_path(fileobj, size)
+        if fpath and self.hash_cache:
+            cached = self.hash_cache.get(fpath, blocksize, blockhash)
+            if cached is not None and len(cached) == nblocks:
+                for hash in cached:
+                    hashes.append(hash)
+                    hmap[hash] = (offset, min(blocksize, size - offset))
+                    offset += blocksize
+                    if hash_gen:
+                        hash_gen.next()
+                fileobj.seek(size)
+                return
+            identity = self.hash_cache.identity(fpath)
+
+        #  Blocks in holes of sparse files are zeros: hash them unread
+        holes = _hole_blocks(fileobj, blocksize, size)
+        #  Processes are not forked from other threads (e.g., of the
+        #  file_pool), which may hold locks, unless hash_pool is set up
+        processes = self.hash_pool or (
+            current_thread().name == 'MainThread' and self.HASH_PROCESSES > 1)
+        if fpath and processes and nblocks > 1 and not holes:
+            self._calculate_blocks_in_processes(
+                blocksize, blockhash, size, nblocks, hashes, hmap, fileobj,
+                hash_gen)
+        else:
+            zero = _zero_hash(blockhash)
+            for block in _read_blocks(
+                    fileobj, blocksize, size, memory_map(fileobj), holes):
+                if block is None:
+                    bytes, hash = min(blocksize, size - offset), zero
+                else:
+                    bytes, hash = len(block), _pithos_hash(block, blockhash)
+                hashes.append(hash)
+                hmap[hash] = (offset, bytes)
+                offset += bytes
+                if hash_gen:
+                    hash_gen.next()
+            msg = ('Failed to calculate uploading blocks: '
+                   'read bytes(%s) != requested size (%s)' % (offset, size))
+            assert offset == size, msg
+
+        if fpath and self.hash_cache:
+            self.hash_cache.set(fpath, blocksize, blockhash, hashes, identity)
+
+    def _upload_blocks_pipelined(
+            self, blocksize, blockhash, size, nblocks, hashes, fileobj,
+            hash_cb=None, upload_cb=None):
+        """Hash and upload blocks in one pass over fileobj
+
+        Each block is uploaded as soon as it is hashed, so it is read only
+        once and memory is bounded by the blocks in flight (see TransferPool).
+        Blocks that fail to upload are not retried here: they will be reported
+        missing when the hashmap is submitted.
+        """
+        offset, flying = 0, []
+        registry = self.block_registry or BlockRegistry()
+        fpath = self._local_path(fileobj, size) if self.hash_cache else None
+        identity = self.hash_cache.identity(fpath) if fpath else None
+        hash_gen = upload_gen = None
+        if hash_cb:
+            hash_gen = hash_cb(nblocks)
+            hash_gen.next()
+        if upload_cb:
+            upload_gen = upload_cb(nblocks)
+            upload_gen.next()
+
+        for block in _read_blocks(
+                fileobj, blocksize, size, memory_map(fileobj)):
             hash = _pithos_hash(block, blockhash)
             hashes.append(hash)
-            hmap[hash] = (offset, bytes)
-            offset += bytes
-            if hash_cb:
+            offset += len(block)
+            if hash_gen:
                 hash_gen.next()
+            job = registry.submit(
+                hash, lambda hash: self._put_block_async(block, hash))
+            if job is None:
+                self._next_gen(upload_gen)
+                continue
+            flying.append(job)
+            unfinished = []
+            for thread in flying:
+                if thread.isAlive():
+                    unfinished.append(thread)
+                else:
+                    self._next_gen(upload_gen)
+            flying = unfinished
         msg = ('Failed to calculate uploading blocks: '
                'read bytes(%s) != requested size (%s)' % (offset, size))
         assert offset == size, msg
+        if fpath:
+            self.hash_cache.set(fpath, blocksize, blockhash, hashes, identity)
+
+        for thread in flying:
+            thread.join()
+            self._next_gen(upload_gen)
 
-    def _upload_missing_blocks(self, missing, hmap, fileobj, upload_gen=None):
-        """upload missing blocks asynchronously"""
+    def _prewarm(self, nblocks):
+        """Open the connections for a transfer of nblocks in advance"""
+        if self.PREWARM_CONNECTIONS and nblocks > 1:
+            self.prewarm_connections(min(nblocks, self.MAX_THREADS))
 
-        self._init_thread_limit()
+    @staticmethod
+    def _next_gen(gen):
+        if gen:
+            try:
+                gen.next()
+            except:
+                pass
 
+    def _upload_missing_blocks(
+            self, missing, hmap, fileobj, upload_gen=None, start=0):
+        """upload missing blocks asynchronously
+
+        Blocks stored or in flight in the block_registry are not sent again
+
+        :param start: (int) the position of fileobj where the hmap offsets
+            start from
+        """
         flying = []
         failures = []
-        for hash in missing:
+        fmap = memory_map(fileobj)
+
+        def upload(hash):
             offset, bytes = hmap[hash]
-            fileobj.seek(offset)
-            data = readall(fileobj, bytes)
-            r = self._put_block_async(data, hash)
-            flying.append(r)
-            unfinished = self._watch_thread_limit(flying)
-            for thread in set(flying).difference(unfinished):
-                if thread.exception:
+            offset += start
+            if fmap:
+                data = buffer(fmap, offset, bytes)
+            else:
+                fileobj.seek(offset)
+                data = readall(fileobj, bytes)
+            return self._put_block_async(data, hash)
+
+        for hash in missing:
+            if self.block_registry is None:
+                flying.append(upload(hash))
+            else:
+                job = self.block_registry.submit(hash, upload)
+                if job is None:
+                    self._next_gen(upload_gen)
+                    continue
+                flying.append(job)
+            unfinished = []
+            for thread in flying:
+                if thread.isAlive():
+                    unfinished.append(thread)
+                elif thread.exception:
                     failures.append(thread)
-                    if isinstance(
-                            thread.exception,
-                            ClientError) and thread.exception.status == 502:
-                        self.POOLSIZE = self._thread_limit
-                elif thread.isAlive():
-                    flying.append(thread)
                 elif upload_gen:
                     try:
                         upload_gen.next()
@@ -372,6 +932,21 @@ class PithosClient(PithosRestClient):
 
         return [failure.kwargs['hash'] for failure in failures]
 
+    def _upload_small_object(
+            self, obj, f, size, nblocks,
+            hash_cb=None, upload_cb=None, **kwargs):
+        """Upload size bytes of f (a file or a string) with a single PUT,
+        instead of negotiating the missing blocks of a hashmap"""
+        for gen in [hash_cb(nblocks)] if hash_cb else []:
+            for i in gen:
+                pass
+        r = self.object_put(
+            obj, data=f, content_length=size, success=201, **kwargs)
+        for gen in [upload_cb(nblocks)] if upload_cb else []:
+            for i in gen:
+                pass
+        return r.headers
+
     def upload_object(
             self, obj, f,
             size=None,
@@ -385,7 +960,8 @@ class PithosClient(PithosRestClient):
             content_type=None,
             sharing=None,
             public=None,
-            container_info_cache=None):
+            container_info_cache=None,
+            pipelined=False):
         """Upload an object using multiple connections (threads)
 
         :param obj: (str) remote object path
@@ -419,6 +995,16 @@ class PithosClient(PithosRestClient):
 
         :param container_info_cache: (dict) if given, avoid redundant calls to
             server for container info (block size and hash information)
+
+        :param pipelined: (bool) hash and upload each block in one pass,
+            without asking the server for missing blocks first. The file is
+            read once and memory stays bounded, but blocks already stored on
+            the server are uploaded again (use for large, new files). Ignored
+            if the block hashes of the file are in hash_cache
+
+        Objects up to SMALL_OBJECT_SIZE are uploaded with a single request,
+        unless their block hashes are in hash_cache: then the blocks are
+        probably on the server already and only the hashmap is sent
         """
         self._assert_container()
 
@@ -427,13 +1013,50 @@ class PithosClient(PithosRestClient):
                 f, size, container_info_cache)
         (hashes, hmap, offset) = ([], {}, 0)
         content_type = content_type or 'application/octet-stream'
-
-        self._calculate_blocks_for_upload(
-            *block_info,
-            hashes=hashes,
-            hmap=hmap,
-            fileobj=f,
-            hash_cb=hash_cb)
+        try:
+            #  Blocks are read from the current position of f
+            offset = f.tell()
+        except (AttributeError, IOError):
+            pass
+
+        fpath = self._local_path(f, size) if self.hash_cache else None
+        hashed = bool(fpath) and self.hash_cache.get(
+            fpath, blocksize, blockhash) is not None
+
+        if size <= self.SMALL_OBJECT_SIZE and not hashed:
+            return self._upload_small_object(
+                obj, f, size, nblocks,
+                hash_cb=hash_cb,
+                upload_cb=upload_cb,
+                etag=etag,
+                content_type=content_type,
+                if_etag_match=if_etag_match,
+                if_etag_not_match='*' if if_not_exist else None,
+                content_encoding=content_encoding,
+                content_disposition=content_disposition,
+                permissions=sharing,
+                public=public)
+
+        if pipelined and hashed:
+            #  Hashes are known, so check for missing blocks first
+            pipelined = False
+
+        if pipelined:
+            self._prewarm(nblocks)
+            self._upload_blocks_pipelined(
+                *block_info,
+                hashes=hashes,
+                fileobj=f,
+                hash_cb=hash_cb,
+                upload_cb=upload_cb)
+            upload_cb = None
+        else:
+            self._calculate_blocks_for_upload(
+                *block_info,
+                hashes=hashes,
+                hmap=hmap,
+                fileobj=f,
+                hash_cb=hash_cb)
 
         hashmap = dict(bytes=size, hashes=hashes)
         missing, obj_headers = self._create_object_or_get_missing_hashes(
@@ -450,6 +1073,14 @@ class PithosClient(PithosRestClient):
         if missing is None:
             return obj_headers
 
+        if pipelined:
+            #  Keep offsets only for the blocks that have to be re-read
+            missing_set = set(missing)
+            for i, hash in enumerate(hashes):
+                if hash in missing_set and hash not in hmap:
+                    start = i * blocksize
+                    hmap[hash] = (start, min(blocksize, size - start))
+
         if upload_cb:
             upload_gen = upload_cb(len(missing))
             for i in range(len(missing), len(hashmap['hashes']) + 1):
@@ -460,6 +1091,7 @@ class PithosClient(PithosRestClient):
         else:
             upload_gen = None
 
+        self._prewarm(len(missing))
         retries = 7
         try:
             while retries:
@@ -469,7 +1101,8 @@ class PithosClient(PithosRestClient):
                     missing,
                     hmap,
                     f,
-                    upload_gen)
+                    upload_gen,
+                    start=offset)
                 if missing:
                     if num_of_blocks == len(missing):
                         retries -= 1
@@ -487,8 +1120,7 @@ class PithosClient(PithosRestClient):
                     details=details)
         except KeyboardInterrupt:
             sendlog.info('- - - wait for threads to finish')
-            for thread in activethreads():
-                thread.join()
+            self.transfer_pool.cancel()
             raise
 
         r = self.object_put(
@@ -561,6 +1193,20 @@ class PithosClient(PithosRestClient):
         if not content_type:
             content_type = 'application/octet-stream'
 
+        if size <= self.SMALL_OBJECT_SIZE:
+            return self._upload_small_object(
+                obj, input_str, size, nblocks,
+                hash_cb=hash_cb,
+                upload_cb=upload_cb,
+                etag=etag,
+                content_type=content_type,
+                if_etag_match=if_etag_match,
+                if_etag_not_match='*' if if_not_exist else None,
+                content_encoding=content_encoding,
+                content_disposition=content_disposition,
+                permissions=sharing,
+                public=public)
+
         hashes = []
         hmap = {}
         for blockid in range(nblocks):
@@ -597,16 +1243,15 @@ class PithosClient(PithosRestClient):
                 failures = []
                 for hash in missing:
                     offset, block = hmap[hash]
-                    bird = self._put_block_async(block, hash)
-                    flying.append(bird)
-                    unfinished = self._watch_thread_limit(flying)
-                    for thread in set(flying).difference(unfinished):
+                    flying.append(self._put_block_async(block, hash))
+                    unfinished = []
+                    for thread in flying:
+                        if thread.isAlive():
+                            unfinished.append(thread)
+                            continue
                         if thread.exception:
                             failures.append(thread.kwargs['hash'])
-                        if thread.isAlive():
-                            flying.append(thread)
-                        else:
-                            self._cb_next()
+                        self._cb_next()
                     flying = unfinished
                 for thread in flying:
                     thread.join()
@@ -621,8 +1266,7 @@ class PithosClient(PithosRestClient):
                 raise ClientError('%s blocks failed to upload' % len(missing))
         except KeyboardInterrupt:
             sendlog.info('- - - wait for threads to finish')
-            for thread in activethreads():
-                thread.join()
+            self.transfer_pool.cancel()
             raise
         self._cb_next()
 
@@ -660,37 +1304,114 @@ class PithosClient(PithosRestClient):
                 map_dict[h] = [i]
         return (blocksize, blockhash, total_size, hashmap['hashes'], map_dict)
 
-    def _dump_blocks_sync(
-            self, obj, remote_hashes, blocksize, total_size, dst, crange,
+    def _get_blocks_in_order(
+            self, obj, hash_list, blocksize, total_size, crange, prefetch,
             **args):
+        """Download blocks in parallel, but yield their contents in order
+
+        Up to prefetch blocks are requested ahead of the one to be yielded,
+        so memory is bounded by prefetch * blocksize.
+        Blocks out of crange are skipped.
+        """
         if not total_size:
             return
-        for blockid, blockhash in enumerate(remote_hashes):
-            if blockhash:
+        flying, prefetch = [], max(prefetch, 1)
+        try:
+            for blockid in xrange(len(hash_list)):
                 start = blocksize * blockid
                 is_last = start + blocksize > total_size
                 end = (total_size - 1) if is_last else (start + blocksize - 1)
                 data_range = _range_up(start, end, total_size, crange)
-                if not data_range:
-                    self._cb_next()
-                    continue
-                args['data_range'] = 'bytes=%s' % data_range
-                r = self.object_get(obj, success=(200, 206), **args)
-                self._cb_next()
-                dst.write(r.content)
-                dst.flush()
+                if data_range:
+                    args['data_range'] = 'bytes=%s' % data_range
+                    flying.append(self._get_block_async(obj, **args))
+                else:
+                    flying.append(None)
+                while len(flying) > prefetch or (flying and not flying[0]):
+                    block = self._pop_block(flying)
+                    if block is not None:
+                        yield block
+            while flying:
+                block = self._pop_block(flying)
+                if block is not None:
+                    yield block
+        finally:
+            for job in flying:
+                if job:
+                    job.cancel()
+
+    def _pop_block(self, flying):
+        """Pop the first of the flying block jobs and wait for it
+        :returns: (str) the block contents or None for skipped blocks
+        """
+        job = flying.pop(0)
+        if job:
+            job.join()
+            if job.exception:
+                raise job.exception
+        self._cb_next()
+        return job.value.content if job else None
+
+    def _dump_blocks_in_order(
+            self, obj, hash_list, blocksize, total_size, dst, crange,
+            **args):
+        """Write blocks to dst strictly in order, e.g., for pipes and ttys"""
+        for block in self._get_blocks_in_order(
+                obj, hash_list, blocksize, total_size, crange,
+                self.MAX_THREADS, **args):
+            dst.write(block)
+        dst.flush()
+
+    @staticmethod
+    def _seekable(fileobj):
+        """:returns: (bool) if blocks can be written in any order in fileobj"""
+        try:
+            if not fileobj.isatty():
+                fileobj.tell()
+                return True
+        except (AttributeError, IOError, ValueError):
+            pass
+        return False
 
     def _get_block_async(self, obj, **args):
-        event = SilentEvent(self.object_get, obj, success=(200, 206), **args)
-        event.start()
-        return event
+        return self.transfer_pool.submit(
+            self.object_get, obj, success=(200, 206), **args)
+
+    def _get_block_into(self, obj, view, **args):
+        """Stream a block straight into view (a memoryview of block size)"""
+        r = self.object_get(obj, success=(200, 206), stream=True, **args)
+        try:
+            offset = 0
+            while offset < len(view):
+                n = r.readinto(view[offset:])
+                if not n:
+                    raise ClientError(
+                        'Incomplete block of %s' % obj,
+                        details=['Got %s of %s bytes (%s)' % (
+                            offset, len(view), args.get('data_range'))])
+                offset += n
+        finally:
+            r.close()
+
+    def _hash_from_file(self, fp, start, size, blockhash, fmap=None):
+        if fmap:
+            block = buffer(fmap, start, size)
+        else:
+            fp.seek(start)
+            block = readall(fp, size)
+        return _pithos_hash(block, blockhash)
+
+    def _local_block_hash(
+            self, fp, start, size, blockhash, cached=None, fmap=None):
+        """
+        :param cached: (list) block hashes of fp, if known
 
-    def _hash_from_file(self, fp, start, size, blockhash):
-        fp.seek(start)
-        block = readall(fp, size)
-        h = newhashlib(blockhash)
-        h.update(block.strip('\x00'))
-        return hexlify(h.digest())
+        :param fmap: (mmap) a memory map of fp, to hash without copying
+        """
+        try:
+            return cached[start // size]
+        except (TypeError, IndexError):
+            return self._hash_from_file(fp, start, size, blockhash, fmap)
 
     def _thread2file(self, flying, blockids, local_file, offset=0, **restargs):
         """write the results of a greenleted rest call to a file
@@ -721,16 +1442,35 @@ class PithosClient(PithosRestClient):
         blockid_dict = dict()
         offset = 0
 
-        self._init_thread_limit()
+        cached = None
+        if file_size and self.hash_cache:
+            fpath = self._local_path(local_file)
+            cached = fpath and self.hash_cache.get(fpath, blocksize, blockhash)
+        fmap = memory_map(local_file) if file_size and not cached else None
+        #  Zero blocks are not downloaded. Past the end of the local file,
+        #  they are left as holes, elsewhere zeros are written over old data
+        zero = blockhash and not filerange and _zero_hash(blockhash)
+        try:
+            dst_size = fstat(local_file.fileno()).st_size
+        except (AttributeError, IOError, OSError, ValueError):
+            dst_size = None
+
         for block_hash, blockids in remote_hashes.items():
             blockids = [blk * blocksize for blk in blockids]
             unsaved = [blk for blk in blockids if not (
-                blk < file_size and block_hash == self._hash_from_file(
-                        local_file, blk, blocksize, blockhash))]
+                blk < file_size and block_hash == self._local_block_hash(
+                        local_file, blk, blocksize, blockhash, cached,
+                        fmap))]
             self._cb_next(len(blockids) - len(unsaved))
-            if unsaved:
+            if unsaved and block_hash == zero:
+                for blk in unsaved:
+                    if dst_size is None or blk < dst_size:
+                        local_file.seek(blk)
+                        local_file.write(
+                            '\x00' * min(blocksize, total_size - blk))
+                    self._cb_next()
+            elif unsaved:
                 key = unsaved[0]
-                self._watch_thread_limit(flying.values())
                 self._thread2file(
                     flying, blockid_dict, local_file, offset,
                     **restargs)
@@ -763,10 +1503,12 @@ class PithosClient(PithosRestClient):
             if_modified_since=None,
             if_unmodified_since=None):
         """Download an object (multiple connections, random blocks)
+        If dst is not seekable (e.g., a pipe or a tty), blocks are downloaded
+        in parallel, but written in order
 
         :param obj: (str) remote object path
 
-        :param dst: open file descriptor (wb+)
+        :param dst: open file descriptor (wb+) or any writable stream
 
         :param download_cb: optional progress.bar object for downloading
 
@@ -803,8 +1545,9 @@ class PithosClient(PithosRestClient):
             self.progress_bar_gen = download_cb(len(hash_list))
             self._cb_next()
 
-        if dst.isatty():
-            self._dump_blocks_sync(
+        self._prewarm(len(hash_list))
+        if not self._seekable(dst):
+            self._dump_blocks_in_order(
                 obj,
                 hash_list,
                 blocksize,
@@ -825,9 +1568,226 @@ class PithosClient(PithosRestClient):
                 **restargs)
             if not range_str:
                 dst.truncate(total_size)
+                fpath = self.hash_cache and self._local_path(dst)
+                if fpath:
+                    #  The local file is now a copy of the remote object
+                    dst.flush()
+                    self.hash_cache.set(fpath, blocksize, blockhash, hash_list)
 
         self._complete_cb()
 
+    def _download_small_object(
+            self, obj, dst,
+            version=None,
+            if_match=None,
+            if_none_match=None,
+            if_modified_since=None,
+            if_unmodified_since=None):
+        """Download an object with a single request, without its hashmap,
+        streaming the body to dst"""
+        r = self.object_get(
+            obj,
+            version=version,
+            if_etag_match=if_match,
+            if_etag_not_match=if_none_match,
+            if_modified_since=if_modified_since,
+            if_unmodified_since=if_unmodified_since,
+            success=(200, 304, 412),
+            stream=True)
+        try:
+            if r.status_code == 200:
+                for chunk in r.iter_content():
+                    dst.write(chunk)
+                dst.truncate()
+        finally:
+            r.close()
+
+    def download_objects(self, targets, download_cb=None, **kwargs):
+        """Download many objects to local files, up to MAX_THREADS objects at
+        a time
+
+        Objects are run by the file_pool and their blocks by the shared
+        transfer_pool, so the hashmap requests of some objects overlap with
+        the block transfers of others, all within the concurrency window of
+        the client. Objects known to be up to SMALL_OBJECT_SIZE are fetched
+        with a single request, without their hashmap
+
+        :param targets: (list) of (remote object path, local path, resume)
+            or (remote object path, local path, resume, object size)
+
+        :param download_cb: optional progress.bar object for downloaded
+            objects
+
+        :param kwargs: download_object arguments for all objects, e.g.,
+            version, range_str, if_match
+
+        :returns: (list) the local paths, in the order of targets
+        """
+        self._assert_container()
+
+        def download(obj, lpath, resume=False, size=None):
+            fork = self._fork()
+            resume = resume and path.exists(lpath)
+            with open(lpath, 'rb+' if resume else 'wb+') as f:
+                if size is not None and size <= self.SMALL_OBJECT_SIZE and (
+                        not (resume or kwargs.get('range_str'))):
+                    kw = dict(kwargs)
+                    kw.pop('range_str', None)
+                    fork._download_small_object(obj, f, **kw)
+                else:
+                    fork.download_object(obj, f, resume=resume, **kwargs)
+            return lpath
+
+        return self._run_files(download, targets, download_cb)
+
+    def transfer_objects(
+            self, src_container, pairs,
+            move=False, source_account=None, **kwargs):
+        """Copy (or move) objects to the container of this client, on the
+        server side, up to MAX_THREADS objects at a time
+
+        Pairs are consumed as transfers are started, so they can be produced
+        while listing the source, in bounded memory. A failed transfer does
+        not stop the rest
+
+        :param src_container: (str) the container of the source objects
+
+        :param pairs: (iterable) of (source object, destination object)
+
+        :param move: (bool) move objects, instead of copying them
+
+        :param source_account: (str) the account of the source objects
+
+        :param kwargs: copy_object (or move_object) arguments for all objects,
+            e.g., public, content_type, source_version
+
+        :returns: (generator) of (source object, destination object, error)
+            per transfer, in the order of pairs. Error is None on success
+        """
+        self._assert_container()
+        dst_container = self.container
+        method = 'move_object' if move else 'copy_object'
+
+        def transfer(src, dst):
+            getattr(self._fork(), method)(
+                src_container, src, dst_container, dst,
+                source_account=source_account, **kwargs)
+
+        for (src, dst), error in self._iter_jobs(transfer, pairs):
+            yield src, dst, error
+
+    def delete_objects(self, objects, until=None):
+        """Delete objects of the container, up to MAX_THREADS at a time
+
+        Objects are consumed as deletions are started, so they can be
+        produced while listing, in bounded memory. A failed deletion does not
+        stop the rest. Objects already deleted count as deleted, so that an
+        interrupted deletion can be run again
+
+        :param objects: (iterable) of object paths
+
+        :param until: (str) formated date, remove history until then
+
+        :returns: (generator) of (object path, error) per object, in the
+            order of objects. Error is None on success
+        """
+        self._assert_container()
+
+        def delete(obj):
+            self._fork().object_delete(obj, until=until, success=(204, 404))
+
+        for (obj, ), error in self._iter_jobs(
+                delete, ((obj, ) for obj in objects)):
+            yield obj, error
+
+    def _iter_jobs(self, method, argslist):
+        """Run method(*args) for each args in argslist, in the file_pool
+        Args are consumed as jobs are started and at most a few jobs per
+        worker wait to be collected. A failed job does not stop the rest
+
+        :returns: (generator) of (args, error) per job, in the order of
+            argslist. Error is None on success
+        """
+        pool, jobs = self.file_pool, []
+
+        def collect():
+            args, job = jobs.pop(0)
+            job.join()
+            return args, (job.exception or None)
+
+        try:
+            for args in argslist:
+                jobs.append((args, pool.submit(method, *args)))
+                while jobs and (
+                        not jobs[0][1].isAlive() or (
+                            len(jobs) > 4 * self.MAX_THREADS)):
+                    yield collect()
+            while jobs:
+                yield collect()
+        except KeyboardInterrupt:
+            sendlog.info('- - - wait for threads to finish')
+            pool.cancel()
+            raise
+
+    def iter_object_blocks(
+            self, obj,
+            prefetch=None,
+            download_cb=None,
+            version=None,
+            range_str=None,
+            if_match=None,
+            if_none_match=None,
+            if_modified_since=None,
+            if_unmodified_since=None):
+        """Download an object in parallel, but get its blocks in order, as
+        soon as they arrive. Memory is bounded by prefetch * blocksize
+
+        :param obj: (str) remote object path
+
+        :param prefetch: (int) max number of blocks to download ahead of the
+            next block in order (default: MAX_THREADS)
+
+        :param download_cb: optional progress.bar object for downloading
+
+        :param version: (str) file version
+
+        :param range_str: (str) from, to are file positions (int) in bytes
+
+        :param if_match: (str)
+
+        :param if_none_match: (str)
+
+        :param if_modified_since: (str) formated date
+
+        :param if_unmodified_since: (str) formated date
+
+        :returns: (generator) of the block contents (str). If range_str is
+            set, only the parts of the blocks in range are returned
+        """
+        restargs = dict(
+            version=version,
+            data_range=None if range_str is None else 'bytes=%s' % range_str,
+            if_match=if_match,
+            if_none_match=if_none_match,
+            if_modified_since=if_modified_since,
+            if_unmodified_since=if_unmodified_since)
+
+        (
+            blocksize,
+            blockhash,
+            total_size,
+            hash_list,
+            remote_hashes) = self._get_remote_blocks_info(obj, **restargs)
+        assert total_size >= 0
+
+        if download_cb:
+            self.progress_bar_gen = download_cb(len(hash_list))
+            self._cb_next()
+
+        return self._get_blocks_in_order(
+            obj, hash_list, blocksize, total_size, range_str,
+            prefetch or self.MAX_THREADS, **restargs)
+
     def download_to_string(
             self, obj,
             download_cb=None,
@@ -839,6 +1799,8 @@ class PithosClient(PithosRestClient):
             if_unmodified_since=None):
         """Download an object to a string (multiple connections). This method
         uses threads for http requests, but stores all content in memory.
+        To process large objects, prefer iter_object_blocks or
+        download_to_buffer
 
         :param obj: (str) remote object path
 
@@ -858,6 +1820,57 @@ class PithosClient(PithosRestClient):
 
         :returns: (str) the whole object contents
         """
+        try:
+            return ''.join(self.iter_object_blocks(
+                obj,
+                download_cb=download_cb,
+                version=version,
+                range_str=range_str,
+                if_match=if_match,
+                if_none_match=if_none_match,
+                if_modified_since=if_modified_since,
+                if_unmodified_since=if_unmodified_since))
+        except KeyboardInterrupt:
+            sendlog.info('- - - wait for threads to finish')
+            self.transfer_pool.cancel()
+
+    def download_to_buffer(
+            self, obj, buf,
+            download_cb=None,
+            version=None,
+            range_str=None,
+            if_match=None,
+            if_none_match=None,
+            if_modified_since=None,
+            if_unmodified_since=None):
+        """Download an object into a preallocated, writable buffer, e.g., a
+        bytearray or a memoryview, so that no second copy is kept in memory.
+        Unless range_str is set, blocks are received in parallel, straight
+        into their place in buf
+
+        :param obj: (str) remote object path
+
+        :param buf: (bytearray or memoryview) at least as large as the
+            downloaded data
+
+        :param download_cb: optional progress.bar object for downloading
+
+        :param version: (str) file version
+
+        :param range_str: (str) from, to are file positions (int) in bytes
+
+        :param if_match: (str)
+
+        :param if_none_match: (str)
+
+        :param if_modified_since: (str) formated date
+
+        :param if_unmodified_since: (str) formated date
+
+        :returns: (int) the number of bytes written in buf
+
+        :raises ClientError: if buf is too small
+        """
         restargs = dict(
             version=version,
             data_range=None if range_str is None else 'bytes=%s' % range_str,
@@ -878,35 +1891,63 @@ class PithosClient(PithosRestClient):
             self.progress_bar_gen = download_cb(len(hash_list))
             self._cb_next()
 
-        num_of_blocks = len(remote_hashes)
-        ret = [''] * num_of_blocks
-        self._init_thread_limit()
-        flying = dict()
+        if range_str:
+            return self._copy_blocks_in_order(
+                obj, buf, hash_list, blocksize, total_size, range_str,
+                **restargs)
+
+        if total_size > len(buf):
+            raise ClientError(
+                'Buffer size %s is too small for object %s' % (len(buf), obj),
+                details=['Object size is %s bytes' % total_size])
+        view, flying = memoryview(buf), []
         try:
-            for blockid, blockhash in enumerate(remote_hashes):
+            for blockid in xrange(len(hash_list)):
                 start = blocksize * blockid
-                is_last = start + blocksize > total_size
-                end = (total_size - 1) if is_last else (start + blocksize - 1)
-                data_range_str = _range_up(start, end, end, range_str)
-                if data_range_str:
-                    self._watch_thread_limit(flying.values())
-                    restargs['data_range'] = 'bytes=%s' % data_range_str
-                    flying[blockid] = self._get_block_async(obj, **restargs)
-                for runid, thread in flying.items():
-                    if (blockid + 1) == num_of_blocks:
-                        thread.join()
-                    elif thread.isAlive():
-                        continue
-                    if thread.exception:
-                        raise thread.exception
-                    ret[runid] = thread.value.content
-                    self._cb_next()
-                    flying.pop(runid)
-            return ''.join(ret)
+                end = min(start + blocksize, total_size)
+                restargs['data_range'] = 'bytes=%s-%s' % (start, end - 1)
+                flying.append(self.transfer_pool.submit(
+                    self._get_block_into, obj, view[start:end], **restargs))
+            while flying:
+                job = flying.pop(0)
+                job.join()
+                if job.exception:
+                    raise job.exception
+                self._cb_next()
+            return total_size
+        except KeyboardInterrupt:
+            sendlog.info('- - - wait for threads to finish')
+            self.transfer_pool.cancel()
+        finally:
+            for job in flying:
+                job.cancel()
+
+    def _copy_blocks_in_order(
+            self, obj, buf, hash_list, blocksize, total_size, crange,
+            **args):
+        """Copy the parts of the blocks in crange to buf, in order
+        :returns: (int) the number of bytes written in buf
+        """
+        offset = 0
+        blocks = self._get_blocks_in_order(
+            obj, hash_list, blocksize, total_size, crange, self.MAX_THREADS,
+            **args)
+        try:
+            for block in blocks:
+                end = offset + len(block)
+                if end > len(buf):
+                    raise ClientError(
+                        'Buffer size %s is too small for object %s' % (
+                            len(buf), obj),
+                        details=['Downloaded %s bytes so far' % end])
+                buf[offset:end] = block
+                offset = end
+            return offset
         except KeyboardInterrupt:
             sendlog.info('- - - wait for threads to finish')
-            for thread in activethreads():
-                thread.join()
+            self.transfer_pool.cancel()
+        finally:
+            blocks.close()
 
     #Command Progress Bar method
     def _cb_next(self, step=1):
@@ -1052,6 +2093,221 @@ class PithosClient(PithosRestClient):
         r = self.account_get()
         return r.json
 
+    def _fork(self):
+        """:returns: a copy of the client, with separate pending headers,
+            params and progress bar, to run requests in other threads. The
+            copy shares the transfer pool and the concurrency controller
+        """
+        self.transfer_pool, self.concurrency  # create them, to be shared
+        fork = copy(self)
+        fork.headers, fork.params = dict(), dict()
+        fork.__dict__.pop('progress_bar_gen', None)
+        return fork
+
+    def _iter_pages(self, get, marker, limit, page_size, prefetch, **kwargs):
+        """Follow the marker over the pages of a listing, until a short page
+        or limit items. If prefetch, the next page is requested in a
+        background thread while the current one is consumed
+        """
+        page_size = page_size or self.LISTING_PAGE_SIZE
+
+        def get_page(marker):
+            r = get(
+                limit=page_size, marker=marker, format='json',
+                success=(200, 204), **kwargs)
+            return r.json if r.status_code == 200 else []
+
+        job, count = SilentEvent(get_page, marker), 0
+        job.start()
+        while job:
+            job.join()
+            if job.exception:
+                raise job.exception
+            page, job = job.value, None
+            if len(page) >= page_size and (
+                    not limit or count + len(page) < limit):
+                last = page[-1]
+                job = SilentEvent(
+                    get_page, last.get('name', last.get('subdir')))
+                if prefetch:
+                    job.start()
+            count += len(page)
+            yield page
+            if job and not prefetch:
+                job.start()
+
+    def _iter_listing(
+            self, get, marker, limit, page_size, prefetch, **kwargs):
+        """Iterate over the items of a listing (see _iter_pages)"""
+        count = 0
+        for page in self._iter_pages(
+                get, marker, limit, page_size, prefetch, **kwargs):
+            for item in page:
+                if limit and count >= limit:
+                    return
+                count += 1
+                yield item
+
+    def iter_containers(
+            self, marker=None, limit=None, page_size=None, prefetch=True,
+            **kwargs):
+        """Iterate over the containers of the account, following the marker
+        from page to page, so that memory is bounded by two pages
+
+        :param marker: (str) start after this container name
+
+        :param limit: (int) stop after that many containers (default: all)
+
+        :param page_size: (int) containers per request (default:
+            LISTING_PAGE_SIZE)
+
+        :param prefetch: (bool) request the next page in the background
+
+        :param kwargs: more account_get arguments, e.g., show_only_shared,
+            public, until, if_modified_since, if_unmodified_since
+
+        :returns: (generator) of container dicts
+        """
+        return self._iter_listing(
+            self._fork().account_get, marker, limit, page_size, prefetch,
+            **kwargs)
+
+    def iter_objects(
+            self, prefix=None, delimiter=None, path=None, marker=None,
+            limit=None, page_size=None, prefetch=True, **kwargs):
+        """Iterate over the objects of the container, following the marker
+        from page to page, so that memory is bounded by two pages
+
+        :param prefix: (str) only objects starting with prefix
+
+        :param delimiter: (str) only objects up to the delimiter
+
+        :param path: (str) same as prefix=path and delimiter=/
+
+        :param marker: (str) start after this object name
+
+        :param limit: (int) stop after that many objects (default: all)
+
+        :param page_size: (int) objects per request (default:
+            LISTING_PAGE_SIZE)
+
+        :param prefetch: (bool) request the next page in the background
+
+        :param kwargs: more container_get arguments, e.g., meta,
+            show_only_shared, public, until, if_modified_since,
+            if_unmodified_since
+
+        :returns: (generator) of object dicts
+        """
+        self._assert_container()
+        return self._iter_listing(
+            self._fork().container_get, marker, limit, page_size, prefetch,
+            prefix=prefix, delimiter=delimiter, path=path, **kwargs)
+
+    def iter_objects_sharded(
+            self, prefix=None, delimiter='/', prefixes=None, workers=None,
+            buffered_pages=4, page_size=None, **kwargs):
+        """Iterate over the objects of the container, in order, while shards
+        of the keyspace are listed concurrently
+
+        By default, the shards are the subdirectories of prefix, discovered
+        by a delimited listing, whose entries are kept in memory. Up to
+        workers shards are listed at a time, in order, each buffering up to
+        buffered_pages pages ahead of the caller
+
+        :param prefix: (str) only objects starting with prefix
+
+        :param delimiter: (str) the delimiter of the shard discovery listing
+
+        :param prefixes: (list) the shards, instead of discovering them.
+            Only objects under these prefixes are listed, so they should not
+            overlap (e.g., 'a' and 'ab')
+
+        :param workers: (int) max shards listed at a time (default:
+            MAX_THREADS)
+
+        :param buffered_pages: (int) max pages kept per shard
+
+        :param page_size: (int) objects per request (default:
+            LISTING_PAGE_SIZE)
+
+        :param kwargs: more container_get arguments, e.g., meta, until,
+            if_modified_since, if_unmodified_since
+
+        :returns: (generator) of object dicts
+        """
+        self._assert_container()
+        if prefixes is None:
+            top = list(self.iter_objects(
+                prefix=prefix, delimiter=delimiter, page_size=page_size,
+                **kwargs))
+        else:
+            top = [dict(subdir=p) for p in sorted(set(prefixes))]
+        return self._merge_shards(
+            top, workers or self.MAX_THREADS, buffered_pages, page_size,
+            **kwargs)
+
+    def _merge_shards(self, top, workers, buffered_pages, page_size, **kwargs):
+        """Yield the entries of top, with each subdir entry replaced by the
+        objects under it. Shards are listed by workers threads, which take
+        them in order, so that the shard consumed next is always running.
+        They are daemon threads, blocked by full queues when the caller
+        stops iterating, which do not keep the program alive
+        """
+        lock, cancelled = Lock(), Event()
+        shards = [(
+            entry['subdir'],
+            Queue(max(buffered_pages, 1))) for entry in top if (
+                'subdir' in entry)]
+        pending = iter(shards)
+
+        def list_shards():
+            lister = self._fork()
+            while not cancelled.is_set():
+                with lock:
+                    shard_prefix, queue = next(pending, (None, None))
+                if queue is None:
+                    return
+                try:
+                    for page in lister._iter_pages(
+                            lister.container_get, None, None, page_size,
+                            False, prefix=shard_prefix, **kwargs):
+                        queue.put(page)
+                        if cancelled.is_set():
+                            return
+                    queue.put(None)
+                except Exception as e:
+                    queue.put(e)
+
+        threads = [SilentEvent(list_shards) for i in range(
+            min(max(workers, 1), len(shards)))]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        queues = iter([queue for shard_prefix, queue in shards])
+        try:
+            for entry in top:
+                if 'subdir' not in entry:
+                    yield entry
+                    continue
+                queue = next(queues)
+                while True:
+                    page = queue.get()
+                    if page is None:
+                        break
+                    if isinstance(page, Exception):
+                        raise page
+                    for obj in page:
+                        yield obj
+        finally:
+            cancelled.set()
+            for shard_prefix, queue in shards:
+                while True:
+                    try:
+                        queue.get_nowait()
+                    except Empty:
+                        break
+
     def del_container(self, until=None, delimiter=None):
         """
         :param until: (str) formated date
@@ -1306,62 +2562,89 @@ class PithosClient(PithosRestClient):
         return self.set_object_sharing(obj)
 
     def append_object(self, obj, source_file, upload_cb=None):
-        """
+        """Append the contents of a local file to an object
+
+        Up to one block of data are sent with a single request. More data are
+        uploaded as a temporary object next to obj, with their blocks sent in
+        parallel (see upload_object). Then, obj is updated from the temporary
+        object with a single request, so that data are appended in order, and
+        the temporary object is deleted
+
         :param obj: (str) remote object path
 
         :param source_file: open file descriptor
 
         :param upload_db: progress.bar for uploading
+
+        :returns: (list) the headers of the update
         """
         self._assert_container()
+        size = fstat(source_file.fileno()).st_size
+        if not size:
+            return []
         meta = self.get_container_info()
-        blocksize = int(meta['x-container-block-size'])
-        filesize = fstat(source_file.fileno()).st_size
-        nblocks = 1 + (filesize - 1) // blocksize
-        offset = 0
-        headers = {}
-        if upload_cb:
-            self.progress_bar_gen = upload_cb(nblocks)
-            self._cb_next()
-        flying = {}
-        self._init_thread_limit()
+        if size <= int(meta['x-container-block-size']):
+            return [self._update_directly(
+                obj, source_file, size, 'bytes */*', upload_cb=upload_cb)]
+        return [self._update_from_staged(
+            obj, source_file, 'bytes */*',
+            upload_cb=upload_cb,
+            container_info_cache={self.container: meta})]
+
+    def _update_directly(
+            self, obj, source_file, size, content_range,
+            source_version=None, upload_cb=None):
+        """Update the content_range of obj with the next size bytes of
+        source_file, sent with the request
+
+        :returns: (dict) the headers of the update
+        """
+        for gen in [upload_cb(1)] if upload_cb else []:
+            for i in gen:
+                pass
+        block = readall(source_file, size)
+        r = self.object_post(
+            obj,
+            update=True,
+            content_type='application/octet-stream',
+            content_length=len(block),
+            content_range=content_range,
+            source_version=source_version,
+            data=block)
+        return dict(r.headers)
+
+    def _update_from_staged(
+            self, obj, source_file, content_range,
+            size=None, source_version=None, upload_cb=None,
+            container_info_cache=None):
+        """Upload size bytes of source_file as a temporary object next to
+        obj, update the content_range of obj from it and delete it
+
+        :returns: (dict) the headers of the update
+        """
+        tmp = '%s.%s.staged' % (obj, uuid4().hex)
+        sendlog.debug('Stage the data for %s in %s' % (obj, tmp))
         try:
-            for i in range(nblocks):
-                block = source_file.read(min(blocksize, filesize - offset))
-                offset += len(block)
-
-                self._watch_thread_limit(flying.values())
-                unfinished = {}
-                flying[i] = SilentEvent(
-                    method=self.object_post,
-                    obj=obj,
-                    update=True,
-                    content_range='bytes */*',
-                    content_type='application/octet-stream',
-                    content_length=len(block),
-                    data=block)
-                flying[i].start()
-
-                for key, thread in flying.items():
-                    if thread.isAlive():
-                        if i < nblocks:
-                            unfinished[key] = thread
-                            continue
-                        thread.join()
-                    if thread.exception:
-                        raise thread.exception
-                    headers[key] = thread.value.headers
-                    self._cb_next()
-                flying = unfinished
-        except KeyboardInterrupt:
-            sendlog.info('- - - wait for threads to finish')
-            for thread in activethreads():
-                thread.join()
+            self.upload_object(
+                tmp, source_file,
+                size=size,
+                upload_cb=upload_cb,
+                container_info_cache=container_info_cache)
+            r = self.object_post(
+                obj,
+                update=True,
+                content_range=content_range,
+                content_type='application/octet-stream',
+                source_object='/%s/%s' % (self.container, tmp),
+                source_version=source_version)
+            return r.headers
         finally:
-            from time import sleep
-            sleep(2 * len(activethreads()))
-            self._cb_next()
-        return headers.values()
+            try:
+                self.del_object(tmp)
+            except ClientError as ce:
+                sendlog.warning(
+                    'Failed to delete temporary object %s, please delete it:'
+                    ' %s' % (tmp, ('%s' % ce).strip()))
 
     def truncate_object(self, obj, upto_bytes):
         """
@@ -1387,6 +2670,13 @@ class PithosClient(PithosRestClient):
         """Overwrite a part of an object from local source file
         ATTENTION: content_type must always be application/octet-stream
 
+        Up to one block of data are sent with a single request. Otherwise,
+        data from the first block boundary on are uploaded as a temporary
+        object (see upload_object), so only blocks the server does not have
+        already are sent, in parallel. Then, the range of obj is updated from
+        the temporary object with a single request. Data before the first
+        block boundary are sent as they are
+
         :param obj: (str) remote object path
 
         :param start: (int) position in bytes to start overwriting from
@@ -1396,6 +2686,8 @@ class PithosClient(PithosRestClient):
         :param source_file: open file descriptor
 
         :param upload_db: progress.bar for uploading
+
+        :returns: (list) the headers of the updates
         """
 
         self._assert_container()
@@ -1407,30 +2699,31 @@ class PithosClient(PithosRestClient):
         meta = self.get_container_info()
         blocksize = int(meta['x-container-block-size'])
         filesize = fstat(source_file.fileno()).st_size
-        datasize = end - start + 1
-        nblocks = 1 + (datasize - 1) // blocksize
-        offset = 0
-        if upload_cb:
-            self.progress_bar_gen = upload_cb(nblocks)
-            self._cb_next()
-        headers = []
-        for i in range(nblocks):
-            read_size = min(blocksize, filesize - offset, datasize - offset)
-            block = source_file.read(read_size)
-            r = self.object_post(
-                obj,
-                update=True,
-                content_type='application/octet-stream',
-                content_length=len(block),
-                content_range='bytes %s-%s/*' % (
-                    start + offset,
-                    start + offset + len(block) - 1),
+        datasize = min(end - start + 1, filesize - source_file.tell())
+        if datasize <= 0:
+            return []
+        if datasize <= blocksize:
+            return [self._update_directly(
+                obj, source_file, datasize,
+                'bytes %s-%s/*' % (start, start + datasize - 1),
                 source_version=source_version,
-                data=block)
-            headers.append(dict(r.headers))
-            offset += len(block)
-            self._cb_next()
-        self._cb_next()
+                upload_cb=upload_cb)]
+
+        headers, head = [], -start % blocksize
+        if head:
+            headers.append(self._update_directly(
+                obj, source_file, head,
+                'bytes %s-%s/*' % (start, start + head - 1),
+                source_version=source_version))
+            start, datasize = start + head, datasize - head
+
+        headers.append(dict(self._update_from_staged(
+            obj, source_file,
+            'bytes %s-%s/*' % (start, start + datasize - 1),
+            size=datasize,
+            source_version=source_version,
+            upload_cb=upload_cb,
+            container_info_cache={self.container: meta})))
         return headers
 
     def copy_object(
@@ -34,9 +34,10 @@
 from unittest import TestCase
 from mock import patch, call
 from tempfile import NamedTemporaryFile
-from os import urandom
+from os import urandom, path
 from itertools import product
 from random import randint
+from time import sleep
 
 try:
     from collections import OrderedDict
@@ -154,6 +155,35 @@ class FR(object):
     status_code = 200
 
 
+class _Block(object):
+    """A block download response"""
+
+    def __init__(self, content):
+        self.content = content
+
+
+def _get_block_by_range(obj, data_range=None, **kwargs):
+    """Fake object_get: the block contents are the range start, and blocks
+    arrive in random order"""
+    sleep(0.001 * randint(0, 10))
+    return _Block('%s,' % data_range[len('bytes='):].split('-')[0])
+
+
+class _Stream(object):
+    """A streamed block download response, read in pieces of 3 bytes"""
+
+    def __init__(self, content):
+        self.content, self.closed = content, False
+
+    def readinto(self, buf):
+        n = min(len(buf), len(self.content), 3)
+        buf[:n], self.content = self.content[:n], self.content[n:]
+        return n
+
+    def close(self):
+        self.closed = True
+
+
 class PithosRestClient(TestCase):
 
     def setUp(self):
@@ -764,6 +794,141 @@ class PithosMethods(TestCase):
                 ((42, 333, 800, '100,50-200,-600',), '42-100,50-200,200-333')):
             self.assertEqual(_range_up(*args), expected)
 
+    def test__hole_blocks(self):
+        from kamaki.clients.pithos import _hole_blocks, _read_blocks
+        bs = 65536
+        f = NamedTemporaryFile()
+        f.seek(bs)
+        f.write('x' * bs)
+        f.truncate(4 * bs + 100)
+        f.flush()
+        f.seek(0)
+        holes = _hole_blocks(f, bs, 4 * bs + 100)
+        self.assertEqual(f.tell(), 0)
+        if not holes:
+            #  The platform or the file system does not report holes
+            return
+        self.assertEqual(holes, set([0, 2, 3, 4]))
+        blocks = _read_blocks(f, bs, 4 * bs + 100, holes=holes)
+        self.assertEqual(
+            [b is None for b in blocks], [True, False, True, True, True])
+        f.seek(bs)
+        self.assertEqual(_hole_blocks(f, bs, 3 * bs + 100), set([1, 2, 3]))
+        self.assertEqual(f.tell(), bs)
+
+
+class BlockHashCache(TestCase):
+
+    def setUp(self):
+        from tempfile import mkdtemp
+        self.cache_dir = mkdtemp()
+        self.cache = pithos.BlockHashCache(self.cache_dir)
+        self.tmpFile = NamedTemporaryFile()
+        self.tmpFile.write(urandom(1024))
+        self.tmpFile.flush()
+
+    def tearDown(self):
+        from shutil import rmtree
+        rmtree(self.cache_dir)
+        self.tmpFile.close()
+
+    def test_get_set(self):
+        fpath, hashes = self.tmpFile.name, ['h1', 'h2']
+        self.assertEqual(self.cache.get(fpath, 512, 'sha256'), None)
+        self.cache.set(fpath, 512, 'sha256', hashes)
+        self.assertEqual(self.cache.get(fpath, 512, 'sha256'), hashes)
+        self.assertEqual(self.cache.get(fpath, 1024, 'sha256'), None)
+        self.assertEqual(self.cache.get(fpath, 512, 'md5'), None)
+
+        #  Changed while hashing
+        identity = self.cache.identity(fpath)
+        identity[0] -= 1
+        self.cache.set(fpath, 512, 'sha256', hashes, identity)
+        self.assertEqual(self.cache.get(fpath, 512, 'sha256'), None)
+
+        #  Changed after hashing: the stale entry is removed
+        self.cache.set(fpath, 512, 'sha256', hashes)
+        self.tmpFile.write('more data')
+        self.tmpFile.flush()
+        self.assertEqual(self.cache.get(fpath, 512, 'sha256'), None)
+        self.assertFalse(path.exists(
+            self.cache._entry_path(fpath, 512, 'sha256')))
+
+        #  Deleted file
+        other = NamedTemporaryFile()
+        self.cache.set(other.name, 512, 'sha256', hashes)
+        entry_path = self.cache._entry_path(other.name, 512, 'sha256')
+        self.assertTrue(path.exists(entry_path))
+        other.close()
+        self.assertEqual(self.cache.get(other.name, 512, 'sha256'), None)
+        self.assertFalse(path.exists(entry_path))
+
+        self.cache.set(fpath, 512, 'sha256', hashes)
+        self.cache.remove(fpath, 512, 'sha256')
+        self.assertEqual(self.cache.get(fpath, 512, 'sha256'), None)
+
+    def test_prune(self):
+        from os import utime, listdir
+        from time import time
+        files = [NamedTemporaryFile() for i in range(4)]
+        for f in files:
+            self.cache.set(f.name, 512, 'sha256', ['h'])
+        entries = [self.cache._entry_path(
+            f.name, 512, 'sha256') for f in files]
+        now = time()
+        utime(entries[0], (now, now - self.cache.MAX_AGE - 10))
+        for i, entry_path in enumerate(entries[1:]):
+            utime(entry_path, (now, now - 100 + i))
+
+        #  Used entries are not pruned first
+        self.assertEqual(self.cache.get(files[1].name, 512, 'sha256'), ['h'])
+        self.cache.MAX_ENTRIES = 2
+        self.cache.prune()
+        self.assertEqual(
+            sorted(listdir(self.cache_dir)),
+            sorted(['.pruned'] + [path.basename(e) for e in (
+                entries[1], entries[3])]))
+
+        #  Writes prune the cache once every PRUNE_INTERVAL
+        self.cache.MAX_ENTRIES = 0
+        self.cache.set(files[2].name, 512, 'sha256', ['h'])
+        self.assertEqual(len(listdir(self.cache_dir)), 4)
+        self.cache.PRUNE_INTERVAL = -1
+        self.cache.set(files[2].name, 512, 'sha256', ['h'])
+        self.assertEqual(listdir(self.cache_dir), ['.pruned'])
+
+
+class BlockRegistry(TestCase):
+
+    def test_submit(self):
+        from kamaki.clients import SilentEvent
+        registry = pithos.BlockRegistry()
+        jobs = []
+
+        def upload(hash, fail=False):
+            def put():
+                sleep(0.01)
+                if fail:
+                    raise ClientError('Failed', status=500)
+            jobs.append(SilentEvent(put))
+            jobs[-1].start()
+            return jobs[-1]
+
+        job = registry.submit('h1', lambda h: upload(h, fail=True))
+        self.assertTrue(registry.submit('h1', upload) is job)
+        job.join()
+        self.assertTrue(job.exception)
+        job = registry.submit('h1', upload)
+        self.assertFalse(job is jobs[0])
+        self.assertFalse('h1' in registry)
+        job.join()
+        self.assertTrue(registry.submit('h1', upload) is job)
+        self.assertEqual(len(jobs), 2)
+        registry.stored('h1')
+        self.assertTrue('h1' in registry)
+        self.assertEqual(registry.submit('h1', upload), None)
+        self.assertEqual(len(jobs), 2)
+
 
 class PithosClient(TestCase):
 
@@ -841,6 +1006,142 @@ class PithosClient(TestCase):
         for i in range(len(r)):
             self.assert_dicts_are_equal(r[i], container_list[i])
 
+    def _pages(self, names):
+        """Fake a paginated listing of names"""
+
+        def get(limit=None, marker=None, **kwargs):
+            start = names.index(marker) + 1 if marker else 0
+            page = [dict(name=n) for n in names[start:start + limit]]
+            r = FR()
+            r.status_code, r.json = (200, page) if page else (204, None)
+            return r
+        return get
+
+    def test_iter_objects(self):
+        names = ['o%03d' % i for i in range(25)]
+        with patch.object(
+                pithos.PithosClient, 'container_get',
+                side_effect=self._pages(names)) as get:
+            for prefetch in (True, False):
+                get.reset_mock()
+                r = self.client.iter_objects(
+                    prefix='o', page_size=10, prefetch=prefetch, until='u')
+                self.assertEqual([o['name'] for o in r], names)
+                self.assertEqual(get.mock_calls, [call(
+                    limit=10, marker=m, format='json', success=(200, 204),
+                    prefix='o', delimiter=None, path=None, until='u')
+                    for m in (None, 'o009', 'o019')])
+            get.reset_mock()
+            r = self.client.iter_objects(marker='o004', limit=7, page_size=5)
+            self.assertEqual([o['name'] for o in r], names[5:12])
+            self.assertEqual(len(get.mock_calls), 2)
+        with patch.object(
+                pithos.PithosClient, 'container_get',
+                side_effect=self._pages(names[:10])) as get:
+            r = self.client.iter_objects(page_size=10)
+            self.assertEqual(len(list(r)), 10)
+            self.assertEqual(get.mock_calls[-1][2]['marker'], 'o009')
+        with patch.object(
+                pithos.PithosClient, 'container_get',
+                side_effect=ClientError('Not found', status=404)):
+            r = self.client.iter_objects()
+            self.assertRaises(ClientError, list, r)
+
+    def test_iter_objects_sharded(self):
+        names = sorted(['%s/%s' % (d, i) for d in 'abd' for i in range(12)] + [
+            'c', 'b/x/y', 'e', 'a/'])
+
+        def get(limit=None, marker=None, prefix=None, delimiter=None, **kw):
+            prefix, entries = prefix or '', []
+            for name in names:
+                if not name.startswith(prefix) or name <= (marker or ''):
+                    continue
+                rest = name[len(prefix):]
+                if delimiter and delimiter in rest:
+                    subdir = prefix + rest[:rest.index(delimiter) + 1]
+                    if subdir > (marker or '') and dict(
+                            subdir=subdir) not in entries:
+                        entries.append(dict(subdir=subdir))
+                elif dict(subdir=name) not in entries:
+                    entries.append(dict(name=name))
+            r = FR()
+            r.json = entries[:limit]
+            r.status_code = 200 if r.json else 204
+            return r
+
+        with patch.object(
+                pithos.PithosClient, 'container_get', side_effect=get) as cg:
+            for workers, buffered in ((1, 1), (3, 1), (8, 4)):
+                r = self.client.iter_objects_sharded(
+                    page_size=5, workers=workers, buffered_pages=buffered)
+                self.assertEqual([o['name'] for o in r], names)
+            r = self.client.iter_objects_sharded(
+                prefixes=['d/', 'a/'], page_size=5)
+            self.assertEqual(
+                [o['name'] for o in r],
+                [n for n in names if n[:2] in ('a/', 'd/')])
+
+            #  Closed early, the shard listers stop
+            r = self.client.iter_objects_sharded(
+                page_size=2, workers=2, buffered_pages=1)
+            self.assertEqual(r.next()['name'], names[0])
+            r.close()
+            sleep(0.1)
+            calls = len(cg.mock_calls)
+            sleep(0.1)
+            self.assertEqual(calls, len(cg.mock_calls))
+
+            #  Abandoned, the blocked shard listers do not keep us alive
+            from threading import enumerate as threads
+            r = self.client.iter_objects_sharded(
+                page_size=2, workers=2, buffered_pages=1)
+            self.assertEqual(r.next()['name'], names[0])
+            sleep(0.1)
+            listers = [t for t in threads() if (
+                isinstance(t, pithos.SilentEvent) and t.is_alive())]
+            self.assertTrue(listers)
+            self.assertTrue(all([t.daemon for t in listers]))
+            r.close()
+
+        with patch.object(
+                pithos.PithosClient, 'container_get',
+                side_effect=ClientError('Not found', status=404)):
+            r = self.client.iter_objects_sharded(prefixes=['a'])
+            self.assertRaises(ClientError, list, r)
+
+        #  Each shard request carries its own prefix
+        prefixes, sent = ['p%02d/' % i for i in range(32)], []
+
+        def request(client, path, **kwargs):
+            params = dict(client.params)
+            client.params.clear()
+            sleep(0.001)
+            sent.append(params.get('prefix'))
+            r = FR()
+            r.json = [dict(name='%so' % params.get('prefix', ''))]
+            r.status_code = 200
+            return r
+
+        with patch.object(
+                pithos.PithosClient, 'get', autospec=True,
+                side_effect=request):
+            r = self.client.iter_objects_sharded(
+                prefixes=prefixes, workers=8, page_size=5)
+            self.assertEqual(
+                [o['name'] for o in r], ['%so' % p for p in prefixes])
+        self.assertEqual(sorted(sent), prefixes)
+
+    def test_iter_containers(self):
+        names = ['c%s' % i for i in range(7)]
+        with patch.object(
+                pithos.PithosClient, 'account_get',
+                side_effect=self._pages(names)) as get:
+            r = self.client.iter_containers(page_size=3)
+            self.assertEqual([c['name'] for c in r], names)
+            self.assertEqual(len(get.mock_calls), 3)
+            self.assertEqual(self.client.headers, {})
+            self.assertEqual(self.client.params, {})
+
     @patch('%s.get_container_info' % pithos_pkg, return_value=container_info)
     @patch('%s.container_post' % pithos_pkg, return_value=FR())
     @patch('%s.object_put' % pithos_pkg, return_value=FR())
@@ -965,6 +1266,158 @@ class PithosClient(TestCase):
         self.assertEqual(OP.mock_calls[-1][2]['if_etag_not_match'], '*')
         self.assertEqual(OP.mock_calls[-1][2]['etag'], etag)
 
+    def test__calculate_blocks_for_upload(self):
+        num_of_blocks = 5
+        tmpFile = self._create_temp_file(num_of_blocks)
+        tmpFile.seek(0, 2)
+        tmpFile.write(urandom(1000))
+        tmpFile.flush()
+        blocksize = container_info['x-container-block-size']
+        size = num_of_blocks * blocksize + 1000
+        tmpFile.seek(0)
+        exp_hashes = [pithos._pithos_hash(tmpFile.read(blocksize), 'sha256')
+                      for i in range(1 + num_of_blocks)]
+
+        for processes in (1, 2, 4):
+            self.client.HASH_PROCESSES = processes
+            progress = []
+
+            def hash_gen(n):
+                for i in range(n + 1):
+                    progress.append(i)
+                    yield
+
+            tmpFile.seek(0)
+            hashes, hmap = [], {}
+            self.client._calculate_blocks_for_upload(
+                blocksize, 'sha256', size, 1 + num_of_blocks, hashes, hmap,
+                tmpFile, hash_cb=hash_gen)
+            self.assertEqual(hashes, exp_hashes)
+            self.assertEqual(hmap[hashes[-1]], (size - 1000, 1000))
+            self.assertEqual(hmap[hashes[1]], (blocksize, blocksize))
+            self.assertEqual(len(progress), 2 + num_of_blocks)
+
+        #  With a hash cache, hash once and then read the cache
+        from tempfile import mkdtemp
+        from shutil import rmtree
+        cache_dir = mkdtemp()
+        self.client.HASH_PROCESSES = 1
+        try:
+            self.client.hash_cache = pithos.BlockHashCache(cache_dir)
+            for i in range(2):
+                tmpFile.seek(0)
+                hashes, hmap = [], {}
+                with patch.object(
+                        pithos, '_pithos_hash',
+                        wraps=pithos._pithos_hash) as PH:
+                    self.client._calculate_blocks_for_upload(
+                        blocksize, 'sha256', size, 1 + num_of_blocks,
+                        hashes, hmap, tmpFile)
+                self.assertEqual(hashes, exp_hashes)
+                self.assertEqual(hmap[hashes[-1]], (size - 1000, 1000))
+                self.assertEqual(len(PH.mock_calls), 0 if i else len(hashes))
+                self.assertEqual(tmpFile.tell(), size)
+        finally:
+            rmtree(cache_dir)
+
+        #  Blocks in holes of sparse files are hashed without reading them
+        blocksize = 65536
+        sparse = NamedTemporaryFile()
+        sparse.seek(blocksize)
+        sparse.write(urandom(blocksize))
+        sparse.truncate(3 * blocksize + 100)
+        sparse.flush()
+        sparse.seek(0)
+        exp_hashes = [pithos._pithos_hash(sparse.read(blocksize), 'sha256')
+                      for i in range(4)]
+        sparse.seek(0)
+        holes = pithos._hole_blocks(sparse, blocksize, 3 * blocksize + 100)
+        hashes, hmap = [], {}
+        with patch.object(
+                pithos, '_pithos_hash', wraps=pithos._pithos_hash) as PH:
+            self.client._calculate_blocks_for_upload(
+                blocksize, 'sha256', 3 * blocksize + 100, 4, hashes, hmap,
+                sparse)
+        self.assertEqual(hashes, exp_hashes)
+        self.assertEqual(len(PH.mock_calls), 4 - len(holes))
+        self.assertEqual(sparse.tell(), 3 * blocksize + 100)
+
+    @patch('%s.get_container_info' % pithos_pkg, return_value=container_info)
+    @patch('%s._put_block' % pithos_pkg)
+    @patch('%s.object_put' % pithos_pkg, return_value=FR())
+    def test_upload_object_pipelined(self, OP, PB, GCI):
+        num_of_blocks = 4
+        tmpFile = self._create_temp_file(num_of_blocks)
+        FR.status_code = 201
+        self.client.upload_object(obj, tmpFile, pipelined=True)
+        self.assertEqual(len(OP.mock_calls), 1)
+        hashes = OP.mock_calls[-1][2]['json']['hashes']
+        self.assertEqual(len(hashes), num_of_blocks)
+        self.assertEqual(
+            sorted([c[2]['hash'] for c in PB.mock_calls]), sorted(hashes))
+
+        #  A block reported missing by the server is re-read and re-sent
+        tmpFile.seek(0)
+        FR.status_code, FR.json = 409, hashes[1:2]
+        self.client.upload_object(obj, tmpFile, pipelined=True)
+        self.assertEqual(len(OP.mock_calls), 3)
+        self.assertEqual(len(PB.mock_calls), 2 * num_of_blocks + 1)
+        block_size = container_info['x-container-block-size']
+        tmpFile.seek(block_size)
+        kwargs = PB.mock_calls[-1][2]
+        self.assertEqual(kwargs['hash'], hashes[1])
+        self.assertEqual(str(kwargs['data']), tmpFile.read(block_size))
+
+    @patch('%s.get_container_info' % pithos_pkg, return_value=container_info)
+    @patch('%s._put_block' % pithos_pkg)
+    @patch('%s.object_put' % pithos_pkg, return_value=FR())
+    def test_upload_small_object(self, OP, PB, GCI):
+        tmpFile = self._create_temp_file(1)
+        size = container_info['x-container-block-size']
+        progress = []
+
+        def cb(n):
+            for i in range(n + 1):
+                progress.append(i)
+                yield
+
+        FR.status_code = 201
+        self.client.upload_object(
+            obj, tmpFile, hash_cb=cb, upload_cb=cb, public=True)
+        OP.assert_called_once_with(
+            obj, data=tmpFile, content_length=size, success=201, etag=None,
+            content_type='application/octet-stream',
+            if_etag_match=None, if_etag_not_match=None,
+            content_encoding=None, content_disposition=None,
+            permissions=None, public=True)
+        self.assertEqual(progress, [0, 1, 0, 1])
+        self.assertFalse(PB.mock_calls)
+
+        OP.reset_mock()
+        self.client.upload_from_string(obj, 'small', if_not_exist=True)
+        self.assertEqual(len(OP.mock_calls), 1)
+        kwargs = OP.mock_calls[0][2]
+        self.assertEqual(kwargs['data'], 'small')
+        self.assertEqual(kwargs['content_length'], 5)
+        self.assertEqual(kwargs['if_etag_not_match'], '*')
+
+        #  Hashed before: the blocks are probably there, send the hashmap
+        from tempfile import mkdtemp
+        from shutil import rmtree
+        cache_dir = mkdtemp()
+        try:
+            self.client.hash_cache = pithos.BlockHashCache(cache_dir)
+            self.client.hash_cache.set(
+                tmpFile.name, size, container_info['x-container-block-hash'],
+                ['s0m3h@5h'])
+            OP.reset_mock()
+            tmpFile.seek(0)
+            self.client.upload_object(obj, tmpFile)
+            self.assertEqual(len(OP.mock_calls), 1)
+            self.assertTrue(OP.mock_calls[0][2]['hashmap'])
+        finally:
+            rmtree(cache_dir)
+
     @patch('%s.get_container_info' % pithos_pkg, return_value=container_info)
     @patch('%s.container_post' % pithos_pkg, return_value=FR())
     @patch('%s.object_put' % pithos_pkg, return_value=FR())
@@ -1221,13 +1674,302 @@ class PithosClient(TestCase):
         self.client.purge_container('another-container')
         self.assertEqual(self.client.container, cont)
 
+    def test_create_directories(self):
+        with patch.object(
+                pithos.PithosClient, 'create_directory',
+                side_effect=lambda p: dict(name=p)) as CD:
+            self.client.MAX_THREADS = 3
+            r = self.client.create_directories(['d', 'd/a', 'd', 'd/b'])
+            self.assertEqual(r, dict([(p, dict(name=p)) for p in (
+                'd', 'd/a', 'd/b')]))
+            self.assertEqual(
+                sorted(CD.mock_calls), [call('d'), call('d/a'), call('d/b')])
+        with patch.object(
+                pithos.PithosClient, 'create_directory',
+                side_effect=ClientError('Forbidden', status=403)):
+            self.assertRaises(
+                ClientError, self.client.create_directories, ['d'])
+
+    def test__run_files_interrupted(self):
+        #  Blocks of the running file jobs are dropped, so they fail fast
+        from time import time
+
+        def upload(n):
+            pool = self.client.transfer_pool
+            for job in [pool.submit(sleep, 0.05) for i in range(n)]:
+                job.join()
+                if job.exception:
+                    raise job.exception
+
+        class Interrupted(list):
+            def __iter__(self):
+                yield self[0]
+                sleep(0.2)
+                raise KeyboardInterrupt()
+
+        started = time()
+        self.assertRaises(
+            KeyboardInterrupt,
+            self.client._run_files, upload, Interrupted([(50, ), (50, )]))
+        self.assertTrue(time() - started < 1)
+        self.assertEqual(self.client.file_pool.pending, 0)
+        self.assertEqual(self.client.transfer_pool.pending, 0)
+
+    def test_upload_objects(self):
+        from threading import current_thread
+        files = [self._create_temp_file(0) for i in range(6)]
+        threads = set()
+
+        def upload(obj, f, **kwargs):
+            threads.add(current_thread())
+            sleep(0.01)
+            if obj == 'fail':
+                raise ClientError('Failed', status=413)
+            return dict(obj=obj, f=f.name, kwargs=kwargs)
+
+        progress = []
+
+        def upload_cb(n):
+            for i in range(n + 1):
+                progress.append(i)
+                yield
+
+        self.client.MAX_THREADS = 3
+        sources = [(f.name, 'o%s' % i) for i, f in enumerate(files)]
+        sources[2] += (dict(content_type='text/plain'), )
+        with patch.object(
+                pithos.PithosClient, 'upload_object',
+                side_effect=upload) as UO:
+            r = self.client.upload_objects(
+                sources, upload_cb=upload_cb, public=True)
+            self.assertEqual([o['obj'] for o in r], [
+                'o%s' % i for i in range(6)])
+            self.assertEqual([o['f'] for o in r], [f.name for f in files])
+            self.assertEqual(r[2]['kwargs']['content_type'], 'text/plain')
+            for o in r:
+                self.assertTrue(o['kwargs']['public'])
+                self.assertTrue(
+                    o['kwargs']['container_info_cache'] is r[0]['kwargs'][
+                        'container_info_cache'])
+            self.assertEqual(progress, range(7))
+            self.assertTrue(1 < len(threads) <= 3)
+            self.assertFalse(current_thread() in threads)
+
+            UO.reset_mock()
+            sources = [(files[0].name, 'fail')] + [
+                (f.name, 'o%s' % i) for i, f in enumerate(files)] * 10
+            self.assertRaises(
+                ClientError, self.client.upload_objects, sources)
+            self.assertTrue(len(UO.mock_calls) < len(sources))
+
+    @patch('%s.get_container_info' % pithos_pkg, return_value=container_info)
+    @patch('%s.object_put' % pithos_pkg, return_value=FR())
+    def test_upload_objects_dedup(self, OP, GCI):
+        src = self._create_temp_file(2)
+        blocksize = container_info['x-container-block-size']
+        hashes = [pithos._pithos_hash(src.read(blocksize), 'sha256')
+                  for i in range(2)]
+        src.seek(0)
+        copies = [self._create_temp_file(0) for i in range(4)]
+        for f in copies:
+            f.write(src.read())
+            f.flush()
+            src.seek(0)
+
+        def put_block(data, hash):
+            sleep(0.01)
+            self.client.block_registry.stored(hash)
+
+        FR.status_code, FR.json = 409, hashes
+        self.client.MAX_THREADS = 4
+        self.client.block_registry = pithos.BlockRegistry()
+        with patch.object(
+                pithos.PithosClient, '_put_block',
+                side_effect=put_block) as PB:
+            self.client.upload_objects(
+                [(f.name, 'o%s' % i) for i, f in enumerate(copies)])
+            self.assertEqual(
+                sorted([c[2]['hash'] for c in PB.mock_calls]), sorted(hashes))
+            self.assertEqual(len(OP.mock_calls), 2 * len(copies))
+
+            #  Pipelined, blocks are uploaded once in the session, too
+            OP.reset_mock()
+            self.client.upload_objects(
+                [(f.name, 'p%s' % i) for i, f in enumerate(copies)],
+                pipelined=True)
+            self.assertEqual(len(PB.mock_calls), 2)
+
+            #  All files are hashed by one pool of processes
+            self.client.HASH_PROCESSES = 2
+            self.client.block_registry = pithos.BlockRegistry()
+            PB.reset_mock()
+            with patch.object(pithos, 'Pool', wraps=pithos.Pool) as P:
+                self.client.upload_objects(
+                    [(f.name, 'q%s' % i) for i, f in enumerate(copies)])
+                self.assertEqual(len([c for c in P.mock_calls if (
+                    c[0] == '')]), 1)
+            self.assertEqual(
+                sorted([c[2]['hash'] for c in PB.mock_calls]), sorted(hashes))
+
+    def test_transfer_objects(self):
+        from itertools import count, islice
+        from threading import current_thread
+        threads, calls = set(), []
+
+        def transfer(src_container, src, dst_container, dst, **kwargs):
+            threads.add(current_thread())
+            sleep(0.01)
+            calls.append((src_container, src, dst_container, dst, kwargs))
+            if src == 'o3':
+                raise ClientError('Failed', status=409)
+
+        self.client.MAX_THREADS = 3
+        pairs = [('o%s' % i, 'd%s' % i) for i in range(8)]
+        with patch.object(
+                pithos.PithosClient, 'copy_object',
+                side_effect=transfer) as CO:
+            r = list(self.client.transfer_objects(
+                'src', pairs, source_account='acc', public=True))
+            self.assertEqual([(s, d) for s, d, e in r], pairs)
+            self.assertEqual([s for s, d, e in r if e], ['o3'])
+            self.assertEqual(r[3][2].status, 409)
+            self.assertEqual(len(CO.mock_calls), 8)
+            for c in calls:
+                self.assertEqual(c[0], 'src')
+                self.assertEqual(c[2], self.client.container)
+                self.assertEqual(c[4], dict(source_account='acc', public=True))
+            self.assertTrue(1 < len(threads) <= 3)
+            self.assertFalse(current_thread() in threads)
+
+            #  Pairs are consumed as they are needed
+            pairs = (('o%s' % i, 'd%s' % i) for i in count(10))
+            r = list(islice(self.client.transfer_objects('src', pairs), 5))
+            self.assertEqual([s for s, d, e in r], [
+                'o%s' % i for i in range(10, 15)])
+            self.assertTrue(len(CO.mock_calls) < 8 + 30)
+
+        with patch.object(
+                pithos.PithosClient, 'move_object',
+                side_effect=transfer) as MO:
+            r = list(self.client.transfer_objects(
+                'src', [('a', 'b')], move=True))
+            self.assertEqual(r, [('a', 'b', None)])
+            MO.assert_called_once_with(
+                'src', 'a', self.client.container, 'b', source_account=None)
+
+    def test_delete_objects(self):
+        from itertools import count, islice
+
+        def delete(obj, **kwargs):
+            sleep(0.01)
+            if obj == 'o3':
+                raise ClientError('Forbidden', status=403)
+
+        self.client.MAX_THREADS = 3
+        with patch.object(
+                pithos.PithosClient, 'object_delete',
+                side_effect=delete) as OD:
+            objects = ['o%s' % i for i in range(8)]
+            r = list(self.client.delete_objects(objects, until='now'))
+            self.assertEqual([o for o, e in r], objects)
+            self.assertEqual([o for o, e in r if e], ['o3'])
+            self.assertEqual(r[3][1].status, 403)
+            self.assertEqual(sorted(OD.mock_calls), sorted([call(
+                o, until='now', success=(204, 404)) for o in objects]))
+
+            #  Objects are consumed as they are needed
+            OD.reset_mock()
+            objects = ('o%s' % i for i in count(10))
+            r = list(islice(self.client.delete_objects(objects), 5))
+            self.assertEqual([o for o, e in r], [
+                'o%s' % i for i in range(10, 15)])
+            self.assertTrue(len(OD.mock_calls) < 30)
+
+    def test_download_objects(self):
+        from tempfile import mkdtemp
+        from shutil import rmtree
+        tmpdir = mkdtemp()
+        self.client.MAX_THREADS = 3
+
+        def download(obj, dst, **kwargs):
+            sleep(0.01)
+            if obj == 'fail':
+                raise ClientError('Failed', status=404)
+            dst.write(obj)
+
+        class Stream(object):
+            status_code = 200
+            closed = False
+
+            def iter_content(self):
+                for chunk in ('sm', 'all'):
+                    yield chunk
+
+            def close(self):
+                self.closed = True
+
+        stream = Stream()
+        try:
+            targets = [
+                ('o%s' % i, path.join(tmpdir, 'f%s' % i), False)
+                for i in range(5)]
+            targets.append(('small', path.join(tmpdir, 'small'), False, 5))
+            progress = []
+
+            def download_cb(n):
+                for i in range(n + 1):
+                    progress.append(i)
+                    yield
+
+            with patch.object(
+                    pithos.PithosClient, 'download_object',
+                    side_effect=download) as DO:
+                with patch.object(
+                        pithos.PithosClient, 'object_get',
+                        return_value=stream) as get:
+                    r = self.client.download_objects(
+                        targets, download_cb=download_cb, version='v1')
+                    self.assertEqual(r, [t[1] for t in targets])
+                    for i in range(5):
+                        with open(targets[i][1]) as f:
+                            self.assertEqual(f.read(), 'o%s' % i)
+                    with open(targets[-1][1]) as f:
+                        self.assertEqual(f.read(), 'small')
+                    self.assertEqual(len(DO.mock_calls), 5)
+                    for c in DO.mock_calls:
+                        self.assertEqual(c[2]['version'], 'v1')
+                    get.assert_called_once_with(
+                        'small', version='v1',
+                        if_etag_match=None, if_etag_not_match=None,
+                        if_modified_since=None, if_unmodified_since=None,
+                        success=(200, 304, 412), stream=True)
+                    self.assertTrue(stream.closed)
+                    self.assertEqual(progress, range(7))
+
+                    #  A range forces the hashmap path on small objects, too
+                    DO.reset_mock()
+                    self.client.download_objects(
+                        targets[-1:], range_str='0-1')
+                    self.assertEqual(len(DO.mock_calls), 1)
+
+                    DO.reset_mock()
+                    targets = [('fail', path.join(tmpdir, 'fail'), False)] + [
+                        ('o%s' % i, path.join(tmpdir, 'f%s' % i), False)
+                        for i in range(5)] * 10
+                    self.assertRaises(
+                        ClientError, self.client.download_objects, targets)
+                    self.assertTrue(len(DO.mock_calls) < len(targets))
+        finally:
+            rmtree(tmpdir)
+
     @patch('%s.object_put' % pithos_pkg, return_value=FR())
     def test_upload_object_unchunked(self, put):
         num_of_blocks = 8
         tmpFile = self._create_temp_file(num_of_blocks)
         expected = dict(
                 success=201,
-                data=num_of_blocks * 4 * 1024 * 1024,
+                data=tmpFile,
+                content_length=None,
                 etag='some-etag',
                 content_encoding='some content_encoding',
                 content_type='some content-type',
@@ -1242,17 +1984,16 @@ class PithosClient(TestCase):
             sorted(expected.keys()))
         kwargs = dict(expected)
         kwargs.pop('success')
-        kwargs['size'] = kwargs.pop('data')
+        kwargs.pop('data')
+        kwargs['size'] = expected['content_length'] = 1024
+        kwargs.pop('content_length')
         kwargs['sharing'] = kwargs.pop('permissions')
         tmpFile.seek(0)
         r = self.client.upload_object_unchunked(obj, tmpFile, **kwargs)
         self.assert_dicts_are_equal(r, FR.headers)
         pmc = put.mock_calls[-1][2]
         for k, v in expected.items():
-            if k == 'data':
-                self.assertEqual(len(pmc[k]), v)
-            else:
-                self.assertEqual(pmc[k], v)
+            self.assertEqual(pmc[k], v)
         self.assertRaises(
             ClientError,
             self.client.upload_object_unchunked,
@@ -1397,6 +2138,124 @@ class PithosClient(TestCase):
             else:
                 self.assertEqual(GET.mock_calls[-1][2][k], v)
 
+    @patch('%s.object_get' % pithos_pkg)
+    def test_download_object_sparse(self, GET):
+        zero = pithos._zero_hash('sha256')
+        GET.return_value = _Block('abcd')
+        hashmap = dict(
+            block_hash='sha256', block_size=4, bytes=16,
+            hashes=['a' * 64, zero, 'b' * 64, zero])
+        tmpFile = NamedTemporaryFile()
+        with patch.object(
+                pithos.PithosClient, 'get_object_hashmap',
+                return_value=hashmap):
+            self.client.download_object(obj, tmpFile)
+        ranges = sorted(
+            c[2]['async_headers']['Range'] for c in GET.mock_calls)
+        self.assertEqual(ranges, ['bytes=0-3', 'bytes=8-11'])
+        tmpFile.seek(0)
+        self.assertEqual(
+            tmpFile.read(), 'abcd' + '\x00' * 4 + 'abcd' + '\x00' * 4)
+
+        #  Without resume, old data where the object has zeros are zeroed
+        tmpFile.seek(0)
+        tmpFile.write('x' * 20)
+        tmpFile.flush()
+        tmpFile.seek(0)
+        with patch.object(
+                pithos.PithosClient, 'get_object_hashmap',
+                return_value=hashmap):
+            self.client.download_object(obj, tmpFile)
+        tmpFile.seek(0)
+        self.assertEqual(
+            tmpFile.read(), 'abcd' + '\x00' * 4 + 'abcd' + '\x00' * 4)
+
+    @patch('%s.get_object_hashmap' % pithos_pkg, return_value=object_hashmap)
+    def test_download_object_in_order(self, GOH):
+
+        class Pipe(object):
+            data = ''
+
+            def isatty(self):
+                return False
+
+            def tell(self):
+                raise IOError(29, 'Illegal seek')
+
+            def write(self, data):
+                self.data += data
+
+            def flush(self):
+                pass
+
+        block_size = object_hashmap['block_size']
+        num_of_blocks = len(object_hashmap['hashes'])
+        with patch.object(
+                pithos.PithosClient, 'object_get',
+                side_effect=_get_block_by_range) as GET:
+            dst = Pipe()
+            self.client.download_object(obj, dst)
+            self.assertEqual(len(GET.mock_calls), num_of_blocks)
+            self.assertEqual(dst.data, ''.join(
+                ['%s,' % (i * block_size) for i in range(num_of_blocks)]))
+
+            dst = Pipe()
+            self.client.download_object(
+                obj, dst, range_str='%s-%s' % (block_size + 1, block_size + 9))
+            self.assertEqual(len(GET.mock_calls), num_of_blocks + 1)
+            self.assertEqual(
+                GET.mock_calls[-1][2]['data_range'],
+                'bytes=%s-%s' % (block_size + 1, block_size + 9))
+            self.assertEqual(dst.data, '%s,' % (block_size + 1))
+
+    @patch('%s.get_object_hashmap' % pithos_pkg, return_value=object_hashmap)
+    @patch('%s.object_get' % pithos_pkg, side_effect=_get_block_by_range)
+    def test_iter_object_blocks(self, GET, GOH):
+        block_size = object_hashmap['block_size']
+        num_of_blocks = len(object_hashmap['hashes'])
+        expected = ['%s,' % (i * block_size) for i in range(num_of_blocks)]
+        for prefetch in (None, 1, 3, 2 * num_of_blocks):
+            r = self.client.iter_object_blocks(obj, prefetch=prefetch)
+            self.assertEqual(list(r), expected)
+
+        #  Blocks not consumed yet are not all downloaded
+        GET.reset_mock()
+        r = self.client.iter_object_blocks(obj, prefetch=2)
+        self.assertEqual(r.next(), expected[0])
+        self.assertTrue(len(GET.mock_calls) <= 3)
+        r.close()
+
+    @patch('%s.get_object_hashmap' % pithos_pkg, return_value=dict(
+        block_hash='sha256', block_size=4, bytes=14, hashes=['h'] * 4))
+    def test_download_to_buffer(self, GOH):
+        streams = []
+
+        def get_stream(obj, data_range=None, stream=False, **kwargs):
+            self.assertTrue(stream)
+            start, end = data_range[len('bytes='):].split('-')
+            streams.append(_Stream(start * (int(end) - int(start) + 1)))
+            return streams[-1]
+
+        expected = '0000444488881212'[:14]
+        with patch.object(
+                pithos.PithosClient, 'object_get', side_effect=get_stream):
+            buf = bytearray(20)
+            self.assertEqual(self.client.download_to_buffer(obj, buf), 14)
+            self.assertEqual(str(buf[:14]), expected)
+            self.assertEqual(len(streams), 4)
+            self.assertTrue(all([s.closed for s in streams]))
+            buf = bytearray(13)
+            self.assertRaises(
+                ClientError, self.client.download_to_buffer, obj, buf)
+
+        #  Ranges are copied in order
+        with patch.object(
+                pithos.PithosClient, 'object_get',
+                side_effect=_get_block_by_range):
+            buf = bytearray(10)
+            r = self.client.download_to_buffer(obj, buf, range_str='2-9')
+            self.assertEqual(str(buf[:r]), '2,4,8,')
+
     def test_get_object_hashmap(self):
         FR.json = object_hashmap
         for empty in (304, 412):
@@ -1691,44 +2550,61 @@ class PithosClient(TestCase):
         SOS.assert_called_once_with(obj)
 
     @patch('%s.get_container_info' % pithos_pkg, return_value=container_info)
+    @patch('%s.del_object' % pithos_pkg)
     @patch('%s.object_post' % pithos_pkg, return_value=FR())
-    def test_append_object(self, post, GCI):
-        num_of_blocks = 4
-        tmpFile = self._create_temp_file(num_of_blocks)
-        tmpFile.seek(0, 2)
-        file_size = tmpFile.tell()
-        for turn in range(2):
-            tmpFile.seek(0, 0)
-
-            try:
-                from progress.bar import ShadyBar
-                apn_bar = ShadyBar('Mock append')
-            except ImportError:
-                apn_bar = None
-
-            if apn_bar:
-
-                def append_gen(n):
-                    for i in apn_bar.iter(range(n)):
-                        yield
-                    yield
+    @patch('%s.upload_object' % pithos_pkg)
+    def test_append_object(self, UO, post, DO, GCI):
+        #  Up to a block: data are sent as they are
+        FR.headers = dict(etag='3t4g')
+        small = NamedTemporaryFile()
+        small.write('some data')
+        small.flush()
+        small.seek(0)
+        r = self.client.append_object(obj, small)
+        self.assertEqual(r, [FR.headers])
+        self.assertFalse(UO.mock_calls or DO.mock_calls)
+        post.assert_called_once_with(
+            obj,
+            update=True,
+            content_type='application/octet-stream',
+            content_length=9,
+            content_range='bytes */*',
+            source_version=None,
+            data='some data')
+
+        #  More data: through a temporary object
+        post.reset_mock()
+        tmpFile = self._create_temp_file(4)
+        r = self.client.append_object(obj, tmpFile, upload_cb='cb')
+        self.assertEqual(r, [FR.headers])
+        tmp = UO.mock_calls[0][1][0]
+        self.assertTrue(tmp.startswith('%s.' % obj))
+        UO.assert_called_once_with(
+            tmp, tmpFile,
+            size=None, upload_cb='cb',
+            container_info_cache={self.client.container: container_info})
+        post.assert_called_once_with(
+            obj,
+            update=True,
+            content_range='bytes */*',
+            content_type='application/octet-stream',
+            source_object='/%s/%s' % (self.client.container, tmp),
+            source_version=None)
+        DO.assert_called_once_with(tmp)
 
-            else:
-                append_gen = None
+        #  The temporary object is removed on errors, too
+        UO.reset_mock()
+        post.side_effect = ClientError('Failed', status=409)
+        self.assertRaises(
+            ClientError, self.client.append_object, obj, tmpFile)
+        DO.assert_called_with(UO.mock_calls[0][1][0])
+        self.assertNotEqual(UO.mock_calls[0][1][0], tmp)
 
-            self.client.append_object(
-                obj, tmpFile,
-                upload_cb=append_gen if turn else None)
-            self.assertEqual((turn + 1) * num_of_blocks, len(post.mock_calls))
-            (args, kwargs) = post.mock_calls[-1][1:3]
-            self.assertEqual(kwargs['obj'], obj)
-            self.assertEqual(kwargs['content_length'], len(kwargs['data']))
-            fsize = num_of_blocks * int(kwargs['content_length'])
-            self.assertEqual(fsize, file_size)
-            self.assertEqual(kwargs['content_range'], 'bytes */*')
-            exp = 'application/octet-stream'
-            self.assertEqual(kwargs['content_type'], exp)
-            self.assertEqual(kwargs['update'], True)
+        #  Nothing to append
+        UO.reset_mock()
+        self.assertEqual(
+            self.client.append_object(obj, self._create_temp_file(0)), [])
+        self.assertFalse(UO.mock_calls)
 
     @patch('%s.object_post' % pithos_pkg, return_value=FR())
     def test_truncate_object(self, post):
@@ -1743,57 +2619,127 @@ class PithosClient(TestCase):
             source_object='/%s/%s' % (self.client.container, obj))
 
     @patch('%s.get_container_info' % pithos_pkg, return_value=container_info)
+    @patch('%s.del_object' % pithos_pkg)
     @patch('%s.object_post' % pithos_pkg, return_value=FR())
-    def test_overwrite_object(self, post, GCI):
+    @patch('%s.upload_object' % pithos_pkg)
+    def test_overwrite_object(self, UO, post, DO, GCI):
         num_of_blocks = 4
         tmpFile = self._create_temp_file(num_of_blocks)
-        tmpFile.seek(0, 2)
-        file_size = tmpFile.tell()
+        file_size = num_of_blocks * container_info['x-container-block-size']
+        block_size = container_info['x-container-block-size']
         info = dict(object_info)
         info['content-length'] = file_size
-        block_size = container_info['x-container-block-size']
+        FR.headers = dict(etag='3t4g')
         with patch.object(
                 pithos.PithosClient, 'get_object_info',
                 return_value=info) as GOI:
-            for start, end in (
-                    (0, file_size + 1),
-                    (file_size + 1, file_size + 2)):
-                tmpFile.seek(0, 0)
-                self.assertRaises(
-                    ClientError,
-                    self.client.overwrite_object,
-                    obj, start, end, tmpFile)
-            for start, end in ((0, 144), (144, 233), (233, file_size)):
-                tmpFile.seek(0, 0)
-                owr_gen = None
-                exp_size = end - start + 1
-                if not start or exp_size > block_size:
-                    try:
-                        from progress.bar import ShadyBar
-                        owr_bar = ShadyBar('Mock append')
-                    except ImportError:
-                        owr_bar = None
-
-                    if owr_bar:
-
-                        def owr_gen(n):
-                            for i in owr_bar.iter(range(n)):
-                                yield
-                            yield
-
-                    if exp_size > block_size:
-                        exp_size = exp_size % block_size or block_size
-
-                self.client.overwrite_object(obj, start, end, tmpFile, owr_gen)
-                self.assertEqual(GOI.mock_calls[-1], call(obj))
-                self.assertEqual(GCI.mock_calls[-1], call())
-                (args, kwargs) = post.mock_calls[-1][1:3]
-                self.assertEqual(args, (obj,))
-                self.assertEqual(len(kwargs['data']), exp_size)
-                self.assertEqual(kwargs['content_length'], exp_size)
-                self.assertEqual(kwargs['update'], True)
-                exp = 'application/octet-stream'
-                self.assertEqual(kwargs['content_type'], exp)
+            tmpFile.seek(0)
+            self.assertRaises(
+                AssertionError,
+                self.client.overwrite_object,
+                obj, file_size + 1, file_size + 2, tmpFile)
+
+            #  Within the first block: data are sent as they are
+            tmpFile.seek(0)
+            r = self.client.overwrite_object(obj, 144, 233, tmpFile)
+            self.assertEqual(GOI.mock_calls[-1], call(obj, version=None))
+            self.assertEqual(r, [FR.headers])
+            self.assertFalse(UO.mock_calls)
+            tmpFile.seek(0)
+            post.assert_called_once_with(
+                obj,
+                update=True,
+                content_type='application/octet-stream',
+                content_length=90,
+                content_range='bytes 144-233/*',
+                source_version=None,
+                data=tmpFile.read(90))
+
+            #  Up to the block boundary as is, the rest through a staged
+            #  object, so only the blocks missing from the server are sent
+            post.reset_mock()
+            tmpFile.seek(0)
+            end = 2 * block_size + 99
+            r = self.client.overwrite_object(
+                obj, 144, end, tmpFile, upload_cb='cb')
+            self.assertEqual(r, [FR.headers, FR.headers])
+            head = post.mock_calls[0][2]
+            self.assertEqual(
+                head['content_range'], 'bytes 144-%s/*' % (block_size - 1))
+            self.assertEqual(len(head['data']), block_size - 144)
+            tmp = UO.mock_calls[0][1][0]
+            UO.assert_called_once_with(
+                tmp, tmpFile,
+                size=end - block_size + 1,
+                upload_cb='cb',
+                container_info_cache={
+                    self.client.container: container_info})
+            self.assertEqual(post.mock_calls[1], call(
+                obj,
+                update=True,
+                content_range='bytes %s-%s/*' % (block_size, end),
+                content_type='application/octet-stream',
+                source_object='/%s/%s' % (self.client.container, tmp),
+                source_version=None))
+            DO.assert_called_once_with(tmp)
+
+            #  Up to a block, across a block boundary: a single request
+            post.reset_mock()
+            UO.reset_mock()
+            tmpFile.seek(0)
+            self.client.overwrite_object(
+                obj, block_size - 10, 2 * block_size - 11, tmpFile,
+                source_version='v1')
+            self.assertFalse(UO.mock_calls)
+            self.assertEqual(len(post.mock_calls), 1)
+            self.assertEqual(post.mock_calls[0][2]['content_range'], (
+                'bytes %s-%s/*' % (block_size - 10, 2 * block_size - 11)))
+            self.assertEqual(post.mock_calls[0][2]['source_version'], 'v1')
+
+            #  Both updates are made against source_version
+            post.reset_mock()
+            tmpFile.seek(0)
+            self.client.overwrite_object(
+                obj, 144, end, tmpFile, source_version='v1')
+            self.assertEqual(
+                [c[2]['source_version'] for c in post.mock_calls],
+                ['v1', 'v1'])
+            self.assertEqual(GOI.mock_calls[-1], call(obj, version='v1'))
+
+            #  Aligned: no data are sent as they are
+            post.reset_mock()
+            UO.reset_mock()
+            tmpFile.seek(0)
+            self.client.overwrite_object(obj, 0, file_size - 1, tmpFile)
+            self.assertEqual(len(post.mock_calls), 1)
+            self.assertEqual(UO.mock_calls[0][2]['size'], file_size)
+
+    @patch('%s.del_object' % pithos_pkg)
+    @patch('%s.object_put' % pithos_pkg, return_value=FR())
+    @patch('%s.object_post' % pithos_pkg, return_value=FR())
+    @patch('%s._put_block' % pithos_pkg)
+    def test_overwrite_object_unaligned(self, PB, post, put, DO):
+        #  The staged upload starts in the middle of the source file
+        data = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ' * 4
+        tmpFile = NamedTemporaryFile()
+        tmpFile.write(data)
+        tmpFile.flush()
+        tmpFile.seek(0)
+        info = dict(container_info)
+        info['x-container-block-size'] = 16
+        self.client.SMALL_OBJECT_SIZE = 16
+        with patch.object(
+                pithos.PithosClient, 'get_object_info',
+                return_value={'content-length': 1000}), patch.object(
+                pithos.PithosClient, 'get_container_info',
+                return_value=info), patch.object(
+                pithos.PithosClient, '_create_object_or_get_missing_hashes',
+                side_effect=lambda obj, json, **kw: (json['hashes'], None)):
+            self.client.overwrite_object(obj, 4, 4 + len(data) - 1, tmpFile)
+        self.assertEqual(post.mock_calls[0][2]['data'], data[:12])
+        self.assertEqual(
+            sorted(str(c[2]['data']) for c in PB.mock_calls),
+            sorted(data[i:i + 16] for i in range(12, len(data), 16)))
 
     @patch('%s.set_param' % pithos_pkg)
     @patch('%s.get' % pithos_pkg, return_value=FR())
@@ -1839,5 +2785,8 @@ if __name__ == '__main__':
     if not argv[1:] or argv[1] == 'PithosMethods':
         not_found = False
         runTestCase(PithosRestClient, 'Pithos Methods', argv[2:])
+    if not argv[1:] or argv[1] == 'BlockRegistry':
+        not_found = False
+        runTestCase(BlockRegistry, 'Block Registry', argv[2:])
     if not_found:
         print('TestCase %s not found' % argv[1])
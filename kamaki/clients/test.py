@@ -46,8 +46,10 @@ from kamaki.clients.cyclades.test import CycladesClient, CycladesNetworkClient
 from kamaki.clients.cyclades.test import CycladesRestClient
 from kamaki.clients.image.test import ImageClient
 from kamaki.clients.storage.test import StorageClient
+from kamaki.clients.asynchronous.test import AsyncClient
 from kamaki.clients.pithos.test import (
-    PithosClient, PithosRestClient, PithosMethods)
+    PithosClient, PithosRestClient, PithosMethods, BlockHashCache,
+    BlockRegistry)
 
 
 class ClientError(TestCase):
@@ -125,14 +127,117 @@ class RequestManager(TestCase):
 
     @patch('httplib.HTTPConnection.getresponse')
     @patch('httplib.HTTPConnection.request')
-    def test_perform(self, request, getresponse):
+    @patch('httplib.HTTPConnection.connect')
+    def test_perform(self, connect, request, getresponse):
         from httplib import HTTPConnection
-        self.RM('GET', 'http://example.com', '/').perform(
-            HTTPConnection('http', 'example.com'))
+        conn = HTTPConnection('http', 'example.com')
+        self.RM('GET', 'http://example.com', '/', connect_timeout=3).perform(
+            conn)
+        connect.assert_called_once_with()
+        self.assertEqual(conn.timeout, 3)
         expected = dict(body=None, headers={}, url='/', method='GET')
         request.assert_called_once_with(**expected)
         getresponse.assert_called_once_with()
 
+    def test_perform_timeouts(self):
+        from httplib import HTTPConnection
+        from socket import timeout
+        from kamaki.clients import (
+            ConnectTimeout, ReadTimeout, RequestTimeout, ClientTimeout)
+        conn = HTTPConnection('example.com')
+        req = self.RM('GET', 'http://example.com', '/')
+        with patch.object(HTTPConnection, 'connect', side_effect=timeout()):
+            self.assertRaises(ConnectTimeout, req.perform, conn)
+        with patch.object(HTTPConnection, 'connect'):
+            with patch.object(
+                    HTTPConnection, 'request', side_effect=timeout()):
+                self.assertRaises(ReadTimeout, req.perform, conn)
+            req = self.RM('GET', 'http://example.com', '/', total_timeout=0.01)
+            with patch.object(
+                    HTTPConnection, 'request',
+                    side_effect=lambda **kwargs: sleep(0.02)):
+                with patch.object(HTTPConnection, 'getresponse') as GR:
+                    self.assertRaises(RequestTimeout, req.perform, conn)
+                    self.assertFalse(GR.mock_calls)
+        for err in (ConnectTimeout, ReadTimeout, RequestTimeout):
+            self.assertTrue(issubclass(err, ClientTimeout))
+
+    def test_iter_body(self):
+        from StringIO import StringIO
+        body = 'x' * 10 + 'y' * 10
+        req = self.RM('PUT', 'http://example.com', '/', data=body)
+        self.assertEqual(list(req.iter_body()), [body])
+        self.assertEqual(req.data_size, 20)
+        req = self.RM(
+            'PUT', 'http://example.com', '/', data=iter(['ab', 'cd']))
+        self.assertEqual(list(req.iter_body()), ['ab', 'cd'])
+        self.assertEqual(req.data_size, None)
+        f = StringIO(body)
+        f.seek(5)
+        req = self.RM(
+            'PUT', 'http://example.com', '/', data=f,
+            headers={'Content-Length': '12'})
+        req.CHUNK_SIZE = 8
+        self.assertEqual(req.data_size, 15)
+        for i in range(2):
+            #  A retried request is sent from the same position
+            self.assertEqual(list(req.iter_body()), [body[5:13], body[13:17]])
+
+    @patch('httplib.HTTPConnection.getresponse')
+    @patch('httplib.HTTPConnection.connect')
+    def test_send_streamed(self, connect, getresponse):
+        from httplib import HTTPConnection
+        from tempfile import TemporaryFile
+        sent = []
+        conn = HTTPConnection('example.com')
+        conn.send = lambda data: sent.append(data)
+        req = self.RM(
+            'PUT', 'http://example.com', '/', data=iter(['ab', '', 'cde']),
+            headers={'Transfer-Encoding': 'chunked'})
+        req.perform(conn)
+        self.assertTrue(
+            sent[0].endswith('Transfer-Encoding: chunked\r\n\r\n'))
+        self.assertEqual(
+            ''.join(sent[1:]), '2\r\nab\r\n3\r\ncde\r\n0\r\n\r\n')
+        self.assertEqual(req.data_size, 5)
+
+        sent[:] = []
+        conn = HTTPConnection('example.com')
+        conn.send = lambda data: sent.append(data)
+        f = TemporaryFile()
+        f.write('some file contents')
+        f.seek(5)
+        req = self.RM(
+            'PUT', 'http://example.com', '/', data=f,
+            headers={'Content-Length': '13'})
+        self.assertEqual(req.data_size, 13)
+        req.perform(conn)
+        self.assertTrue(sent[0].endswith('Content-Length: 13\r\n\r\n'))
+        self.assertEqual(''.join(sent[1:]), 'file contents')
+
+        #  On an empty status line, the request is resent, not the last
+        #  request objpool saw on this connection
+        from httplib import BadStatusLine
+        sent[:] = []
+        conn = HTTPConnection('example.com')
+        conn.send = lambda data: sent.append(data)
+        conn._request_args = ('DELETE', '/other')
+        connect.reset_mock()
+        getresponse.side_effect = [BadStatusLine(''), 'response']
+        self.assertEqual(req.perform(conn), 'response')
+        self.assertEqual(
+            [d for d in sent if not d.startswith('PUT')],
+            ['file contents', 'file contents'])
+        self.assertEqual(len(connect.mock_calls), 2)
+
+        #  Bodies that cannot be rewound are not resent
+        conn.close()
+        getresponse.side_effect = [BadStatusLine(''), 'response']
+        req = self.RM(
+            'PUT', 'http://example.com', '/', data=iter(['ab']),
+            headers={'Transfer-Encoding': 'chunked'})
+        self.assertRaises(BadStatusLine, req.perform, conn)
+
 
 class FakeResp(object):
 
@@ -141,6 +246,7 @@ class FakeResp(object):
     reason = 'some reason'
     status = 42
     status_code = 200
+    content = READ
 
     def read(self):
         return self.READ
@@ -210,6 +316,203 @@ class ResponseManager(TestCase):
         self.assertEqual(self.RM.headers, FakeResp.HEADERS)
         perform.assert_called_only_once
 
+    def _stream(self, body, chunked=False, missing=0):
+        from socket import socket, socketpair
+        from httplib import HTTPResponse
+        sock, peer = socketpair()
+        sock = socket(_sock=sock)
+        if chunked:
+            head = 'Transfer-Encoding: chunked\r\n\r\n'
+            body = '%x\r\n%s\r\n0\r\n\r\n' % (len(body), body)
+        else:
+            head = 'Content-Length: %s\r\n\r\n' % (len(body) + missing)
+        peer.sendall('HTTP/1.1 200 OK\r\n%s%s' % (head, body))
+        if missing:
+            peer.close()
+        r = HTTPResponse(sock)
+        r.begin()
+        self.addCleanup(sock.close)
+        self.addCleanup(peer.close)
+        return r
+
+    def test_readinto(self):
+        from kamaki.clients import ResponseManager, RequestManager
+        body = 'some streamed body'
+        for chunked in (False, True):
+            RM = ResponseManager(
+                RequestManager('GET', 'http://ok', '/'), stream=True)
+            with patch(
+                    'kamaki.clients.RequestManager.perform',
+                    return_value=self._stream(body, chunked)):
+                self.assertEqual(RM.status_code, 200)
+            self.assertTrue(RM._stream)
+            buf = bytearray(len(body) + 2)
+            view, n = memoryview(buf), 0
+            for size in (5, 100):
+                n += RM.readinto(view[n:n + size])
+            self.assertEqual(n, len(body))
+            self.assertEqual(str(buf[:n]), body)
+            self.assertEqual(RM._stream, None)
+            self.assertEqual(RM.readinto(buf), 0)
+
+        #  A body cut short by the server
+        from kamaki.clients import ClientError
+        RM = ResponseManager(
+            RequestManager('GET', 'http://ok', '/'), stream=True)
+        with patch(
+                'kamaki.clients.RequestManager.perform',
+                return_value=self._stream(body, missing=10)):
+            self.assertEqual(RM.status_code, 200)
+        self.assertEqual(RM.readinto(buf), len(body))
+        self.assertRaises(ClientError, RM.readinto, buf)
+        self.assertEqual(RM._stream, None)
+
+    def test_stream_record(self):
+        from kamaki.clients import Client
+        body = 'some streamed body'
+        client = Client('http://ok', 'token')
+        with patch(
+                'kamaki.clients.RequestManager.perform',
+                return_value=self._stream(body)):
+            with patch.object(client.concurrency, 'record') as record:
+                r = client.get('/', success=200, stream=True)
+                self.assertFalse(record.called)
+                self.assertEqual(''.join(r.iter_content(5)), body)
+                self.assertEqual(record.call_args[0][0], len(body))
+                self.assertEqual(record.call_args[0][2], 200)
+                r.close()
+                self.assertEqual(len(record.mock_calls), 1)
+
+    def test_iter_content(self):
+        from kamaki.clients import ResponseManager, RequestManager
+        body = 'some streamed body'
+        RM = ResponseManager(
+            RequestManager('GET', 'http://ok', '/'), stream=True)
+        with patch(
+                'kamaki.clients.RequestManager.perform',
+                return_value=self._stream(body)):
+            self.assertEqual(list(RM.iter_content(10)), [body[:10], body[10:]])
+        self.assertEqual(RM._stream, None)
+        RM = ResponseManager(
+            RequestManager('GET', 'http://ok', '/'), stream=True)
+        with patch(
+                'kamaki.clients.RequestManager.perform',
+                return_value=self._stream(body)):
+            self.assertEqual(RM.content, body)
+        self.assertEqual(RM._stream, None)
+        with patch('kamaki.clients.RequestManager.perform',
+                   return_value=FakeResp()):
+            self.assertEqual(list(self.RM.iter_content()), [FakeResp.READ])
+            buf = bytearray(4)
+            self.assertEqual(self.RM.readinto(buf), 4)
+            self.assertEqual(str(buf), FakeResp.READ[:4])
+
+    @patch('kamaki.clients.RequestManager.perform', return_value=FakeResp())
+    def test_json_cache(self, perform):
+        from json import dumps
+        FakeResp.READ = dumps(FakeResp.HEADERS)
+        with patch('kamaki.clients.loads', return_value='decoded') as loads:
+            self.assertEqual(self.RM.json, 'decoded')
+            self.assertEqual(self.RM.json, 'decoded')
+            loads.assert_called_once_with(FakeResp.READ)
+
+    def test_iter_json(self):
+        from kamaki.clients import ResponseManager, RequestManager, ClientError
+        from json import dumps
+        items = [dict(name='o%s' % i, bytes=i) for i in range(100)]
+        RM = ResponseManager(
+            RequestManager('GET', 'http://ok', '/'), stream=True)
+        with patch(
+                'kamaki.clients.RequestManager.perform',
+                return_value=self._stream(dumps(items))):
+            r = RM.iter_json(chunk_size=10)
+            self.assertEqual(r.next(), items[0])
+            self.assertTrue(RM._stream)
+            self.assertEqual(list(r), items[1:])
+        self.assertEqual(RM._stream, None)
+        with patch('kamaki.clients.RequestManager.perform',
+                   return_value=FakeResp()):
+            self.assertRaises(ClientError, list, self.RM.iter_json())
+
+    def test_close(self):
+        from kamaki.clients import ResponseManager, RequestManager
+        RM = ResponseManager(
+            RequestManager('GET', 'http://ok', '/'), stream=True)
+        with patch(
+                'kamaki.clients.RequestManager.perform',
+                return_value=self._stream('unread body')):
+            RM.status_code
+        r, connection, pooled = RM._stream
+        with patch.object(connection, 'close') as close:
+            with patch.object(pooled, 'release') as release:
+                RM.close()
+                close.assert_called_once_with()
+                release.assert_called_once_with()
+        self.assertEqual(RM._stream, None)
+
+
+class ConnectionPools(TestCase):
+
+    def setUp(self):
+        from kamaki.clients import ConnectionPools
+        self.pools = ConnectionPools()
+
+    def test_get(self):
+        pool = self.pools.get('https', 'www.example.com')
+        self.assertEqual(pool.size, self.pools.MIN_SIZE)
+        self.assertEqual(self.pools.get('https', 'www.example.com', 2), pool)
+        self.assertEqual(pool.size, self.pools.MIN_SIZE)
+        size = self.pools.MIN_SIZE + 5
+        self.assertEqual(
+            self.pools.get('https', 'www.example.com', size), pool)
+        self.assertEqual(pool.size, size)
+        self.assertNotEqual(self.pools.get('http', 'www.example.com'), pool)
+        self.assertEqual(
+            self.pools.stats()[('https', 'www.example.com')],
+            dict(size=size, idle=0, created=0, hits=0, misses=0))
+
+    def test_prewarm(self):
+        from socket import socketpair
+        from httplib import HTTPConnection
+        peers, timeouts = [], []
+
+        class Connection(HTTPConnection):
+            def connect(self):
+                timeouts.append(self.timeout)
+                self.sock, peer = socketpair()
+                peers.append(peer)
+
+        pool = self.pools.get('http', 'www.example.com')
+        pool.connection_class = Connection
+        self.assertEqual(pool.prewarm(3, timeout=2.5), 3)
+        self.assertEqual(timeouts, [2.5] * 3)
+        self.assertEqual((pool.created, pool.idle), (3, 3))
+        conns = [pool.pool_get() for i in range(4)]
+        self.assertEqual((pool.hits, pool.misses, pool.created), (3, 1, 4))
+        self.assertEqual(pool.idle, 0)
+
+        #  Connections in use are not exceeded
+        self.assertEqual(pool.prewarm(5), 0)
+        conns[3].connect()
+        for conn in conns:
+            pool.pool_put(conn)
+        self.assertEqual(pool.idle, 4)
+        self.assertEqual(pool.prewarm(3), 0)
+        self.assertEqual(pool.created, 4)
+
+        #  Connections closed by the server are not idle, or reused
+        peers[0].close()
+        self.assertEqual(pool.idle, 3)
+        conns = [pool.pool_get() for i in range(4)]
+        self.assertEqual((pool.hits, pool.misses, pool.created), (6, 2, 5))
+        for conn in conns:
+            pool.pool_put(conn)
+        self.assertEqual(pool.idle, 3)
+        for conn in conns:
+            conn.close()
+        for peer in peers:
+            peer.close()
+
 
 class SilentEvent(TestCase):
 
@@ -265,11 +568,173 @@ class SilentEvent(TestCase):
                 self.assertFalse(t.exception)
 
 
+class TransferPool(TestCase):
+
+    def setUp(self):
+        from kamaki.clients import TransferPool
+        self.pool = TransferPool(2)
+
+    def tearDown(self):
+        self.pool.cancel()
+
+    def test_size(self):
+        self.assertEqual(self.pool.size, 2)
+        self.pool.size = 5
+        self.assertEqual(self.pool.size, 5)
+        for faulty in (-1, 0, 0.5, 'a string', {}):
+            self.assertRaises(
+                AssertionError, setattr, self.pool, 'size', faulty)
+        self.assertEqual(self.pool.size, 5)
+
+    def test_submit(self):
+        jobs = [self.pool.submit(lambda x, y: x + y, i, y=i) for i in range(9)]
+        for i, job in enumerate(jobs):
+            job.join()
+            self.assertFalse(job.isAlive())
+            self.assertFalse(job.exception)
+            self.assertEqual(job.value, 2 * i)
+        self.assertTrue(len(self.pool._workers) <= self.pool.size)
+
+        def fail():
+            raise Exception('Some exception')
+
+        job = self.pool.submit(fail)
+        job.join()
+        self.assertTrue(isinstance(job.exception, Exception))
+        self.assertEqual(job.value, None)
+
+    def test_bounded(self):
+        from threading import Event
+        release, running = Event(), []
+
+        def block(i):
+            running.append(i)
+            release.wait(4)
+
+        jobs = [self.pool.submit(block, i) for i in range(4)]
+        sleep(0.3)
+        self.assertEqual(self.pool.pending, 4)
+        self.assertTrue(len(running) <= 2)
+        release.set()
+        self.pool.join()
+        self.assertEqual(self.pool.pending, 0)
+        self.assertEqual(sorted(running), range(4))
+        self.assertFalse([job for job in jobs if job.isAlive()])
+
+    def test_grow(self):
+        from threading import Event
+        release, running = Event(), []
+
+        def block(i):
+            running.append(i)
+            release.wait(4)
+
+        jobs = [self.pool.submit(block, i) for i in range(4)]
+        sleep(0.3)
+        self.assertEqual(len(running), 2)
+        self.pool.size = 4
+        sleep(0.3)
+        self.assertEqual(len(running), 4)
+        self.assertEqual(len(self.pool._workers), 4)
+        release.set()
+        self.pool.join()
+        self.assertFalse([job for job in jobs if job.isAlive()])
+
+    def test_cancel(self):
+        from threading import Event
+        release = Event()
+        jobs = [self.pool.submit(release.wait, 4) for i in range(4)]
+        sleep(0.3)
+        release.set()
+        self.pool.cancel()
+        self.assertEqual(self.pool.pending, 0)
+        self.assertFalse([job for job in jobs if job.isAlive()])
+
+    def test_drop(self):
+        from threading import Event
+        from kamaki.clients import ClientError
+        release = Event()
+        jobs = [self.pool.submit(release.wait, 4) for i in range(4)]
+        sleep(0.3)
+        self.pool.drop()
+        self.assertEqual(self.pool.pending, 2)
+        self.assertEqual(len([job for job in jobs if job.isAlive()]), 2)
+        self.assertTrue(isinstance(jobs[-1].exception, ClientError))
+        release.set()
+        self.pool.join()
+        self.assertFalse([job for job in jobs if job.isAlive()])
+
+
+class AdaptiveConcurrency(TestCase):
+
+    def setUp(self):
+        from kamaki.clients import AdaptiveConcurrency
+        self.now = 1000.0
+        self.clock = patch('kamaki.clients.time', side_effect=self._time)
+        self.clock.start()
+        self.control = AdaptiveConcurrency(8)
+
+    def tearDown(self):
+        self.clock.stop()
+
+    def _time(self):
+        return self.now
+
+    def _epoch(self, nbytes=1000, elapsed=0.01, status=200):
+        for i in range(self.control.window):
+            self.now += elapsed
+            self.control.record(nbytes, elapsed, status)
+
+    def test_window(self):
+        from kamaki.clients import AdaptiveConcurrency
+        self.assertEqual(AdaptiveConcurrency(8, initial=4).window, 4)
+        self.assertEqual(AdaptiveConcurrency(2, initial=4).window, 2)
+        self.assertEqual(self.control.window, 1)
+        for exp in (2, 4, 8, 8):
+            self._epoch()
+            self.assertEqual(self.control.window, exp)
+        self.control.maximum = 3
+        self.assertEqual(self.control.window, 3)
+        self.control.maximum = 8
+        self.assertEqual(self.control.requests, 15)
+        self.assertEqual(self.control.bytes, 15000)
+
+    def test_overload(self):
+        for i in range(3):
+            self._epoch()
+        self.assertEqual(self.control.window, 8)
+        for status in (503, 503, 0):
+            self.control.record(0, 0.01, status)
+        self.assertEqual(self.control.window, 4)
+        self.assertEqual(self.control.errors, 3)
+        #  After congestion, the window grows additively
+        self._epoch()
+        self.assertEqual(self.control.window, 5)
+        self.now += 0.02
+        self.control.record(0, 0.01, 502)
+        self.assertEqual(self.control.window, 2)
+        self.control.record(0, 0.01, 0)
+        self.assertEqual(self.control.window, 2)
+
+    def test_throughput(self):
+        self._epoch()
+        self.assertEqual(self.control.window, 2)
+        self.control.throughput = 1e12
+        self._epoch()
+        self.assertEqual(self.control.window, 1)
+        self._epoch()
+        self.assertEqual(self.control.window, 2)
+        self._epoch()
+        self.assertEqual(self.control.window, 3)
+
+
 class FR(object):
     json = None
     text = None
     headers = dict()
     content = json
+    data = None
+    data_size = 0
     status = None
     status_code = 200
 
@@ -305,49 +770,41 @@ class Client(TestCase):
         DATE_FORMATS = ['%a %b %d %H:%M:%S %Y']
         self.assertEqual(self.client.DATE_FORMATS, DATE_FORMATS)
 
-    def test__init_thread_limit(self):
-        exp = 'Nothing set here'
-        for faulty in (-1, 0.5, 'a string', {}):
-            self.assertRaises(
-                AssertionError,
-                self.client._init_thread_limit,
-                faulty)
-            self.assertEqual(exp, getattr(self.client, '_thread_limit', exp))
-            self.assertEqual(exp, getattr(self.client, '_elapsed_old', exp))
-            self.assertEqual(exp, getattr(self.client, '_elapsed_new', exp))
-        self.client._init_thread_limit(42)
-        self.assertEqual(42, self.client._thread_limit)
-        self.assertEqual(0.0, self.client._elapsed_old)
-        self.assertEqual(0.0, self.client._elapsed_new)
-
-    def test__watch_thread_limit(self):
-        waits = (
-            dict(args=((0.1, 1), (0.1, 2), (0.2, 1), (0.7, 1), (0.3, 2))),
-            dict(args=((1.0 - (i / 10.0), (i + 1)) for i in range(7))),
-            dict(max=1, args=tuple([(randint(1, 10) / 3.0, 1), ] * 10)),
-            dict(
-                limit=5,
-                args=tuple([
-                    (1.0 + (i / 10.0), (5 - i - 1)) for i in range(4)] + [
-                    (2.0, 1), (1.9, 2), (2.0, 1), (2.0, 2)])),
-            dict(args=tuple(
-                [(1.0 - (i / 10.0), (i + 1)) for i in range(7)] + [
-                (0.1, 7), (0.2, 6), (0.4, 5), (0.3, 6), (0.2, 7), (0.1, 7)])),)
-        for wait_dict in waits:
-            if 'max' in wait_dict:
-                self.client.MAX_THREADS = wait_dict['max']
-            else:
-                self.client.MAX_THREADS = 7
-            if 'limit' in wait_dict:
-                self.client._init_thread_limit(wait_dict['limit'])
-            else:
-                self.client._init_thread_limit()
-                self.client._watch_thread_limit(list())
-                self.assertEqual(1, self.client._thread_limit)
-            for wait, exp_limit in wait_dict['args']:
-                self.client._elapsed_new = wait
-                self.client._watch_thread_limit(list())
-                self.assertEqual(exp_limit, self.client._thread_limit)
+    def test_transfer_pool(self):
+        from kamaki.clients import TransferPool
+        pool = self.client.transfer_pool
+        self.assertTrue(isinstance(pool, TransferPool))
+        self.assertEqual(pool.size, 1)
+        self.client.MAX_THREADS = 7
+        for i in range(3):
+            self.client.concurrency.record(1000, 0.1, 200)
+        self.assertEqual(self.client.transfer_pool, pool)
+        self.assertEqual(pool.size, self.client.concurrency.window)
+        self.assertEqual(pool.size, 4)
+
+    def test_async_run(self):
+        self.client.MAX_THREADS = 3
+        r = self.client.async_run(
+            lambda x, y: x * y, [dict(x=i, y=i) for i in range(10)])
+        self.assertEqual(sorted(r), [i * i for i in range(10)])
+
+        def fail(x):
+            raise self.CE('Failed %s' % x)
+
+        self.assertRaises(
+            self.CE, self.client.async_run, fail, [dict(x=1), dict(x=2)])
+
+    def test_concurrency(self):
+        from kamaki.clients import AdaptiveConcurrency
+        self.client.MAX_THREADS = 4
+        control = self.client.concurrency
+        self.assertTrue(isinstance(control, AdaptiveConcurrency))
+        self.assertEqual(control.maximum, 4)
+        self.assertEqual(
+            control.window, min(4, self.client.INITIAL_CONCURRENCY))
+        self.client.MAX_THREADS = 2
+        self.assertEqual(self.client.concurrency, control)
+        self.assertEqual(control.maximum, 2)
 
     def test__raise_for_status(self):
         r = FR()
@@ -412,7 +869,7 @@ class Client(TestCase):
             self.client.request(method, path, **kwargs)
             self.assertEqual(
                 RespInit.mock_calls[-1],
-                call(FR, connection_retry_limit=0, poolsize=None))
+                call(FR, connection_retry_limit=0, poolsize=1, stream=False))
 
     @patch('kamaki.clients.Client.request', return_value='lala')
     def _test_foo(self, foo, request):
@@ -31,6 +31,12 @@
 # interpreted as representing official policies, either expressed
 # or implied, of GRNET S.A.
 
+from itertools import chain
+from json import JSONDecoder
+from os import fstat
+from stat import S_ISREG
+from mmap import mmap, ACCESS_READ
+
 
 def _matches(val1, val2, exactMath=True):
     """Case Insensitive match"""
@@ -95,13 +101,79 @@ def path4url(*args):
 def readall(openfile, size, retries=7):
     """Read a file until size is reached"""
     remains = size if size > 0 else 0
-    buf = ''
+    chunks = []
     for i in range(retries):
         tmp_buf = openfile.read(remains)
         if tmp_buf:
-            buf += tmp_buf
+            chunks.append(tmp_buf)
             remains -= len(tmp_buf)
             if remains > 0:
                 continue
-        return buf
+        return chunks[0] if len(chunks) == 1 else ''.join(chunks)
     raise IOError('Failed to read %s bytes from file' % size)
+
+
+def memory_map(openfile):
+    """Map a file in memory, read-only. Slice it with buffer(map, start, size)
+    to access blocks without copying them
+
+    :param openfile: an open file descriptor
+
+    :returns: (mmap) or None, if the file cannot be mapped (e.g., it is empty
+        or not a regular file)
+    """
+    try:
+        fd = openfile.fileno()
+        st = fstat(fd)
+        if S_ISREG(st.st_mode) and st.st_size:
+            return mmap(fd, 0, access=ACCESS_READ)
+    except (AttributeError, EnvironmentError, ValueError, OverflowError):
+        pass
+    return None
+
+
+def iter_json_list(chunks):
+    """Decode a json list incrementally, as its text arrives in chunks
+
+    :param chunks: iterator of str, e.g., the chunks of a streamed response
+
+    :returns: (generator) the list elements, each decoded as soon as it is
+        complete
+
+    :raises ValueError: if the text is not a json list
+    """
+    decoder, text, pos, state = JSONDecoder(), '', 0, 'start'
+    for chunk in chain(chunks, [None]):
+        last = chunk is None
+        text, pos = text[pos:] + (chunk or ''), 0
+        while True:
+            while pos < len(text) and text[pos] in ' \t\n\r':
+                pos += 1
+            if pos == len(text):
+                break
+            c = text[pos]
+            if state == 'start':
+                if c != '[':
+                    raise ValueError('Expecting a json list')
+                pos, state = pos + 1, 'first'
+            elif state in ('first', 'next') and c == ']':
+                pos, state = pos + 1, 'end'
+            elif state == 'next':
+                if c != ',':
+                    raise ValueError('Expecting , or ] in json list')
+                pos, state = pos + 1, 'value'
+            elif state in ('first', 'value'):
+                try:
+                    value, end = decoder.raw_decode(text, pos)
+                except ValueError:
+                    if last:
+                        raise
+                    break
+                if end == len(text) and not last:
+                    break  # e.g., a number may go on in the next chunk
+                pos, state = end, 'next'
+                yield value
+            else:
+                raise ValueError('Extra data after json list')
+    if state != 'end':
+        raise ValueError('Incomplete json list')
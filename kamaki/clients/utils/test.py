@@ -140,6 +140,36 @@ class Utils(TestCase):
             self.assertEqual(utils.readall(f, 1), '')
             self.assertRaises(IOError, utils.readall, f, 1, 0)
 
+    def test_memory_map(self):
+        tstr = '1234567890'
+        with TemporaryFile() as f:
+            self.assertEqual(utils.memory_map(f), None)
+            f.write(tstr)
+            f.flush()
+            m = utils.memory_map(f)
+            self.assertEqual(len(m), len(tstr))
+            self.assertEqual(str(buffer(m, 3, 4)), tstr[3:7])
+            self.assertEqual(str(buffer(m, 8, 4)), tstr[8:])
+            m.close()
+        self.assertEqual(utils.memory_map(object()), None)
+
+    def test_iter_json_list(self):
+        from json import dumps
+        items = [
+            dict(name='o1', bytes=12), 'a string, with ] and [', 123456,
+            [1, [2, 3]], None, dict(name=u'\u03c9', hash='x' * 10)]
+        text = ' %s ' % dumps(items)
+        for size in (1, 3, 7, len(text)):
+            chunks = [text[i:i + size] for i in range(0, len(text), size)]
+            self.assertEqual(list(utils.iter_json_list(chunks)), items)
+        self.assertEqual(list(utils.iter_json_list(['[', ' ]'])), [])
+        r = utils.iter_json_list(['[{"a": 1}, ', '{"b"'])
+        self.assertEqual(r.next(), dict(a=1))
+        self.assertRaises(ValueError, r.next)
+        for text in ('{"a": 1}', '[1, 2', '[1 2]', '[1], 2', ''):
+            self.assertRaises(
+                ValueError, list, utils.iter_json_list([text]))
+
 if __name__ == '__main__':
     from sys import argv
     from kamaki.clients.test import runTestCase
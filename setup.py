@@ -39,7 +39,7 @@ from sys import version_info
 import kamaki
 
 
-optional = ['ansicolors', 'mock>=1.0.1']
+optional = ['ansicolors', 'mock>=1.0.1', 'trollius']
 
 requires = ['objpool>=0.2', 'progress>=1.1', 'astakosclient>=0.14.10']
 
@@ -69,6 +69,7 @@ setup(
         'kamaki.cli.command_tree',
         'kamaki.clients',
         'kamaki.clients.utils',
+        'kamaki.clients.asynchronous',
         'kamaki.clients.astakos',
         'kamaki.clients.image',
         'kamaki.clients.storage',